@@ -3,10 +3,13 @@ import numpy as np
 import cv2
 import os
 import glob
+import json
 import logging
 from pathlib import Path
 import esim_torch
 
+import tracing
+
 
 class EventGenerator:
     def __init__(self, base_dir="output/upsampled_rgb", output_base_dir="output/events", device="cuda:0"):
@@ -27,6 +30,28 @@ class EventGenerator:
         images = np.stack([cv2.imread(f, cv2.IMREAD_GRAYSCALE) for f in image_files])
         return images
 
+    def _load_store(self, store_dir):
+        """Frame RGB (in scala di grigi) e timestamp di uno store di kubric.sequence_store, letti via mmap."""
+        with open(store_dir / "store.json") as f:
+            info = json.load(f)
+        layer = next((l for l in ("rgb", "rgba") if l in info["layers"]), None)
+        if layer is None:
+            raise FileNotFoundError(f"Nessun layer rgb/rgba nello store {store_dir}")
+        frames = np.load(store_dir / f"{layer}.npy", mmap_mode="r")
+        if frames.dtype != np.uint8:
+            scale = 255 / 65535 if frames.dtype == np.uint16 else 255
+            frames = np.clip(np.asarray(frames[..., :3], dtype="float32") * scale, 0, 255).astype("uint8")
+        images = np.stack([cv2.cvtColor(np.ascontiguousarray(f[..., :3]), cv2.COLOR_RGB2GRAY) for f in frames])
+        logging.info(f"Caricati {len(images)} frame dallo store {store_dir}")
+
+        timestamp_file = store_dir / "timestamps.txt"
+        if timestamp_file.exists():
+            return images, self._load_timestamps(timestamp_file)
+        if not info.get("fps"):
+            raise FileNotFoundError(f"Né timestamps.txt né fps nello store {store_dir}")
+        timestamps_ns = (np.arange(len(images)) / info["fps"] * 1e9).astype("int64")
+        return images, timestamps_ns
+
     def _load_timestamps(self, timestamp_file):
         if not os.path.exists(timestamp_file):
             raise FileNotFoundError(f"File timestamps non trovato: {timestamp_file}")
@@ -44,19 +69,25 @@ class EventGenerator:
         timestamp_file = seq_dir / "timestamps.txt"
         output_file = self.output_base_dir / f"{seq_name}.npz"
         
+        is_store = (seq_dir / "store.json").exists()  # frame e fps letti dallo store
+
         # Check if required files exist
-        if not image_dir.exists():
+        if not is_store and not image_dir.exists():
             logging.warning(f"⚠️ Directory immagini non trovata per {seq_name}: {image_dir}")
             return False
             
-        if not timestamp_file.exists():
+        if not is_store and not timestamp_file.exists():
             logging.warning(f"⚠️ File timestamps non trovato per {seq_name}: {timestamp_file}")
             return False
 
         try:
             # Load images and timestamps
-            images = self._load_images(image_dir)
-            timestamps_ns = self._load_timestamps(timestamp_file)
+            with tracing.span("event_load"):
+                if is_store:
+                    images, timestamps_ns = self._load_store(seq_dir)
+                else:
+                    images = self._load_images(image_dir)
+                    timestamps_ns = self._load_timestamps(timestamp_file)
             
             # Validate dimensions
             if len(images) != len(timestamps_ns):
@@ -70,16 +101,15 @@ class EventGenerator:
             log_images = torch.from_numpy(log_images).to(self.device)
             timestamps_ns = torch.from_numpy(timestamps_ns).to(self.device)
 
-            # Generate events
-            events = self.esim.forward(log_images, timestamps_ns)
+            # Generate events (copied to the cpu here, so that the span includes the asynchronous gpu work)
+            with tracing.span("event_simulation"):
+                events = self.esim.forward(log_images, timestamps_ns)
+                events = {key: events[key].cpu().numpy() for key in ("x", "y", "t", "p")}
 
             # Save events
-            os.makedirs(os.path.dirname(output_file), exist_ok=True)
-            np.savez_compressed(output_file,
-                                x=events['x'].cpu().numpy(),
-                                y=events['y'].cpu().numpy(),
-                                t=events['t'].cpu().numpy(),
-                                p=events['p'].cpu().numpy())
+            with tracing.span("event_save"):
+                os.makedirs(os.path.dirname(output_file), exist_ok=True)
+                np.savez_compressed(output_file, **events)
 
             logging.info(f"✅ Eventi salvati per {seq_name} in {output_file}")
             return True
@@ -0,0 +1,241 @@
+import argparse
+import glob
+import html
+import json
+import logging
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import natsort
+import numpy as np
+
+
+def iter_npz_chunks(npz_path, keys=("x", "y", "t", "p"), chunk_size=1 << 20):
+    """Reads the arrays of an .npz file in chunks of chunk_size events, without loading them entirely."""
+    with zipfile.ZipFile(npz_path) as zf:
+        streams, dtypes, lengths = [], [], []
+        try:
+            for key in keys:
+                f = zf.open(key + ".npy")
+                streams.append(f)
+                version = np.lib.format.read_magic(f)
+                if version == (1, 0):
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+                else:
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+                assert len(shape) == 1, f"{key} in {npz_path} is not a 1D array"
+                dtypes.append(dtype)
+                lengths.append(shape[0])
+            if len(set(lengths)) != 1:
+                raise ValueError(f"Arrays {keys} in {npz_path} have different lengths {lengths}")
+
+            remaining = lengths[0]
+            while remaining > 0:
+                n = min(chunk_size, remaining)
+                yield [np.frombuffer(f.read(n * dtype.itemsize), dtype=dtype, count=n)
+                       for f, dtype in zip(streams, dtypes)]
+                remaining -= n
+        finally:
+            for f in streams:
+                f.close()
+
+
+class SequenceStats:
+    """Accumulates the statistics of one event stream, one chunk at a time."""
+    def __init__(self, bin_us):
+        self.bin_us = bin_us
+        self.num_events = 0
+        self.num_positive = 0
+        self.t_first = None
+        self.t_last = None
+        self.unsorted = False
+        self.rate_hist = np.zeros(0, dtype=np.int64)
+        self.counts = np.zeros((2, 0, 0), dtype=np.int64)  # negative, positive
+
+    def _grow_counts(self, height, width):
+        _, h, w = self.counts.shape
+        if height > h or width > w:
+            self.counts = np.pad(self.counts, ((0, 0), (0, max(0, height - h)), (0, max(0, width - w))))
+
+    def update(self, x, y, t, p, t_scale):
+        if len(t) == 0:
+            return
+        t = t.astype(np.float64) * t_scale  # microseconds
+        if self.t_first is None:
+            self.t_first = t[0]
+        if np.any(np.diff(t) < 0) or (self.t_last is not None and t[0] < self.t_last):
+            self.unsorted = True
+        self.t_last = t[-1]
+
+        pos = p > 0
+        self.num_events += len(t)
+        self.num_positive += int(pos.sum())
+
+        # event rate over time, fixed bins starting at the first event
+        bins = ((t - self.t_first) // self.bin_us).astype(np.int64)
+        bins = np.clip(bins, 0, None)
+        hist = np.bincount(bins)
+        if len(hist) > len(self.rate_hist):
+            self.rate_hist = np.pad(self.rate_hist, (0, len(hist) - len(self.rate_hist)))
+        self.rate_hist[:len(hist)] += hist
+
+        # per pixel counts, per polarity
+        x = x.astype(np.int64)
+        y = y.astype(np.int64)
+        self._grow_counts(int(y.max()) + 1, int(x.max()) + 1)
+        _, h, w = self.counts.shape
+        idx = pos.astype(np.int64) * (h * w) + y * w + x
+        self.counts += np.bincount(idx, minlength=2 * h * w).reshape(2, h, w)
+
+    def summary(self, hot_sigma, min_events, max_hot_fraction, top_k):
+        total = self.counts.sum(0)
+        duration_s = 0.0 if self.t_first is None else (self.t_last - self.t_first) / 1e6
+        active = total[total > 0]
+
+        hot_pixels = []
+        hot_events = 0
+        if len(active) > 1:
+            threshold = active.mean() + hot_sigma * active.std()
+            ys, xs = np.nonzero(total > threshold)
+            order = np.argsort(-total[ys, xs])
+            hot_events = int(total[ys, xs].sum())
+            hot_pixels = [dict(x=int(xs[i]), y=int(ys[i]), count=int(total[ys[i], xs[i]])) for i in order[:top_k]]
+
+        rate = self.rate_hist / (self.bin_us / 1e6)
+        positive_fraction = self.num_positive / self.num_events if self.num_events else 0.0
+
+        flags = []
+        if self.num_events == 0:
+            flags.append("empty")
+        elif self.num_events < min_events:
+            flags.append("too_few_events")
+        if self.num_events > 0 and positive_fraction in (0.0, 1.0):
+            flags.append("single_polarity")
+        if self.num_events > 0 and duration_s == 0:
+            flags.append("zero_duration")
+        if self.unsorted:
+            flags.append("unsorted_timestamps")
+        if self.num_events > 0 and hot_events / self.num_events > max_hot_fraction:
+            flags.append("hot_pixels")
+        if len(self.rate_hist) > 2 and np.any(self.rate_hist[1:-1] == 0):
+            flags.append("gaps")
+
+        return dict(
+            num_events=self.num_events,
+            duration_s=duration_s,
+            mean_rate_ev_s=self.num_events / duration_s if duration_s > 0 else 0.0,
+            max_rate_ev_s=float(rate.max()) if len(rate) else 0.0,
+            positive_fraction=positive_fraction,
+            resolution=[int(self.counts.shape[1]), int(self.counts.shape[2])],
+            active_pixel_fraction=float(len(active) / total.size) if total.size else 0.0,
+            hot_pixels=hot_pixels,
+            hot_event_fraction=hot_events / self.num_events if self.num_events else 0.0,
+            rate_hist_bin_ms=self.bin_us / 1e3,
+            rate_hist=self.rate_hist.tolist(),
+            flags=flags,
+        )
+
+
+def save_rate_map(counts, path):
+    """Per pixel event count map, log scaled and colored."""
+    total = counts.sum(0).astype(np.float64)
+    if total.size == 0:
+        return None
+    img = np.log1p(total)
+    img = (255 * img / max(img.max(), 1e-9)).astype(np.uint8)
+    cv2.imwrite(path, cv2.applyColorMap(img, cv2.COLORMAP_INFERNO))
+    return path
+
+
+def analyze_file(npz_path, args):
+    name = os.path.splitext(os.path.basename(npz_path))[0]
+    stats = SequenceStats(bin_us=args.bin_ms * 1e3)
+    try:
+        for x, y, t, p in iter_npz_chunks(npz_path, chunk_size=args.chunk_size):
+            stats.update(x, y, t, p, t_scale=args.t_scale)
+    except Exception as e:
+        logging.error(f"❌ Errore durante la lettura di {npz_path}: {e}")
+        return dict(name=name, path=npz_path, flags=["unreadable"], error=str(e))
+
+    result = dict(name=name, path=npz_path, **stats.summary(args.hot_sigma, args.min_events,
+                                                            args.max_hot_fraction, args.top_k))
+    rate_map = save_rate_map(stats.counts, os.path.join(args.report_dir, "rate_maps", name + ".png"))
+    result["rate_map"] = None if rate_map is None else os.path.relpath(rate_map, args.report_dir)
+    return result
+
+
+def _sparkline(values, width=300, height=40):
+    if not values or max(values) == 0:
+        return ""
+    step = width / len(values)
+    peak = max(values)
+    bars = "".join(
+        f'<rect x="{i * step:.2f}" y="{height - height * v / peak:.2f}" width="{max(step, 1):.2f}" '
+        f'height="{height * v / peak:.2f}"/>' for i, v in enumerate(values) if v > 0)
+    return f'<svg width="{width}" height="{height}" fill="#4477aa">{bars}</svg>'
+
+
+def write_html(results, path):
+    rows = []
+    for r in results:
+        flags = ", ".join(r["flags"])
+        style = ' style="background:#fdd"' if r["flags"] else ""
+        if "error" in r:
+            rows.append(f'<tr{style}><td>{html.escape(r["name"])}</td><td colspan="7">{html.escape(r["error"])}</td>'
+                        f'<td>{flags}</td></tr>')
+            continue
+        rate_map = f'<img src="{html.escape(r["rate_map"])}" height="64">' if r["rate_map"] else ""
+        rows.append(
+            f'<tr{style}><td>{html.escape(r["name"])}</td><td>{r["num_events"]}</td><td>{r["duration_s"]:.3f}</td>'
+            f'<td>{r["mean_rate_ev_s"]:.3g}</td><td>{r["positive_fraction"]:.2f}</td>'
+            f'<td>{len(r["hot_pixels"])}</td><td>{_sparkline(r["rate_hist"])}</td><td>{rate_map}</td>'
+            f'<td>{flags}</td></tr>')
+
+    num_flagged = sum(1 for r in results if r["flags"])
+    with open(path, "w") as f:
+        f.write(
+            '<!DOCTYPE html><html><head><meta charset="utf-8"><title>Event stats</title>'
+            '<style>body{font-family:sans-serif}td,th{padding:2px 8px;border-bottom:1px solid #ccc}</style>'
+            f'</head><body><h2>Event stats: {len(results)} sequences, {num_flagged} flagged</h2><table>'
+            '<tr><th>sequence</th><th>events</th><th>duration [s]</th><th>rate [ev/s]</th><th>positive</th>'
+            '<th>hot pixels</th><th>rate over time</th><th>rate map</th><th>flags</th></tr>'
+            + "".join(rows) + '</table></body></html>')
+
+
+def main():
+    parser = argparse.ArgumentParser("Compute statistics and a quality report of generated event streams")
+    parser.add_argument("--input_dir", default="output/events")
+    parser.add_argument("--report_dir", default="output/event_stats")
+    parser.add_argument("--num_workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunk_size", type=int, default=1 << 20, help="Eventi letti per volta")
+    parser.add_argument("--t_scale", type=float, default=1e-3, help="Fattore per convertire t in microsecondi (default: t in ns)")
+    parser.add_argument("--bin_ms", type=float, default=10.0, help="Larghezza dei bin dell'istogramma del rate")
+    parser.add_argument("--hot_sigma", type=float, default=5.0, help="Soglia hot pixel in deviazioni standard")
+    parser.add_argument("--max_hot_fraction", type=float, default=0.1, help="Frazione massima di eventi da hot pixel")
+    parser.add_argument("--min_events", type=int, default=1000)
+    parser.add_argument("--top_k", type=int, default=20, help="Numero di hot pixel riportati")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    event_files = natsort.natsorted(glob.glob(os.path.join(args.input_dir, "*.npz")))
+    logging.info(f"📁 Trovati {len(event_files)} file di eventi in {args.input_dir}")
+    os.makedirs(os.path.join(args.report_dir, "rate_maps"), exist_ok=True)
+
+    with ProcessPoolExecutor(max_workers=args.num_workers) as executor:
+        results = list(executor.map(analyze_file, event_files, [args] * len(event_files)))
+
+    with open(os.path.join(args.report_dir, "event_stats.json"), "w") as f:
+        json.dump(results, f, indent=2)
+    write_html(results, os.path.join(args.report_dir, "report.html"))
+
+    for r in results:
+        if r["flags"]:
+            logging.warning(f"⚠️ {r['name']}: {', '.join(r['flags'])}")
+    logging.info(f"✅ Report salvato in {args.report_dir}")
+
+
+if __name__ == "__main__":
+    main()
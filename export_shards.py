@@ -0,0 +1,353 @@
+"""Packs the pipeline output into size-bounded tar shards (WebDataset layout) with an index.
+
+Every sequence becomes one sample: all of its files are stored one after the other in the same
+shard, named "<seq>.<ext>" so that WebDataset-style readers group them by the part before the
+first dot:
+
+  seq0.meta.json             sequence name, fps and number of frames of each layer
+  seq0.metadata.json         output/annotations/seq0_metadata.json
+  seq0.events.npz            output/events/seq0.npz (x, y, t, p)
+  seq0.timestamps.txt        output/upsampled_rgb/seq0/timestamps.txt (timestamps of the events' frames)
+  seq0.rgb_00000.png ...     output/<layer>/seq0/imgs/*.png for each exported layer
+  seq0.rgba.npy ...          output/store/seq0/<layer>.npy (--output_format store)
+
+Files are copied as they are (no decoding or re-encoding). A shard is closed when the next
+sequence would exceed --max_shard_mb, sequences are never split. index.json lists the shards and,
+for every sequence, its shard and the byte offset and size of each member, so that a sequence can
+also be read without scanning the shard.
+
+  python export_shards.py --output_dir output --shard_dir output/shards --max_shard_mb 1024
+
+pipeline.py runs the export at the end of every run only with "export_shards": true in its
+configuration, since the shards are a second copy of the data.
+
+Reading (e.g. in a training job):
+
+  reader = ShardReader("output/shards")
+  for key, sample in reader.iter_samples(num_parallel=4, shuffle=True):
+      sample = decode_sample(sample)  # {"rgb": (N, H, W, 3) uint8, "segmentation": (N, H, W, 1) ids, ...}
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import queue
+import random
+import re
+import tarfile
+import threading
+from pathlib import Path
+
+import cv2
+import natsort
+import numpy as np
+from PIL import Image
+
+INDEX_FILE = "index.json"
+INDEX_VERSION = 1
+DEFAULT_LAYERS = ("rgb", "segmentation")
+_BLOCK_SIZE = tarfile.BLOCKSIZE
+_FRAME_RE = re.compile(r"^(?P<layer>.+)_(?P<frame>\d+)\.png$")
+
+
+def _padded(size):
+    return -(-size // _BLOCK_SIZE) * _BLOCK_SIZE
+
+
+def _read_fps(path):
+    try:
+        return float(path.read_text().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def find_sequences(output_dir, layers=DEFAULT_LAYERS):
+    """Names of all sequences with at least one exportable file in the pipeline output."""
+    output_dir = Path(output_dir)
+    names = set()
+    names.update(p.stem for p in (output_dir / "events").glob("seq*.npz"))
+    names.update(p.name[:-len("_metadata.json")] for p in (output_dir / "annotations").glob("seq*_metadata.json"))
+    for layer_dir in [output_dir / layer for layer in layers] + [output_dir / "store"]:
+        names.update(p.name for p in layer_dir.glob("seq*") if p.is_dir())
+    return natsort.natsorted(names)
+
+
+def collect_sequence(output_dir, name, layers=DEFAULT_LAYERS):
+    """Members (member name, source file) of the sample of a sequence and its meta information."""
+    output_dir = Path(output_dir)
+    members = []
+    meta = {"sequence": name, "fps": None, "num_frames": {}}
+
+    annotations = output_dir / "annotations" / f"{name}_metadata.json"
+    if annotations.is_file():
+        members.append((f"{name}.metadata.json", annotations))
+    events = output_dir / "events" / f"{name}.npz"
+    if events.is_file():
+        members.append((f"{name}.events.npz", events))
+    timestamps = output_dir / "upsampled_rgb" / name / "timestamps.txt"
+    if timestamps.is_file():
+        members.append((f"{name}.timestamps.txt", timestamps))
+
+    for layer in layers:
+        frames = natsort.natsorted((output_dir / layer / name / "imgs").glob(f"{layer}_*.png"))
+        if frames:
+            members.extend((f"{name}.{frame.name}", frame) for frame in frames)
+            meta["num_frames"][layer] = len(frames)
+            meta["fps"] = meta["fps"] or _read_fps(output_dir / layer / name / "fps.txt")
+
+    store_dir = output_dir / "store" / name
+    if (store_dir / "store.json").is_file():
+        with open(store_dir / "store.json") as f:
+            store = json.load(f)
+        meta["fps"] = meta["fps"] or store.get("fps")
+        # rgb is stored as part of rgba
+        store_layers = set(layers) | ({"rgba"} if "rgb" in layers else set())
+        for layer in sorted(store_layers & set(store["layers"])):
+            members.append((f"{name}.{layer}.npy", store_dir / f"{layer}.npy"))
+            meta["num_frames"][layer] = store["num_frames"]
+
+    return members, meta
+
+
+class ShardWriter:
+    """Writes samples into shard-000000.tar, shard-000001.tar, ... of at most max_shard_bytes each.
+
+    A sample larger than max_shard_bytes gets a shard of its own. index.json is written by close().
+    """
+
+    def __init__(self, shard_dir, max_shard_bytes=1 << 30, prefix="shard"):
+        self.shard_dir = Path(shard_dir)
+        self.shard_dir.mkdir(parents=True, exist_ok=True)
+        # shards of a previous export are overwritten, they are only valid again with the new index
+        (self.shard_dir / INDEX_FILE).unlink(missing_ok=True)
+        self.max_shard_bytes = max_shard_bytes
+        self.prefix = prefix
+        self.shards = []
+        self.sequences = {}
+        self._tar = None
+        self._tmp_path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif self._tar is not None:  # no index for an incomplete export
+            self._tar.close()
+
+    def _close_shard(self):
+        if self._tar is None:
+            return
+        self._tar.close()
+        self._tar = None
+        shard = self.shards[-1]
+        os.replace(self._tmp_path, self.shard_dir / shard["name"])
+        shard["size"] = (self.shard_dir / shard["name"]).stat().st_size
+
+    def _open_shard(self):
+        self._close_shard()
+        name = f"{self.prefix}-{len(self.shards):06d}.tar"
+        self._tmp_path = self.shard_dir / (name + ".tmp")
+        self._tar = tarfile.open(self._tmp_path, "w", format=tarfile.GNU_FORMAT)
+        self.shards.append({"name": name, "sequences": []})
+
+    def write(self, name, members, meta=None):
+        """Adds a sample: members are (member name, source path or bytes) pairs."""
+        entries = [(f"{name}.meta.json", json.dumps(meta).encode())] if meta is not None else []
+        entries += members
+        sizes = [len(data) if isinstance(data, bytes) else Path(data).stat().st_size for _, data in entries]
+        sample_bytes = sum(_BLOCK_SIZE + _padded(size) for size in sizes)
+        if self._tar is None or (self.shards[-1]["sequences"] and
+                                 self._tar.offset + sample_bytes > self.max_shard_bytes):
+            self._open_shard()
+
+        index = {}
+        for (member_name, data), size in zip(entries, sizes):
+            info = tarfile.TarInfo(member_name)
+            info.size = size
+            info.mode = 0o644
+            if isinstance(data, bytes):
+                self._tar.addfile(info, io.BytesIO(data))
+            else:
+                with open(data, "rb") as f:
+                    self._tar.addfile(info, f)
+            # the data of a member ends (padded to the block size) where the tar file now ends
+            index[member_name[len(name) + 1:]] = [self._tar.offset - _padded(size), size]
+        self.shards[-1]["sequences"].append(name)
+        self.sequences[name] = {"shard": len(self.shards) - 1, "members": index}
+
+    def close(self):
+        self._close_shard()
+        info = {"version": INDEX_VERSION, "shards": self.shards, "sequences": self.sequences}
+        tmp_file = self.shard_dir / (INDEX_FILE + ".tmp")
+        with open(tmp_file, "w") as f:
+            json.dump(info, f, indent=2)
+        os.replace(tmp_file, self.shard_dir / INDEX_FILE)
+
+
+def export(output_dir, shard_dir, layers=DEFAULT_LAYERS, max_shard_bytes=1 << 30):
+    """Packs all sequences of the pipeline output into shards, returns the number of sequences."""
+    names = find_sequences(output_dir, layers)
+    with ShardWriter(shard_dir, max_shard_bytes=max_shard_bytes) as writer:
+        for name in names:
+            members, meta = collect_sequence(output_dir, name, layers)
+            writer.write(name, members, meta)
+            logging.info(f"📦 {name}: {len(members)} file nello shard {writer.shards[-1]['name']}")
+    logging.info(f"✅ {len(names)} sequenze esportate in {len(writer.shards)} shard in {shard_dir}")
+    return len(names)
+
+
+class ShardReader:
+    """Reads the samples of the shards written by ShardWriter.
+
+    iter_samples() streams whole shards with large sequential reads, read_sequence() reads a single
+    sequence using the offsets in index.json. Samples are {extension: bytes} dicts (see
+    decode_sample()).
+    """
+
+    def __init__(self, shard_dir):
+        self.shard_dir = Path(shard_dir)
+        with open(self.shard_dir / INDEX_FILE) as f:
+            info = json.load(f)
+        if info.get("version") != INDEX_VERSION:
+            raise ValueError(f"Versione dell'indice non supportata {info.get('version')!r} in {self.shard_dir}")
+        self.shards = [shard["name"] for shard in info["shards"]]
+        self._index = info["sequences"]
+
+    @property
+    def sequences(self):
+        return list(self._index)
+
+    def read_sequence(self, name):
+        entry = self._index[name]
+        sample = {}
+        with open(self.shard_dir / self.shards[entry["shard"]], "rb") as f:
+            for ext, (offset, size) in entry["members"].items():
+                f.seek(offset)
+                sample[ext] = f.read(size)
+        return sample
+
+    def _iter_shard(self, shard):
+        key, sample = None, {}
+        with tarfile.open(self.shard_dir / shard, "r|") as tar:
+            for info in tar:
+                if not info.isfile():
+                    continue
+                member_key, ext = info.name.split(".", 1)
+                if member_key != key and sample:
+                    yield key, sample
+                    sample = {}
+                key = member_key
+                sample[ext] = tar.extractfile(info).read()
+        if sample:
+            yield key, sample
+
+    def iter_samples(self, num_parallel=1, shuffle=False, seed=None, buffer_size=8):
+        """Yields (sequence name, sample) pairs of all shards.
+
+        With num_parallel > 1, that many shards are read concurrently by background threads and
+        their samples interleaved (in no particular order); at most buffer_size samples wait in
+        memory. shuffle randomizes the order of the shards.
+        """
+        shards = list(self.shards)
+        if shuffle:
+            random.Random(seed).shuffle(shards)
+        if num_parallel <= 1:
+            for shard in shards:
+                yield from self._iter_shard(shard)
+            return
+
+        samples = queue.Queue(maxsize=buffer_size)
+        stop = threading.Event()
+        done = object()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    samples.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def read_shards(worker_shards):
+            try:
+                for shard in worker_shards:
+                    for item in self._iter_shard(shard):
+                        if not put(item):
+                            return
+            except Exception as e:  # re-raised in the consumer
+                put(e)
+            put(done)
+
+        num_workers = min(num_parallel, len(shards))
+        threads = [threading.Thread(target=read_shards, args=(shards[i::num_workers],), daemon=True)
+                   for i in range(num_workers)]
+        for thread in threads:
+            thread.start()
+        try:
+            finished = 0
+            while finished < num_workers:
+                item = samples.get()
+                if item is done:
+                    finished += 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    yield item
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+
+def _decode_png(data):
+    with Image.open(io.BytesIO(data)) as img:
+        if img.mode == "P":
+            # png con palette (segmentazione, vedi kubric.file_io.write_palette_png): gli indici sono gli id
+            return np.array(img)[:, :, None]
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED)
+    if img.ndim == 2:
+        return img[:, :, None]
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB if img.shape[2] == 3 else cv2.COLOR_BGRA2RGBA)
+
+
+def decode_sample(sample):
+    """Decodes a sample: png frames are stacked per layer, .npy/.npz/.json/.txt are parsed."""
+    decoded, frames = {}, {}
+    for ext, data in sample.items():
+        match = _FRAME_RE.match(ext)
+        if match:
+            frames.setdefault(match["layer"], []).append((int(match["frame"]), data))
+        elif ext.endswith(".json"):
+            decoded[ext[:-len(".json")]] = json.loads(data)
+        elif ext.endswith(".npz"):
+            with np.load(io.BytesIO(data)) as npz:
+                decoded[ext[:-len(".npz")]] = {key: npz[key] for key in npz.files}
+        elif ext.endswith(".npy"):
+            decoded[ext[:-len(".npy")]] = np.load(io.BytesIO(data))
+        elif ext.endswith(".txt"):
+            decoded[ext[:-len(".txt")]] = data.decode()
+        else:
+            decoded[ext] = data
+    for layer, layer_frames in frames.items():
+        decoded[layer] = np.stack([_decode_png(data) for _, data in sorted(layer_frames, key=lambda x: x[0])])
+    return decoded
+
+
+def main():
+    parser = argparse.ArgumentParser("Pack RGB frames, events, segmentations and metadata of each sequence into tar shards")
+    parser.add_argument("--output_dir", default="output")
+    parser.add_argument("--shard_dir", default="output/shards")
+    parser.add_argument("--layers", nargs="+", default=list(DEFAULT_LAYERS), help="Layer di frame da esportare")
+    parser.add_argument("--max_shard_mb", type=float, default=1024, help="Dimensione massima di uno shard in MB")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    export(args.output_dir, args.shard_dir, layers=args.layers, max_shard_bytes=int(args.max_shard_mb * 2**20))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+import contextlib
 import gc
 import logging
 import os
@@ -5,7 +6,7 @@ import re
 import numpy as np
 import kubric as kb
 import bpy
-from kubric.renderer.blender import Blender as KubricBlender
+from kubric.renderer.blender import Blender as KubricBlender, RENDER_LAYER_PASSES
 from kubric.simulator.pybullet import PyBullet as KubricSimulator
 from kubric.assets.asset_source import AssetSource
 from kubric.file_io import (
@@ -19,13 +20,19 @@ from kubric.file_io import (
     write_backward_flow_batch,
     write_segmentation_batch,
     write_coordinates_batch,
+    StreamingFrameWriter,
 )
+from kubric.sequence_store import SequenceStoreWriter
 from tqdm import tqdm
 from pathlib import Path
 import json
 from collections import defaultdict
 import random as Random
 import argparse
+import subprocess
+import sys
+import stage_graph
+import tracing
 
 # ============================================================
 # --- CONFIGURAZIONE GLOBALE ---
@@ -125,7 +132,7 @@ print(f"✅ KuBasic asset disponibili")
 import argparse
 
 
-def parse_args():
+def parse_args(argv=None):
     parser = kb.ArgumentParser()
     parser.set_defaults(
         resolution=RESOLUTION,
@@ -142,39 +149,106 @@ def parse_args():
     parser.add_argument("--light_colors", nargs="+", default=["white", "1.0", "1.0", "1.0", "1.0", "red", "1.0", "0.0", "0.0", "1.0", "orange", "1.0", "0.5", "0.0", "1.0"])
     parser.add_argument("--output_root", type=Path, default=Path("output"))
     parser.add_argument("--rand_gen", type=lambda x: x.lower() == 'true', default=False, help="Genera sequenze aggiuntive con parametri casuali e oggetti multipli")
-
-    return parser.parse_args()
+    # sharding: la griglia di sequenze viene divisa in num_shards blocchi contigui di seq_id
+    parser.add_argument("--shard_index", type=int, default=0, help="Indice dello shard generato da questo processo")
+    parser.add_argument("--num_shards", type=int, default=1, help="Numero totale di shard")
+    parser.add_argument("--num_workers", type=int, default=1, help="Se > 1, lancia num_workers processi locali, uno per shard")
+    parser.add_argument("--grid_seed", type=int, default=None, help="Seed per la scelta degli shape (deve essere uguale in tutti gli shard)")
+    parser.add_argument("--layers", nargs="+", default=["rgba", "backward_flow", "forward_flow", "depth", "normal", "object_coordinates", "segmentation"],
+                        help="Layer da renderizzare e salvare (rgba produce anche rgb). Solo i render pass necessari vengono calcolati")
+    parser.add_argument("--reuse_scene", type=lambda x: x.lower() == 'true', default=False, help="Riusa la stessa scena Blender/PyBullet per tutte le sequenze dello shard")
+    parser.add_argument("--prefetch", type=int, default=2, help="Numero di sequenze successive di cui scaricare in anticipo shape e HDRI (0 = disattivato)")
+    parser.add_argument("--stream_render", type=lambda x: x.lower() == 'true', default=False, help="Scrive ogni frame appena renderizzato, invece di tenere in memoria l'intera sequenza")
+    parser.add_argument("--compression", type=int, default=-1, help="Livello di compressione zlib (0-9) di PNG e TIFF, più basso = più veloce (-1 = default del formato)")
+    parser.add_argument("--output_format", choices=["png", "store", "both"], default="png",
+                        help="png: un file per frame e layer; store: un archivio per sequenza (output/store/seqN) con tutti i layer al dtype nativo; both: entrambi")
+    parser.add_argument("--write_processes", type=lambda x: x.lower() == 'true', default=False, help="Codifica le immagini in processi separati invece che in thread (ogni processo importa kubric e questo script all'avvio: conviene solo per sequenze lunghe)")
+    parser.add_argument("--skip_done", type=lambda x: x.lower() == 'true', default=False, help="Salta le sequenze con il marker render.done in output_root/markers scritto con gli stessi parametri")
+
+    return parser.parse_args(argv)
+
+
+def write_options(FLAGS):
+    """Opzioni comuni a tutti i writer di kubric.file_io (compressione, thread o processi)."""
+    return dict(compression=None if FLAGS.compression < 0 else FLAGS.compression,
+                use_processes=FLAGS.write_processes)
 
 
 # ============================================================
 # --- FUNZIONE DI GENERAZIONE SEQUENZA ---
 # ============================================================
 
-def generate_sequence(seq_id: int, shape_id:str, light_intensity: float, orientation: tuple, camera_position: tuple, light_color: tuple, FLAGS, output_root: Path = Path("output")):
+class SceneSession:
+    """Scena Blender/PyBullet riutilizzata tra sequenze (--reuse_scene).
+
+    Renderer, simulatore, render pass, nodi di shading, dome e camera vengono creati una volta sola;
+    tra una sequenza e l'altra vengono rimossi solo gli oggetti generati e reimpostate luci e camera.
+    Gli HDRI già caricati restano in Blender (immagini con check_existing).
+    """
+    def __init__(self, FLAGS):
+        self.FLAGS = FLAGS
+        self.scene, _, self.output_dir, self.scratch_dir = kb.setup(FLAGS)
+        self.renderer = KubricBlender(self.scene, use_denoising=True, samples_per_pixel=64, render_layers=FLAGS.layers)
+        self.simulator = KubricSimulator(self.scene)
+
+        self.dome = KUBASIC_SOURCE.create(asset_id="dome", friction=1.0, restitution=0.0, static=True, background=True)
+        assert isinstance(self.dome, kb.FileBasedObject)
+        self.scene += self.dome
+
+        self.scene.camera = kb.PerspectiveCamera(name="camera", focal_length=35., sensor_width=32)
+
+    def reset(self, seq_id):
+        """Rimuove gli oggetti della sequenza precedente e restituisce un rng per la nuova sequenza."""
+        keep = {self.dome, self.scene.camera}
+        for asset in list(self.scene.assets):
+            if asset not in keep:
+                self.scene.remove(asset)
+        # mesh, materiali e animazioni degli oggetti rimossi restano in bpy.data senza utenti
+        if hasattr(bpy.data, "orphans_purge"):
+            bpy.data.orphans_purge(do_recursive=True)
+
+        seed = self.FLAGS.seed + seq_id if self.FLAGS.seed else np.random.randint(0, 2147483647)
+        self.scene.metadata["seed"] = seed
+        return np.random.RandomState(seed=seed)
+
+
+def generate_sequence(seq_id: int, shape_id:str, light_intensity: float, orientation: tuple, camera_position: tuple, light_color: tuple, FLAGS, output_root: Path = Path("output"), session: SceneSession = None, hdri_id: str = None):
 
-    scene, rng, output_dir, scratch_dir = kb.setup(FLAGS)
+    scene_setup = tracing.begin("scene_setup")
+    if session is None:
+        scene, rng, output_dir, scratch_dir = kb.setup(FLAGS)
 
-    renderer = KubricBlender(scene, use_denoising=True, samples_per_pixel=64)
-    simulator = KubricSimulator(scene)    
+        renderer = KubricBlender(scene, use_denoising=True, samples_per_pixel=64, render_layers=FLAGS.layers)
+        simulator = KubricSimulator(scene)
+    else:
+        rng = session.reset(seq_id)
+        scene, renderer, simulator = session.scene, session.renderer, session.simulator
 
     # --- Scene background HDRI ---
-    hdri_id = rng.choice(list(HDRI_SOURCE._assets.keys()))
+    if hdri_id is None:
+        hdri_id = rng.choice(list(HDRI_SOURCE._assets.keys()))
     print(f"🌅 Using HDRI: {hdri_id}")
+    # creato anche con --reuse_scene: riprende la voce della cache rilasciata alla fine della sequenza
+    # precedente (render_jobs), che altrimenti potrebbe essere rimossa mentre Blender legge il file
     background_hdri = HDRI_SOURCE.create(asset_id=hdri_id)
     renderer._set_ambient_light_hdri(background_hdri.filename, hdri_rotation=orientation, strength=light_intensity)
     # --- Set ambient light color ---
     renderer._set_ambient_light_color(light_color)
 
     # --- Dome ---
-    dome = KUBASIC_SOURCE.create(asset_id="dome", friction=1.0, restitution=0.0, static=True, background=True)
-    assert isinstance(dome, kb.FileBasedObject)
-    scene += dome
+    if session is None:
+        dome = KUBASIC_SOURCE.create(asset_id="dome", friction=1.0, restitution=0.0, static=True, background=True)
+        assert isinstance(dome, kb.FileBasedObject)
+        scene += dome
+    else:
+        dome = session.dome
     dome_blender = dome.linked_objects[renderer]
     texture_node = dome_blender.data.materials[0].node_tree.nodes["Image Texture"]
-    texture_node.image = bpy.data.images.load(background_hdri.filename)
+    texture_node.image = bpy.data.images.load(background_hdri.filename, check_existing=True)
 
     # --- Camera ---
-    scene.camera = kb.PerspectiveCamera(name="camera", focal_length=35., sensor_width=32)
+    if session is None:
+        scene.camera = kb.PerspectiveCamera(name="camera", focal_length=35., sensor_width=32)
     scene.camera.position = camera_position
     scene.camera.look_at((0, 0, 0))
 
@@ -189,11 +263,11 @@ def generate_sequence(seq_id: int, shape_id:str, light_intensity: float, orienta
         scale = rng.uniform(0.75, 3.0)
         obj.scale = scale / np.max(obj.bounds[1] - obj.bounds[0])  # Normalize scale
         scene += obj
-        kb.move_until_no_overlap(obj, simulator, spawn_region=SPAWN_REGION_STATIC, rng=rng)
+        kb.place_without_overlap(obj, simulator, spawn_region=SPAWN_REGION_STATIC, rng=rng)
         print(f"📦 Static object {shape_id} at {obj.position}")
 
     print("Simulating to let objects settle...")
-    _, _ = simulator.run(frame_start=-100, frame_end=0)
+    _, _ = simulator.run(frame_start=-100, frame_end=0, collision_stride=0)
 
     print("Stopping any moving objects...")
     # stop any objects that are still moving and reset friction / restitution
@@ -212,50 +286,132 @@ def generate_sequence(seq_id: int, shape_id:str, light_intensity: float, orienta
         scale = rng.uniform(0.75, 3.0)
         obj.scale = scale / np.max(obj.bounds[1] - obj.bounds[0])
         scene += obj
-        kb.move_until_no_overlap(obj, simulator, spawn_region=SPAWN_REGION_DYNAMIC, rng=rng)
+        kb.place_without_overlap(obj, simulator, spawn_region=SPAWN_REGION_DYNAMIC, rng=rng)
         obj.velocity = (rng.uniform(*VELOCITY_RANGE) - [obj.position[0], obj.position[1], 0])
         print(f"🚀 Dynamic object {shape_id} with velocity {obj.velocity}")
 
+    tracing.end(scene_setup)
+
     # === Simulation ===
     print("🎬 Simulazione...")
-    animation, collisions = simulator.run(frame_start=0, frame_end=scene.frame_end + 1)
+    # le collisioni non vengono salvate: non serve raccoglierle
+    animation, _ = simulator.run(frame_start=0, frame_end=scene.frame_end + 1, collision_stride=0)
 
 
     # === Rendering ===
     print("🎥 Rendering...")
     renderer.save_state(output_root / f"states/seq{seq_id}.blend")
-    frames_dict = renderer.render()
+    if FLAGS.stream_render:
+        render_and_write_streaming(scene, renderer, obj, seq_id, output_root, write_options(FLAGS),
+                                   output_format=FLAGS.output_format)
+        write_metadata(scene, seq_id, output_root)
+        gc.collect()
+        return
+    with tracing.span("render"):
+        frames_dict = renderer.render()
 
     # === Post-processing ===
     print("🎞️ Post-processing...")
-    kb.compute_visibility(frames_dict["segmentation"], scene.assets)
-    frames_dict["segmentation"] = kb.adjust_segmentation_idxs(
-        frames_dict["segmentation"], scene.assets, [obj]).astype(np.uint8)
+    if "segmentation" in frames_dict:
+        kb.compute_visibility(frames_dict["segmentation"], scene.assets)
+        frames_dict["segmentation"] = kb.adjust_segmentation_idxs(
+            frames_dict["segmentation"], scene.assets, [obj]).astype(np.uint8)
 
     # === Saving frames ===
+    if FLAGS.output_format in ("store", "both"):
+        print(f"💾 Salvataggio store per seq{seq_id}...")
+        with open_store(scene, seq_id, output_root) as store:
+            for key, value in frames_dict.items():
+                with tracing.span("layer_write", layer=key, format="store"):
+                    store.write(key, value)
+    if FLAGS.output_format == "store":
+        write_metadata(scene, seq_id, output_root)
+        gc.collect()
+        return
+
     print(f"💾 Salvataggio frame per seq{seq_id}...")
     for key in tqdm(frames_dict.keys(), desc=f"Scrittura Frame seq{seq_id}", unit="tipo"):
+        layer_write = tracing.begin("layer_write", layer=key, format="png")
         value = frames_dict[key]
         base_dir = output_root / key / f"seq{seq_id}"
         imgs_dir = base_dir / "imgs"
         imgs_dir.mkdir(parents=True, exist_ok=True)
 
         if key == "rgba":
-            writer_map["rgba"](value, imgs_dir)
+            writer_map["rgba"](value, imgs_dir, **write_options(FLAGS))
             rgb = value[..., :3]
             rgb_base_dir = output_root / "rgb" / f"seq{seq_id}"
             rgb_imgs_dir = rgb_base_dir / "imgs"
             rgb_imgs_dir.mkdir(parents=True, exist_ok=True)
-            writer_map["rgb"](rgb, rgb_imgs_dir)
+            writer_map["rgb"](rgb, rgb_imgs_dir, **write_options(FLAGS))
             with open(rgb_base_dir / "fps.txt", "w") as f:
                 f.write(str(scene.frame_rate))
 
         elif key in writer_map:
-            writer_map[key](value, imgs_dir)
+            writer_map[key](value, imgs_dir, **write_options(FLAGS))
             with open(base_dir / "fps.txt", "w") as f:
                 f.write(str(scene.frame_rate))
+        tracing.end(layer_write)
+
+    write_metadata(scene, seq_id, output_root)
+    gc.collect()  # Garbage collection to free memory
 
-    # === Metadata ===
+
+def open_store(scene, seq_id, output_root: Path):
+    """Store della sequenza (--output_format store/both): tutti i layer in output/store/seqN, rgb incluso in rgba."""
+    return SequenceStoreWriter(output_root / "store" / f"seq{seq_id}",
+                               num_frames=scene.frame_end - scene.frame_start + 1,
+                               fps=scene.frame_rate, attrs={"seq_id": seq_id})
+
+
+def render_and_write_streaming(scene, renderer, obj, seq_id, output_root: Path, options=None, output_format="png"):
+    """Renderizza e salva un frame alla volta (--stream_render).
+
+    I frame vengono scritti da thread in background mentre Blender renderizza il successivo, quindi in
+    memoria restano solo pochi frame. Produce gli stessi file di renderer.render() + writer_map.
+    """
+    # visibilità calcolata frame per frame sugli indici originali, come kb.compute_visibility
+    assets = list(scene.assets)
+    visibility = []
+    segmentation_ids = 2 if obj.segmentation_id is None else obj.segmentation_id + 1
+
+    with contextlib.ExitStack() as stack:
+        writer = store = None
+        if output_format in ("png", "both"):
+            layers = list(renderer.render_layers)
+            save_layers = layers + (["rgb"] if "rgba" in layers else [])
+            directories = {key: output_root / key / f"seq{seq_id}" / "imgs" for key in save_layers}
+            for key in save_layers:
+                directories[key].mkdir(parents=True, exist_ok=True)
+                with open(output_root / key / f"seq{seq_id}" / "fps.txt", "w") as f:
+                    f.write(str(scene.frame_rate))
+            writer = stack.enter_context(
+                StreamingFrameWriter(directories, num_segmentation_ids=segmentation_ids, **(options or {})))
+        if output_format in ("store", "both"):
+            store = stack.enter_context(open_store(scene, seq_id, output_root))
+
+        frames = renderer.render_iter()
+        for frame_nr, frame in tqdm(frames, total=scene.frame_end - scene.frame_start + 1,
+                                    desc=f"Rendering seq{seq_id}", unit="frame"):
+            if "segmentation" in frame:
+                segmentation = frame["segmentation"]
+                visibility.append(np.bincount(segmentation.ravel(), minlength=len(assets) + 1))
+                frame["segmentation"] = kb.adjust_segmentation_idxs(
+                    segmentation, assets, [obj]).astype(np.uint8)
+            if store is not None:
+                store.write_frame(frame_nr - scene.frame_start, frame)
+            if writer is not None:
+                if "rgba" in frame:
+                    frame["rgb"] = frame["rgba"][..., :3]
+                writer.write(frame_nr - scene.frame_start, frame)
+
+    if visibility:
+        visibility = np.stack(visibility)
+        for i, asset in enumerate(assets, start=1):
+            asset.metadata["visibility"] = [int(v) for v in visibility[:, i]]
+
+
+def write_metadata(scene, seq_id, output_root: Path):
     exclude_names = {"floor", "camera", "sun"}
     scene_objects = [obj for obj in scene.assets if obj.name not in exclude_names]
     data = {
@@ -267,48 +423,165 @@ def generate_sequence(seq_id: int, shape_id:str, light_intensity: float, orienta
     annotations_dir.mkdir(parents=True, exist_ok=True)
     metadata_path = annotations_dir / f"seq{seq_id}_metadata.json"
     kb.file_io.write_json(filename=metadata_path, data=data)
-    gc.collect()  # Garbage collection to free memory
 
 
 # ============================================================
 # --- CHOOSE IDS ---
 # ============================================================
+def choose_hdri(seq_id, seed=None):
+    """HDRI di sfondo della sequenza, scelto prima della generazione per poterlo scaricare in anticipo."""
+    rng = np.random.RandomState(seed + seq_id) if seed else np.random
+    return rng.choice(HDRI_SOURCE.all_asset_ids)
+
+
+def prefetch_assets(jobs):
+    """Scarica ed estrae in background shape e HDRI delle sequenze indicate (se non già fatto)."""
+    ASSET_SOURCE.prefetch([job["shape_id"] for job in jobs])
+    HDRI_SOURCE.prefetch([job["hdri_id"] for job in jobs])
+
+
 def chooseClass(class_name):
-    return [name for name, spec in ASSET_SOURCE._assets.items() if spec["metadata"]["category"] == class_name]
+    return ASSET_SOURCE.ids_for_category(class_name)
 
 
 # ============================================================
-# --- MAIN ---
+# --- GRIGLIA DI SEQUENZE E SHARDING ---
 # ============================================================
 
-def main():
-    args = parse_args()
-    print("🎛️  Configurazione in corso...")
-    print("Classes:", args.classes)
-    print("Light levels:", args.light_levels)
-    print("Orientations:", args.light_orientations)
-    print("Cameras:", args.camera_positions)
-    print("Colors:", args.light_colors)
+def build_sequence_grid(classes, light_levels, light_orientations, camera_positions, light_colors, rand_gen, grid_seed=None):
+    """Lista deterministica (dato grid_seed) di tutte le sequenze da generare, con seq_id globali."""
+    rnd = Random.Random(grid_seed)
+    jobs = []
 
-    def _normalize_list_arg(lst):
-        """Accetta ['a','b',...] oppure ['a,b;c d'] e restituisce ['a','b','c','d'].
-        Se la lista contiene numeri (int/float), li restituisce così com'è.
-        """
-        if not lst:
-            return []
+    def add_job(shape_class, shape_id, intensity, orient, cam, color, random_job=False):
+        jobs.append(dict(seq_id=len(jobs), random=random_job, **{"class": shape_class}, shape_id=shape_id,
+                         intensity=intensity, orient_name=orient[0], orientation=orient[1],
+                         cam_name=cam[0], cam_pos=cam[1], color_name=color[0], color_value=color[1]))
 
-        # Caso: lista di numeri → ritorna direttamente
-        if all(isinstance(x, (int, float)) for x in lst):
-            return lst
-
-        # Caso: singola stringa da splittare
-        if len(lst) == 1 and isinstance(lst[0], str):
-            s = lst[0]
-            return [t for t in re.split(r'[,\s;]+', s) if t]
-
-        # Caso: lista di stringhe già separata
-        return [str(x) for x in lst]
+    for shape_class in classes:
+        shape_id = rnd.choice(sorted(chooseClass(shape_class)))
+        for intensity in light_levels:
+            for orient in light_orientations.items():
+                for cam in camera_positions.items():
+                    for color in light_colors.items():
+                        add_job(shape_class, shape_id, intensity, orient, cam, color)
 
+    # Generate additional sequences with multiple objects and random parameters if enabled
+    if rand_gen:
+        for i in range(1):
+            random_class = rnd.choice(classes_all)
+            shape_id = rnd.choice(sorted(chooseClass(random_class)))
+            intensity = rnd.choice(light_levels_all)
+            orient = rnd.choice(list(light_orientations_all.items()))
+            cam = rnd.choice(list(camera_positions_all.items()))
+            color = rnd.choice(list(light_colors_all.items()))
+            add_job(random_class, shape_id, intensity, orient, cam, color, random_job=True)
+
+    return jobs
+
+
+def shard_range(num_jobs, shard_index, num_shards):
+    """Intervallo [start, end) di seq_id assegnato allo shard (blocchi contigui, dimensioni che differiscono al più di 1)."""
+    base, extra = divmod(num_jobs, num_shards)
+    start = shard_index * base + min(shard_index, extra)
+    end = start + base + (1 if shard_index < extra else 0)
+    return start, end
+
+
+def launch_workers(args):
+    """Lancia args.num_workers processi locali di questo script, uno per shard, ognuno con la sua scratch dir."""
+    num_workers = args.num_workers
+    grid_seed = args.grid_seed if args.grid_seed is not None else Random.randrange(2**31)
+    log_dir = Path(args.output_root) / "logs"
+    log_dir.mkdir(parents=True, exist_ok=True)
+
+    print(f"🧵 Avvio di {num_workers} worker (grid_seed={grid_seed})...")
+    procs = []
+    for shard_index in range(num_workers):
+        scratch_dir = Path(args.scratch_dir) / f"shard{shard_index}"
+        # gli argomenti aggiunti in coda sovrascrivono quelli originali
+        cmd = [sys.executable, os.path.abspath(__file__)] + sys.argv[1:] + [
+            "--num_workers", "1",
+            "--num_shards", str(num_workers),
+            "--shard_index", str(shard_index),
+            "--grid_seed", str(grid_seed),
+            "--scratch_dir", str(scratch_dir),
+        ]
+        log_file = open(log_dir / f"shard{shard_index}.log", "w")
+        procs.append((shard_index, subprocess.Popen(cmd, stdout=log_file, stderr=subprocess.STDOUT), log_file))
+
+    failed = []
+    for shard_index, proc, log_file in procs:
+        proc.wait()
+        log_file.close()
+        if proc.returncode != 0:
+            failed.append(shard_index)
+            print(f"❌ Shard {shard_index} terminato con codice {proc.returncode}, vedi {log_dir / f'shard{shard_index}.log'}")
+        else:
+            print(f"✅ Shard {shard_index} completato")
+
+    if failed:
+        raise RuntimeError(f"Shard falliti: {failed}")
+
+
+def instrument_tracing():
+    """Span dei punti caldi di kubric e Blender (solo con tracing attivo, vedi tracing.py)."""
+    tracing.instrument(AssetSource, "fetch", "asset_fetch")
+    tracing.instrument(KubricSimulator, "run", "physics")
+    tracing.instrument(KubricBlender, "_decode_frame", "exr_postprocess")
+    tracing.instrument(kb.file_io, "write_png", "png_write")
+    tracing.instrument(kb.file_io, "write_palette_png", "png_write")
+    tracing.instrument(kb.file_io, "write_tiff", "tiff_write")
+    # i writer in streaming usano le funzioni registrate in FRAME_WRITERS
+    for key, (write_fn, file_template) in kb.file_io.FRAME_WRITERS.items():
+        kb.file_io.FRAME_WRITERS[key] = (getattr(kb.file_io, write_fn.__name__), file_template)
+
+    # render Cycles di ogni frame, misurato dagli handler di Blender
+    # (persistent: KubricBlender carica le factory settings, che rimuovono gli altri handler)
+    frames = []
+
+    @bpy.app.handlers.persistent
+    def render_pre(scene, *_):
+        frames.append(tracing.begin("cycles_render", frame=scene.frame_current))
+
+    @bpy.app.handlers.persistent
+    def render_post(scene, *_):
+        if frames:
+            tracing.end(frames.pop())
+
+    bpy.app.handlers.render_pre.append(render_pre)
+    bpy.app.handlers.render_post.append(render_post)
+    bpy.app.handlers.render_cancel.append(render_post)
+
+
+def _normalize_list_arg(lst):
+    """Accetta ['a','b',...] oppure ['a,b;c d'] e restituisce ['a','b','c','d'].
+    Se la lista contiene numeri (int/float), li restituisce così com'è.
+    """
+    if not lst:
+        return []
+
+    # Caso: lista di numeri → ritorna direttamente
+    if all(isinstance(x, (int, float)) for x in lst):
+        return lst
+
+    # Caso: singola stringa da splittare
+    if len(lst) == 1 and isinstance(lst[0], str):
+        s = lst[0]
+        return [t for t in re.split(r'[,\s;]+', s) if t]
+
+    # Caso: lista di stringhe già separata
+    return [str(x) for x in lst]
+
+
+def parse_grid_args(args):
+    """Valida args.layers e restituisce classi, livelli, orientazioni, camere e colori della griglia."""
+    # -- layers
+    args.layers = _normalize_list_arg(args.layers)
+    valid_layers = set(writer_map) & set(RENDER_LAYER_PASSES)
+    unknown_layers = set(args.layers) - valid_layers
+    if unknown_layers:
+        raise ValueError(f"layers non validi: {sorted(unknown_layers)}, validi: {sorted(valid_layers)}")
 
     # -- classes
     raw_classes = _normalize_list_arg(args.classes)
@@ -360,6 +633,118 @@ def main():
             raise ValueError(f"Colore luce non valido per '{name}': {raw_colors[i+1:i+5]}") from e
         light_colors[name] = (r, g, b, a)
 
+    return classes, light_levels, light_orientations, camera_positions, light_colors
+
+
+def sequence_outputs(seq_id, FLAGS, output_root: Path):
+    """Percorsi scritti da generate_sequence per la sequenza: directory dei frame per layer, store e metadati."""
+    outputs = {}
+    if FLAGS.output_format in ("png", "both"):
+        layers = list(FLAGS.layers) + (["rgb"] if "rgba" in FLAGS.layers else [])
+        outputs["layers"] = {key: str(output_root / key / f"seq{seq_id}" / "imgs") for key in layers}
+    if FLAGS.output_format in ("store", "both"):
+        outputs["store"] = str(output_root / "store" / f"seq{seq_id}")
+    outputs["metadata"] = str(output_root / "annotations" / f"seq{seq_id}_metadata.json")
+    return outputs
+
+
+# argomenti che non cambiano il contenuto delle sequenze renderizzate (la griglia è nei parametri dei job)
+_SCHEDULING_ARGS = {"classes", "light_levels", "light_orientations", "camera_positions", "light_colors", "rand_gen",
+                    "grid_seed", "shard_index", "num_shards", "num_workers", "skip_done", "prefetch", "output_root",
+                    "scratch_dir", "job_dir", "logging_level", "reuse_scene", "stream_render", "write_processes"}
+
+
+def render_params(job, args):
+    """Hash dei parametri della sequenza e degli argomenti del generatore, salvato nel marker render.done.
+
+    Shape e HDRI non sono inclusi: senza --grid_seed e --seed cambiano a ogni esecuzione.
+    """
+    job_params = {key: job[key] for key in ("class", "intensity", "orientation", "cam_pos", "color_value", "random")}
+    generator_args = {key: value for key, value in vars(args).items() if key not in _SCHEDULING_ARGS}
+    return stage_graph.params_hash([job_params, generator_args])
+
+
+def select_jobs(args, classes, light_levels, light_orientations, camera_positions, light_colors):
+    """Sequenze della griglia assegnate allo shard args.shard_index, senza quelle già renderizzate (--skip_done).
+
+    Ogni job ha già il suo hdri_id, per poterne scaricare in anticipo gli asset.
+    """
+    if args.num_shards > 1 and args.grid_seed is None:
+        raise ValueError("--grid_seed è necessario con --num_shards > 1, altrimenti gli shard scelgono shape diversi")
+    if not 0 <= args.shard_index < args.num_shards:
+        raise ValueError(f"shard_index {args.shard_index} non valido per num_shards={args.num_shards}")
+
+    jobs = build_sequence_grid(classes, light_levels, light_orientations, camera_positions, light_colors,
+                               args.rand_gen, args.grid_seed)
+    start, end = shard_range(len(jobs), args.shard_index, args.num_shards)
+    print(f"🧩 Shard {args.shard_index}/{args.num_shards}: sequenze {start}..{end - 1} di {len(jobs)}")
+
+    shard_jobs = jobs[start:end]
+    marker_dir = args.output_root / "markers"
+    if args.skip_done:
+        # sequenze renderizzate con gli stessi parametri (una configurazione modificata le rigenera)
+        done = [job["seq_id"] for job in shard_jobs
+                if stage_graph.is_done(marker_dir, f"seq{job['seq_id']}", "render", params=render_params(job, args))]
+        if done:
+            print(f"⏭️  Sequenze già renderizzate: {done}")
+        shard_jobs = [job for job in shard_jobs if job["seq_id"] not in done]
+    for job in shard_jobs:
+        # un marker vecchio farebbe elaborare alla pipeline i frame mentre vengono riscritti
+        stage_graph.clear_done(marker_dir, f"seq{job['seq_id']}", "render")
+        job["hdri_id"] = choose_hdri(job["seq_id"], args.seed)
+    return shard_jobs
+
+
+def render_jobs(jobs, args, output_root: Path, session: SceneSession = None):
+    """Renderizza le sequenze della griglia (vedi build_sequence_grid) e scrive il loro marker render.done.
+
+    I job devono avere hdri_id (choose_hdri); restituisce i percorsi di output di ogni seq_id.
+    """
+    global MIN_STATIC, MAX_STATIC, MIN_DYNAMIC, MAX_DYNAMIC
+    marker_dir = output_root / "markers"
+    outputs = {}
+    for i, job in enumerate(jobs):
+        if args.prefetch > 0:
+            # gli asset delle prossime sequenze vengono scaricati mentre questa viene renderizzata
+            prefetch_assets(jobs[i:i + 1 + args.prefetch])
+        objects_range = MIN_STATIC, MAX_STATIC, MIN_DYNAMIC, MAX_DYNAMIC
+        if job["random"]:
+            # Modified parameters for multiple objects
+            MIN_STATIC, MAX_STATIC = 1, 2
+            MIN_DYNAMIC, MAX_DYNAMIC = 1, 2
+            print(f"\n🎲 Random sequence {job['seq_id']} | shape={job['class']} | light={int(job['intensity']*100)}% | orient={job['orient_name']} | cam={job['cam_name']} | color={job['color_name']}")
+        else:
+            print(f"\n🚀 Generazione sequenza {job['seq_id']} | shape={job['class']} | light={int(job['intensity']*100)}% | orient={job['orient_name']} | cam={job['cam_name']} | color={job['color_name']}")
+        try:
+            with tracing.span("render_sequence", seq=f"seq{job['seq_id']}"):
+                generate_sequence(job["seq_id"], job["shape_id"], job["intensity"], job["orientation"], job["cam_pos"],
+                                  job["color_value"], args, output_root, session=session, hdri_id=job["hdri_id"])
+        finally:
+            # un processo che renderizza più batch (render_server.py) non deve ereditare i parametri random
+            MIN_STATIC, MAX_STATIC, MIN_DYNAMIC, MAX_DYNAMIC = objects_range
+            # gli asset della sequenza sono già caricati in Blender: la cache può rimuoverli se serve spazio
+            for source in (ASSET_SOURCE, HDRI_SOURCE, KUBASIC_SOURCE):
+                source.release()
+        # la sequenza può passare all'upsampling (vedi pipeline.py)
+        stage_graph.mark_done(marker_dir, f"seq{job['seq_id']}", "render", params=render_params(job, args))
+        outputs[job["seq_id"]] = sequence_outputs(job["seq_id"], args, output_root)
+    return outputs
+
+
+# ============================================================
+# --- MAIN ---
+# ============================================================
+
+def main():
+    args = parse_args()
+    print("🎛️  Configurazione in corso...")
+    print("Classes:", args.classes)
+    print("Light levels:", args.light_levels)
+    print("Orientations:", args.light_orientations)
+    print("Cameras:", args.camera_positions)
+    print("Colors:", args.light_colors)
+
+    classes, light_levels, light_orientations, camera_positions, light_colors = parse_grid_args(args)
 
     print("✅ Config caricate:")
     print("Classes:", classes)
@@ -367,50 +752,26 @@ def main():
     print("Orientations:", light_orientations)
     print("Cameras:", camera_positions)
     print("Colors:", light_colors)
+    print("Layers:", args.layers)
 
     
     # Use output_root from arguments
     output_root = args.output_root
-    
-    seq_id = 0
-    
-    for shape_class in classes:
-        shape_ids = chooseClass(shape_class)
-        shape_id = Random.choice(shape_ids)
-        for intensity in light_levels:
-            for orient_name, orientation in light_orientations.items():
-                for cam_name, cam_pos in camera_positions.items():
-                    for color_name, color_value in light_colors.items():
-                        print(f"\n🚀 Generazione sequenza {seq_id} | shape={shape_class} | light={int(intensity*100)}% | orient={orient_name} | cam={cam_name} | color={color_name}")
-                        generate_sequence(seq_id, shape_id, intensity, orientation, cam_pos, color_value, args, output_root)
-                        seq_id += 1
-    print("\n✅ Tutte le sequenze sono state generate.")
 
-    # Generate additional sequences with multiple objects and random parameters if enabled
-    if args.rand_gen:
-        print(f"\n🎲 Generating additional sequences with random multiple objects...")
-
-        # Modified parameters for multiple objects
-        global MIN_STATIC, MAX_STATIC, MIN_DYNAMIC, MAX_DYNAMIC
-        MIN_STATIC, MAX_STATIC = 1, 2
-        MIN_DYNAMIC, MAX_DYNAMIC = 1, 2
-        
-        # Generate 10 additional sequences with random parameters
-        for i in range(1):
-            # Random shape selection
-            random_class = Random.choice(classes_all)
-            shape_ids = chooseClass(random_class)
-            shape_id = Random.choice(shape_ids)
-            
-            # Random light parameters
-            intensity = Random.choice(light_levels_all)
-            orient_name, orientation = Random.choice(list(light_orientations_all.items()))
-            cam_name, cam_pos = Random.choice(list(camera_positions_all.items()))
-            color_name, color_value = Random.choice(list(light_colors_all.items()))
-
-            print(f"\n🎲 Random sequence {seq_id} | shape={random_class} | light={int(intensity*100)}% | orient={orient_name} | cam={cam_name} | color={color_name}")
-            generate_sequence(seq_id, shape_id, intensity, orientation, cam_pos, color_value, args, output_root)
-            seq_id += 1
+    if args.num_workers > 1:
+        launch_workers(args)
+        return
+
+    shard_jobs = select_jobs(args, classes, light_levels, light_orientations, camera_positions, light_colors)
+    if args.prefetch > 0:
+        KUBASIC_SOURCE.prefetch(["dome"])
+
+    if tracing.enabled():
+        instrument_tracing()
+    session = SceneSession(args) if args.reuse_scene else None
+
+    render_jobs(shard_jobs, args, output_root, session)
+    print("\n✅ Tutte le sequenze sono state generate.")
 
     kb.done()
 
@@ -0,0 +1,99 @@
+# Copyright 2024 The Kubric Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmark of the kubric.file_io batch writers.
+
+Reports the throughput (bytes of image data per second) and the size of the written files for
+each layer type, compression level and executor type (threads or processes):
+
+  python benchmarks/bench_file_io.py --resolution 256 --num_frames 24 --compression 1 6 9
+"""
+
+import argparse
+import logging
+import pathlib
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from kubric import file_io
+
+
+def make_layers(num_frames, resolution, rng):
+  """Synthetic layers with the shapes and dtypes returned by the Blender renderer."""
+  shape = (num_frames, resolution, resolution)
+  # smooth images compress like rendered ones, unlike pure noise
+  ramp = np.linspace(0, 1, resolution, dtype=np.float32)
+  smooth = (ramp[None, :, None] * ramp[None, None, :]) * np.ones(shape, dtype=np.float32)
+  noise = rng.normal(scale=0.02, size=shape + (4,)).astype(np.float32)
+  rgba = np.clip(smooth[..., None] + noise, 0, 1)
+  segmentation = (smooth * 8).astype(np.uint8)[..., None]
+  return {
+      "rgba": (rgba * 255).astype(np.uint8),
+      "depth": (smooth * 10)[..., None],
+      "normal": (rgba[..., :3] * 65535).astype(np.uint16),
+      "object_coordinates": (rgba[..., 1:] * 65535).astype(np.uint16),
+      "forward_flow": (noise[..., :2] * 100).astype(np.float32),
+      "segmentation": segmentation,
+  }
+
+
+def bench_layer(key, data, output_dir, compression, use_processes, max_write_threads, repeats):
+  best = float("inf")
+  for _ in range(repeats):
+    shutil.rmtree(output_dir, ignore_errors=True)
+    output_dir.mkdir(parents=True)
+    start = time.perf_counter()
+    file_io.DEFAULT_WRITERS[key](data, output_dir, max_write_threads=max_write_threads,
+                                 compression=compression, use_processes=use_processes)
+    best = min(best, time.perf_counter() - start)
+  file_size = sum(f.stat().st_size for f in output_dir.iterdir())
+  return data.nbytes / best, file_size
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--resolution", type=int, default=256)
+  parser.add_argument("--num_frames", type=int, default=24)
+  parser.add_argument("--compression", type=int, nargs="+", default=[1, 6, 9])
+  parser.add_argument("--max_write_threads", type=int, default=16)
+  parser.add_argument("--repeats", type=int, default=3)
+  parser.add_argument("--seed", type=int, default=0)
+  args = parser.parse_args()
+  logging.basicConfig(level="WARNING")
+
+  layers = make_layers(args.num_frames, args.resolution, np.random.default_rng(args.seed))
+  tmp_dir = pathlib.Path(tempfile.mkdtemp())
+  try:
+    # start (and import kubric in) all worker processes outside of the measurements
+    executor = file_io.get_write_executor(args.max_write_threads, use_processes=True)
+    for future in [executor.submit(time.sleep, 1.) for _ in range(args.max_write_threads)]:
+      future.result()
+    print(f"{'layer':>20} {'compression':>11} {'executor':>9} {'MB/s':>8} {'file size [MB]':>15}")
+    for key, data in layers.items():
+      for compression in args.compression:
+        for use_processes in (False, True):
+          throughput, file_size = bench_layer(key, data, tmp_dir / key, compression,
+                                              use_processes, args.max_write_threads, args.repeats)
+          executor = "processes" if use_processes else "threads"
+          print(f"{key:>20} {compression:>11} {executor:>9} {throughput / 1e6:>8.1f} "
+                f"{file_size / 1e6:>15.2f}")
+  finally:
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    file_io.shutdown_write_executors()
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,106 @@
+# Copyright 2024 The Kubric Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmark of transferring simulated animations to Blender.
+
+Compares inserting keyframes one frame at a time (keyframe_insert) with transferring whole
+curves at once (Asset.set_keyframes, which fills the Blender F-curves in bulk), for scenes
+with many dynamic objects. Requires bpy:
+
+  python benchmarks/bench_keyframes.py --num_objects 10 100 500 --num_frames 96
+"""
+
+import argparse
+import logging
+import time
+
+import numpy as np
+
+import kubric as kb
+from kubric.renderer.blender import Blender as KubricRenderer
+
+ANIMATED_PROPERTIES = ("position", "quaternion", "velocity", "angular_velocity")
+
+
+def random_animation(num_objects, num_frames, rng):
+  animation = []
+  for _ in range(num_objects):
+    quaternions = rng.normal(size=(num_frames, 4))
+    animation.append({
+        "position": rng.uniform(-5, 5, size=(num_frames, 3)),
+        "quaternion": quaternions / np.linalg.norm(quaternions, axis=1, keepdims=True),
+        "velocity": rng.normal(size=(num_frames, 3)),
+        "angular_velocity": rng.normal(size=(num_frames, 3)),
+    })
+  return animation
+
+
+def make_scene(num_objects, num_frames):
+  scene = kb.Scene(resolution=(64, 64), frame_start=1, frame_end=num_frames)
+  renderer = KubricRenderer(scene)
+  objects = [kb.Cube(name=f"cube_{i}") for i in range(num_objects)]
+  scene.add(objects)
+  return scene, renderer, objects
+
+
+def transfer_per_frame(objects, animation, frames):
+  for obj, anim in zip(objects, animation):
+    for i, frame in enumerate(frames):
+      for key in ANIMATED_PROPERTIES:
+        setattr(obj, key, anim[key][i])
+        obj.keyframe_insert(key, frame)
+
+
+def transfer_bulk(objects, animation, frames):
+  for obj, anim in zip(objects, animation):
+    for key in ANIMATED_PROPERTIES:
+      obj.set_keyframes(key, frames, anim[key])
+
+
+def run(num_objects, num_frames, repeats, rng):
+  frames = list(range(1, num_frames + 1))
+  animation = random_animation(num_objects, num_frames, rng)
+  timings = {}
+  for name, transfer in [("keyframe_insert", transfer_per_frame), ("set_keyframes", transfer_bulk)]:
+    best = float("inf")
+    for _ in range(repeats):
+      scene, renderer, objects = make_scene(num_objects, num_frames)
+      start = time.perf_counter()
+      transfer(objects, animation, frames)
+      best = min(best, time.perf_counter() - start)
+      del scene, renderer
+    timings[name] = best
+  return timings
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--num_objects", type=int, nargs="+", default=[10, 100, 500])
+  parser.add_argument("--num_frames", type=int, default=96)
+  parser.add_argument("--repeats", type=int, default=3)
+  parser.add_argument("--seed", type=int, default=0)
+  args = parser.parse_args()
+  logging.basicConfig(level="WARNING")
+
+  rng = np.random.default_rng(args.seed)
+  print(f"{'objects':>8} {'frames':>7} {'keyframe_insert [s]':>20} {'set_keyframes [s]':>18} "
+        f"{'speedup':>8}")
+  for num_objects in args.num_objects:
+    timings = run(num_objects, args.num_frames, args.repeats, rng)
+    print(f"{num_objects:>8} {args.num_frames:>7} {timings['keyframe_insert']:>20.3f} "
+          f"{timings['set_keyframes']:>18.3f} "
+          f"{timings['keyframe_insert'] / timings['set_keyframes']:>7.1f}x")
+
+
+if __name__ == "__main__":
+  main()
@@ -64,6 +64,7 @@ from kubric.randomness import rotation_sampler
 from kubric.randomness import position_sampler
 from kubric.randomness import resample_while
 from kubric.randomness import move_until_no_overlap
+from kubric.randomness import place_without_overlap
 from kubric.randomness import sample_point_in_half_sphere_shell
 
 from kubric.post_processing import compute_visibility
@@ -81,6 +82,9 @@ from kubric.file_io import write_image_dict
 from kubric.file_io import read_png
 from kubric.file_io import read_tiff
 
+from kubric.sequence_store import SequenceStore
+from kubric.sequence_store import SequenceStoreWriter
+
 from kubric.utils import ArgumentParser
 from kubric.utils import done
 from kubric.utils import get_camera_info
@@ -12,5 +12,6 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from .asset_cache import AssetCache
 from .asset_source import AssetSource, ClosableResource
 from . import utils
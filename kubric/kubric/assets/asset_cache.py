@@ -0,0 +1,235 @@
+# Copyright 2024 The Kubric Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Persistent cache of extracted assets, shared between processes and runs."""
+
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import shutil
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+import tensorflow as tf
+
+from kubric.kubric_typing import PathLike
+
+logger = logging.getLogger(__name__)
+
+# default cache directory of AssetSource, if set
+CACHE_DIR_ENV = "KUBRIC_ASSET_CACHE"
+# default maximum size of the cache in bytes, if set
+CACHE_SIZE_ENV = "KUBRIC_ASSET_CACHE_MAX_BYTES"
+
+_COMPLETE = "complete.json"
+
+
+def _dir_size(path: pathlib.Path) -> int:
+  size = 0
+  for root, _, files in os.walk(path):
+    for f in files:
+      size += os.lstat(os.path.join(root, f)).st_size
+  return size
+
+
+class AssetCache:
+  """Directory of extracted assets that is reused across runs and shared by concurrent workers.
+
+  Every entry is stored in `<cache_dir>/entries/<key>` where key identifies the source archive
+  (see key_for). Entries are populated once, under an exclusive file lock, into a temporary
+  directory that is renamed into place, so other processes never see partially extracted assets.
+  Complete entries in use are protected by a shared lock until release() (or release_all()) is
+  called; populating uses a separate lock and does not wait for the processes using an entry.
+
+  If max_size is set, the least recently used entries that are not in use are deleted whenever
+  the total size of the cache exceeds max_size bytes.
+  """
+
+  def __init__(self, cache_dir: PathLike, max_size: Optional[int] = None):
+    self.cache_dir = pathlib.Path(cache_dir)
+    self.max_size = max_size
+    self.entries_dir = self.cache_dir / "entries"
+    self.locks_dir = self.cache_dir / "locks"
+    self.entries_dir.mkdir(parents=True, exist_ok=True)
+    self.locks_dir.mkdir(parents=True, exist_ok=True)
+    self._held = {}  # key -> file descriptor holding a shared lock
+    self._lock = threading.RLock()  # entries may be fetched from several threads
+
+  @staticmethod
+  def key_for(source_path: PathLike) -> str:
+    """Key of an archive: hash of its path together with its size and modification time.
+
+    Changing the file at source_path therefore results in a new cache entry.
+    """
+    source_path = str(source_path)
+    stat = tf.io.gfile.stat(source_path)
+    h = hashlib.sha256()
+    h.update(json.dumps([source_path, stat.length, stat.mtime_nsec]).encode("utf-8"))
+    return h.hexdigest()[:32]
+
+  def _lock_file(self, key: str, suffix: str = ".lock") -> int:
+    return os.open(self.locks_dir / (key + suffix), os.O_RDWR | os.O_CREAT, 0o644)
+
+  def entry_dir(self, key: str) -> pathlib.Path:
+    return self.entries_dir / key
+
+  def _is_complete(self, key: str) -> bool:
+    return (self.entries_dir / key / _COMPLETE).exists()
+
+  def get(self, key: str, populate: Callable[[pathlib.Path], None]) -> pathlib.Path:
+    """Returns the directory of the entry, calling populate(directory) first if it is missing.
+
+    The entry is locked against eviction until it is released.
+    """
+    with self._lock:
+      if key in self._held:
+        self._touch(key)
+        return self.entry_dir(key)
+
+    while True:
+      if not self._is_complete(key):
+        self._populate_once(key, populate)
+      fd = self._lock_file(key)
+      try:
+        fcntl.flock(fd, fcntl.LOCK_SH)
+      except BaseException:
+        os.close(fd)
+        raise
+      if self._is_complete(key):
+        break
+      os.close(fd)  # evicted between populating and locking, populate again
+    logger.debug("Using cached asset %s", key)
+    self._touch(key)
+    with self._lock:
+      if key in self._held:
+        os.close(fd)  # got concurrently by another thread, which holds the lock already
+      else:
+        self._held[key] = fd
+
+    if self.max_size is not None:
+      self.evict(self.max_size)
+    return self.entry_dir(key)
+
+  def _populate_once(self, key: str, populate: Callable[[pathlib.Path], None]):
+    # a separate lock, so that populating never waits for processes that hold the entry
+    fd = self._lock_file(key, ".populate")
+    try:
+      fcntl.flock(fd, fcntl.LOCK_EX)
+      # only one process populates the entry, the others wait and then reuse it
+      if not self._is_complete(key):
+        self._populate(key, populate)
+    finally:
+      os.close(fd)
+
+  def _populate(self, key: str, populate: Callable[[pathlib.Path], None]):
+    entry_dir = self.entry_dir(key)
+    # leftovers of a process that died while populating or evicting (the lock is held by us now)
+    shutil.rmtree(entry_dir, ignore_errors=True)
+    tmp_dir = pathlib.Path(tempfile.mkdtemp(prefix=key + ".", suffix=".tmp", dir=self.entries_dir))
+    try:
+      populate(tmp_dir)
+      size = _dir_size(tmp_dir)
+      with open(tmp_dir / _COMPLETE, "w", encoding="utf-8") as f:
+        json.dump({"size": size, "created": time.time()}, f)
+      os.rename(tmp_dir, entry_dir)
+    except BaseException:
+      shutil.rmtree(tmp_dir, ignore_errors=True)
+      raise
+    logger.debug("Cached asset %s (%d bytes)", key, size)
+
+  def _touch(self, key: str):
+    try:
+      os.utime(self.entry_dir(key) / _COMPLETE)
+    except FileNotFoundError:
+      pass
+
+  def release(self, key: str):
+    with self._lock:
+      fd = self._held.pop(key, None)
+    if fd is not None:
+      os.close(fd)
+
+  def release_all(self):
+    for key in list(self._held):
+      self.release(key)
+
+  def entries(self) -> Dict[str, Dict[str, float]]:
+    """Size and last access time of all complete entries."""
+    entries = {}
+    for entry_dir in self.entries_dir.iterdir():
+      if entry_dir.name.endswith(".tmp"):
+        continue  # being populated
+      marker = entry_dir / _COMPLETE
+      try:
+        with open(marker, encoding="utf-8") as f:
+          size = json.load(f)["size"]
+        entries[entry_dir.name] = {"size": size, "atime": os.stat(marker).st_mtime}
+      except (FileNotFoundError, NotADirectoryError, json.JSONDecodeError, KeyError):
+        continue
+    return entries
+
+  def size(self) -> int:
+    return sum(e["size"] for e in self.entries().values())
+
+  def evict(self, max_size: int) -> int:
+    """Deletes least recently used entries that are not in use until the cache fits max_size.
+
+    Returns the number of deleted entries.
+    """
+    global_fd = os.open(self.cache_dir / "evict.lock", os.O_RDWR | os.O_CREAT, 0o644)
+    num_deleted = 0
+    try:
+      fcntl.flock(global_fd, fcntl.LOCK_EX)
+      with self._lock:
+        entries = self.entries()
+        total = sum(e["size"] for e in entries.values())
+        for key in sorted(entries, key=lambda k: entries[k]["atime"]):
+          if total <= max_size:
+            break
+          if key in self._held:
+            continue
+          # nobody populates the entry again while it is being deleted
+          populate_fd = self._lock_file(key, ".populate")
+          fd = self._lock_file(key)
+          try:
+            fcntl.flock(populate_fd, fcntl.LOCK_EX)
+            try:
+              fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+              continue  # in use by another process
+            # remove the marker first, so that a half deleted entry is never considered complete
+            (self.entry_dir(key) / _COMPLETE).unlink(missing_ok=True)
+            shutil.rmtree(self.entry_dir(key), ignore_errors=True)
+          finally:
+            os.close(fd)
+            os.close(populate_fd)
+          total -= entries[key]["size"]
+          num_deleted += 1
+          logger.debug("Evicted cached asset %s", key)
+    finally:
+      os.close(global_fd)
+    return num_deleted
+
+
+def default_cache() -> Optional[AssetCache]:
+  """The cache configured by the KUBRIC_ASSET_CACHE environment variable (None if unset)."""
+  cache_dir = os.environ.get(CACHE_DIR_ENV)
+  if not cache_dir:
+    return None
+  max_size = os.environ.get(CACHE_SIZE_ENV)
+  return AssetCache(cache_dir, max_size=int(max_size) if max_size else None)
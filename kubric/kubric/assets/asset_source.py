@@ -12,22 +12,27 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import concurrent.futures
 import difflib
 import functools
 import logging
+import os
 import pathlib
 import shutil
 import tarfile
 import tempfile
+import threading
 
 import numpy as np
 import tensorflow as tf
 
-from typing import Optional, Dict, Any, Type
+from typing import Optional, Dict, Any, Iterable, List, Mapping, Type
 import weakref
 
 from kubric import core
 from kubric import file_io
+from kubric.assets import asset_cache
+from kubric.assets import manifest_index
 from kubric.kubric_typing import PathLike
 
 
@@ -63,44 +68,117 @@ class AssetSource(ClosableResource):
   def from_manifest(
       cls,
       manifest_path: PathLike,
-      scratch_dir: Optional[PathLike] = None
+      scratch_dir: Optional[PathLike] = None,
+      cache_dir: Optional[PathLike] = None,
+      max_cache_size: Optional[int] = None,
+      index_dir: Optional[PathLike] = None,
   ) -> "AssetSource":
+    """Creates an AssetSource from a manifest file.
+
+    If index_dir is given (default: <cache_dir>/manifests if an asset cache is configured),
+    the manifest is compiled once into an index there, and later calls open the index instead
+    of parsing the manifest. Entries of an indexed manifest are only parsed when accessed.
+    """
     if manifest_path == "gs://kubric-public/assets/ShapeNetCore.v2.json":
       raise ValueError(f"The path `{manifest_path}` is a placeholder for the real path. "
                        "Please visit https://shapenet.org, agree to terms and conditions."
                        "After logging in, you will find the manifest URL here:"
                        "https://shapenet.org/download/kubric")
 
-    manifest_path = file_io.as_path(manifest_path)
-    manifest = file_io.read_json(manifest_path)
-    name = manifest.get("name", manifest_path.stem)  # default to filename
-    data_dir = manifest.get("data_dir", manifest_path.parent)  # default to manifest dir
-    assets = manifest["assets"]
-    return cls(name=name, data_dir=data_dir, assets=assets, scratch_dir=scratch_dir)
+    if index_dir is None:
+      cache_dir = cache_dir or os.environ.get(asset_cache.CACHE_DIR_ENV)
+      if cache_dir:
+        index_dir = pathlib.Path(cache_dir) / "manifests"
+    index_path = None
+    if index_dir is not None:
+      index_path = manifest_index.index_dir_for(manifest_path, index_dir)
+
+    if index_path is not None and (index_path / "index.json").exists():
+      assets = manifest_index.IndexedManifest(index_path)
+      name, data_dir = assets.name, assets.data_dir
+    else:
+      manifest_path = file_io.as_path(manifest_path)
+      manifest = file_io.read_json(manifest_path)
+      name = manifest.get("name", manifest_path.stem)  # default to filename
+      data_dir = manifest.get("data_dir", manifest_path.parent)  # default to manifest dir
+      if index_path is not None:
+        assets = manifest_index.compile_manifest(manifest, name, data_dir, index_path)
+      else:
+        assets = manifest["assets"]
+    return cls(name=name, data_dir=data_dir, assets=assets, scratch_dir=scratch_dir,
+               cache_dir=cache_dir, max_cache_size=max_cache_size)
 
   def __init__(
       self,
       name: str,
       data_dir: PathLike,
-      assets: Dict[str, Any],
-      scratch_dir: Optional[PathLike] = None
+      assets: Mapping[str, Any],
+      scratch_dir: Optional[PathLike] = None,
+      cache_dir: Optional[PathLike] = None,
+      max_cache_size: Optional[int] = None,
   ):
+    """
+    Args:
+      name: name of the asset source.
+      data_dir: directory (or URI) of the asset archives.
+      assets: the asset entries of the manifest (a dict or an IndexedManifest).
+      scratch_dir: parent of the temporary directory the assets are extracted to.
+      cache_dir: if given, assets are extracted to this persistent AssetCache directory instead,
+        which is shared by concurrent processes and reused by later runs. Defaults to the
+        KUBRIC_ASSET_CACHE environment variable.
+      max_cache_size: maximum size of the cache in bytes (least recently used assets are
+        deleted). Defaults to KUBRIC_ASSET_CACHE_MAX_BYTES, or no limit.
+    """
     super().__init__()
     self.name = name
     self.data_dir = file_io.as_path(data_dir)
     logging.info("Created AssetSource '%s' with '%d' assets at URI='%s'",
                  name, len(assets), self.data_dir)
     self.local_dir = pathlib.Path(tempfile.mkdtemp(prefix=name, dir=scratch_dir))
+    if cache_dir is not None:
+      self.cache = asset_cache.AssetCache(cache_dir, max_size=max_cache_size)
+    else:
+      self.cache = asset_cache.default_cache()
+      if self.cache is not None and max_cache_size is not None:
+        self.cache.max_size = max_cache_size
     self._assets = assets
+    self._fetches = {}  # asset_id -> Future of the asset directory
+    self._cache_keys = {}  # asset_id -> key of its cache entry
+    self._fetched = set()  # asset ids whose fetch was used by create()
+    self._fetch_lock = threading.Lock()
+    self._prefetch_executor = None
 
   def close(self):
     if self.is_closed:
       return
     try:
+      if self._prefetch_executor is not None:
+        self._prefetch_executor.shutdown(wait=True, cancel_futures=True)
+      if self.cache is not None:
+        self.cache.release_all()
       shutil.rmtree(self.local_dir)
     finally:
+      self.is_closed = True
       super().close()
 
+  def release(self):
+    """Releases the cache entries of the assets created so far, so that they can be evicted.
+
+    Call it when the created assets have been loaded (e.g. after rendering a sequence); a later
+    create() of the same asset takes the cache entry again. Prefetched assets that have not been
+    created yet keep their cache entries.
+    """
+    if self.cache is None:
+      return
+    with self._fetch_lock:
+      done = [asset_id for asset_id in self._fetched if self._fetches[asset_id].done()]
+      for asset_id in done:
+        del self._fetches[asset_id]
+        self._fetched.discard(asset_id)
+      keys = [self._cache_keys.pop(asset_id) for asset_id in done if asset_id in self._cache_keys]
+    for key in keys:
+      self.cache.release(key)
+
   def __enter__(self):
     return self
 
@@ -110,23 +188,27 @@ class AssetSource(ClosableResource):
   @functools.cached_property
   def db(self):
     import pandas as pd
-    db = pd.DataFrame([{"id": k} | v["kwargs"] | v["metadata"]
-                       for k, v in self._assets.items()])
-
-    def get_category_id(x):
-      if x['category'] in self.categories:
-        return self.categories.index(x['category'])
-      else:
-        return np.nan
+    db = pd.DataFrame.from_records([{"id": k} | v["kwargs"] | v["metadata"]
+                                    for k, v in self._assets.items()])
 
     if "category_id" not in db:
-      db["category_id"] = db.apply(get_category_id, axis=1)
+      category_ids = {category: i for i, category in enumerate(self.categories)}
+      db["category_id"] = db["category"].map(category_ids)
     return db
 
+  @functools.cached_property
+  def _ids_by_category(self) -> Dict[str, List[str]]:
+    if isinstance(self._assets, manifest_index.IndexedManifest):
+      return self._assets.category_index
+    return manifest_index.category_index(self._assets)
+
   @functools.cached_property
   def categories(self):
-    return sorted(filter(None, {v["metadata"].get("category", "")
-                                for v in self._assets.values()}))
+    return sorted(self._ids_by_category)
+
+  def ids_for_category(self, category: str) -> List[str]:
+    """Sorted ids of all assets with the given metadata category."""
+    return list(self._ids_by_category.get(category, []))
 
   @functools.cached_property
   def all_asset_ids(self):
@@ -216,30 +298,112 @@ class AssetSource(ClosableResource):
 
     return asset
 
-  def fetch(self, asset_path, asset_id):
-    local_path = self.local_dir / (asset_id + ".tar.gz")
-    if not local_path.exists():
-      logging.debug("Copying %s to %s", str(asset_path), str(local_path))
-      local_path.parent.mkdir(parents=True, exist_ok=True)
-      tf.io.gfile.copy(asset_path, local_path)
-
-      with tarfile.open(local_path, "r:gz") as tar:
-        # We support two kinds of archives:
-        #  1. flat archives that do not contain any directories
-        #  2. archives where the content is in a directory with the name of the asset
-        list_of_files = tar.getnames()
-        if asset_id in list_of_files and tar.getmember(asset_id).isdir():
-          # tarfile contains directory with name object_id, so we can just extract
-          assert f"{asset_id}/data.json" in list_of_files, list_of_files
-          tar.extractall(self.local_dir)
+  def prefetch(self, asset_ids: Iterable[str],
+               max_workers: int = 4) -> List[concurrent.futures.Future]:
+    """Fetches and extracts assets on background threads, so that create() does not wait for them.
+
+    Assets that are already fetched (or being fetched) are not fetched again. Errors are not
+    raised here: create() retries a failed prefetch and raises if it fails again.
+
+    Args:
+      asset_ids: ids of the assets that will be created later.
+      max_workers: number of download threads (only used by the first call).
+
+    Returns:
+      A future of the asset directory for each asset id.
+    """
+    futures = []
+    for asset_id in asset_ids:
+      asset_entry = self._assets[asset_id]
+      asset_path = self._resolve_asset_path(asset_entry.get("path", ""), asset_id)
+      future, owner = self._register_fetch(asset_id)
+      if owner:
+        if asset_path is None:
+          future.set_result(None)
         else:
-          # tarfile contains files only, so extract into a new directory
-          assert "data.json" in list_of_files, list_of_files
-          tar.extractall(self.local_dir / asset_id)
-        logging.debug("Extracted %s", repr([m.name for m in tar.getmembers()]))
+          if self._prefetch_executor is None:
+            self._prefetch_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix=f"prefetch_{self.name}")
+          self._prefetch_executor.submit(self._run_fetch, future, asset_path, asset_id)
+      futures.append(future)
+    return futures
 
+  def fetch(self, asset_path, asset_id):
+    future, owner = self._register_fetch(asset_id)
+    if owner:
+      self._run_fetch(future, asset_path, asset_id)
+    else:
+      try:
+        future.result()
+      except Exception:  # pylint: disable=broad-except
+        # a prefetch (or another thread) that was still running failed: retry once here
+        future, owner = self._register_fetch(asset_id)
+        if owner:
+          self._run_fetch(future, asset_path, asset_id)
+    asset_dir = future.result()
+    with self._fetch_lock:
+      if self._fetches.get(asset_id) is future:
+        self._fetched.add(asset_id)
+    return asset_dir
+
+  def _register_fetch(self, asset_id):
+    """Returns the future of fetching asset_id and whether the caller has to run the fetch."""
+    with self._fetch_lock:
+      future = self._fetches.get(asset_id)
+      if future is not None:
+        return future, False
+      future = self._fetches[asset_id] = concurrent.futures.Future()
+      return future, True
+
+  def _run_fetch(self, future, asset_path, asset_id):
+    if not future.set_running_or_notify_cancel():
+      return
+    try:
+      future.set_result(self._fetch(asset_path, asset_id))
+    except BaseException as e:  # pylint: disable=broad-except
+      logging.warning("Fetching asset %s failed: %r", asset_id, e)
+      with self._fetch_lock:
+        self._fetches.pop(asset_id, None)  # the next fetch retries
+      future.set_exception(e)
+
+  def _fetch(self, asset_path, asset_id):
+    if self.cache is not None:
+      key = self.cache.key_for(asset_path)
+      entry_dir = self.cache.get(
+          key, lambda target_dir: self._copy_and_extract(asset_path, asset_id, target_dir))
+      with self._fetch_lock:
+        self._cache_keys[asset_id] = key
+      return entry_dir / asset_id
+
+    if not (self.local_dir / asset_id).exists():
+      self._copy_and_extract(asset_path, asset_id, self.local_dir)
     return self.local_dir / asset_id
 
+  @staticmethod
+  def _copy_and_extract(asset_path, asset_id, target_dir: pathlib.Path):
+    """Copies the archive of an asset to target_dir and extracts it to target_dir / asset_id."""
+    local_path = target_dir / (asset_id + ".tar.gz")
+    logging.debug("Copying %s to %s", str(asset_path), str(local_path))
+    local_path.parent.mkdir(parents=True, exist_ok=True)
+    tf.io.gfile.copy(asset_path, local_path, overwrite=True)
+
+    with tarfile.open(local_path, "r:gz") as tar:
+      # We support two kinds of archives:
+      #  1. flat archives that do not contain any directories
+      #  2. archives where the content is in a directory with the name of the asset
+      list_of_files = tar.getnames()
+      if asset_id in list_of_files and tar.getmember(asset_id).isdir():
+        # tarfile contains directory with name object_id, so we can just extract
+        assert f"{asset_id}/data.json" in list_of_files, list_of_files
+        tar.extractall(target_dir)
+      else:
+        # tarfile contains files only, so extract into a new directory
+        assert "data.json" in list_of_files, list_of_files
+        tar.extractall(target_dir / asset_id)
+      logging.debug("Extracted %s", repr([m.name for m in tar.getmembers()]))
+    # the extracted files are all that is needed
+    local_path.unlink()
+
   def get_test_split(self, fraction=0.1):
     """
     Generates a train/test split for the asset source.
@@ -254,5 +418,6 @@ class AssetSource(ClosableResource):
     rng = np.random.default_rng(42)
     test_size = int(round(len(self.all_asset_ids) * fraction))
     test_ids = rng.choice(self.all_asset_ids, size=test_size, replace=False)
-    train_ids = [i for i in self.all_asset_ids if i not in test_ids]
+    test_set = set(test_ids)
+    train_ids = [i for i in self.all_asset_ids if i not in test_set]
     return train_ids, test_ids
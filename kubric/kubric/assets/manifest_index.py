@@ -0,0 +1,135 @@
+# Copyright 2024 The Kubric Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Precompiled, memory-mapped index of asset manifests.
+
+A manifest is compiled once into a directory with
+  entries.jsonl  one JSON line per asset entry, in the order of the ids
+  offsets.npy    int64 array, entry i is stored at bytes offsets[i]:offsets[i+1] of entries.jsonl
+  index.json     name, data_dir, the asset ids and a mapping of category -> asset ids
+Opening an index only reads index.json, entries are parsed when they are accessed.
+"""
+
+import collections.abc
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import shutil
+import tempfile
+from typing import Any, Dict, Iterator, List
+
+import numpy as np
+import tensorflow as tf
+
+from kubric import file_io
+from kubric.kubric_typing import PathLike
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+
+
+class IndexedManifest(collections.abc.Mapping):
+  """Read-only mapping asset_id -> manifest entry, backed by a compiled index directory."""
+
+  def __init__(self, index_dir: PathLike):
+    self.index_dir = pathlib.Path(index_dir)
+    index = file_io.read_json(self.index_dir / "index.json")
+    if index.get("version") != INDEX_VERSION:
+      raise ValueError(f"Unsupported manifest index version {index.get('version')!r} "
+                       f"in {self.index_dir}")
+    self.name = index["name"]
+    self.data_dir = index["data_dir"]
+    self._ids = index["ids"]
+    self._positions = {asset_id: i for i, asset_id in enumerate(self._ids)}
+    self._categories = index["categories"]
+    self._offsets = np.load(self.index_dir / "offsets.npy", mmap_mode="r")
+    entries_path = self.index_dir / "entries.jsonl"
+    if os.path.getsize(entries_path) > 0:
+      self._entries = np.memmap(entries_path, dtype=np.uint8, mode="r")
+    else:
+      self._entries = np.zeros(0, dtype=np.uint8)
+
+  def __getitem__(self, asset_id: str) -> Dict[str, Any]:
+    i = self._positions[asset_id]
+    start, end = int(self._offsets[i]), int(self._offsets[i + 1])
+    # every access returns a new dict, so callers can modify it
+    return json.loads(self._entries[start:end].tobytes())
+
+  def __contains__(self, asset_id) -> bool:
+    return asset_id in self._positions
+
+  def __iter__(self) -> Iterator[str]:
+    return iter(self._ids)
+
+  def __len__(self) -> int:
+    return len(self._ids)
+
+  @property
+  def category_index(self) -> Dict[str, List[str]]:
+    """Mapping category -> sorted asset ids."""
+    return self._categories
+
+
+def category_index(assets: Dict[str, Dict[str, Any]]) -> Dict[str, List[str]]:
+  """Mapping category -> sorted asset ids (assets without category are left out)."""
+  categories = collections.defaultdict(list)
+  for asset_id in sorted(assets):
+    category = assets[asset_id].get("metadata", {}).get("category", "")
+    if category:
+      categories[category].append(asset_id)
+  return dict(categories)
+
+
+def compile_manifest(manifest: Dict[str, Any], name: str, data_dir: str,
+                     index_dir: PathLike) -> IndexedManifest:
+  """Writes the index of a parsed manifest to index_dir (atomically) and opens it."""
+  index_dir = pathlib.Path(index_dir)
+  index_dir.parent.mkdir(parents=True, exist_ok=True)
+  assets = manifest["assets"]
+  ids = sorted(assets)
+
+  tmp_dir = pathlib.Path(tempfile.mkdtemp(prefix=index_dir.name + ".", suffix=".tmp",
+                                          dir=index_dir.parent))
+  try:
+    offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+    with open(tmp_dir / "entries.jsonl", "wb") as f:
+      for i, asset_id in enumerate(ids):
+        line = json.dumps(assets[asset_id]).encode("utf-8") + b"\n"
+        f.write(line)
+        offsets[i + 1] = offsets[i] + len(line)
+    np.save(tmp_dir / "offsets.npy", offsets)
+    file_io.write_json({"version": INDEX_VERSION, "name": name, "data_dir": str(data_dir),
+                        "ids": ids, "categories": category_index(assets)},
+                       tmp_dir / "index.json")
+    try:
+      os.rename(tmp_dir, index_dir)
+    except OSError:
+      # compiled concurrently by another process
+      if not (index_dir / "index.json").exists():
+        raise
+  finally:
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+  logger.info("Compiled manifest index of %d assets to %s", len(ids), index_dir)
+  return IndexedManifest(index_dir)
+
+
+def index_dir_for(manifest_path: PathLike, root: PathLike) -> pathlib.Path:
+  """Directory of the compiled index of a manifest (changes when the manifest file changes)."""
+  manifest_path = str(manifest_path)
+  stat = tf.io.gfile.stat(manifest_path)
+  h = hashlib.sha256()
+  h.update(json.dumps([manifest_path, stat.length, stat.mtime_nsec, INDEX_VERSION]).encode())
+  return pathlib.Path(root) / h.hexdigest()[:32]
@@ -16,6 +16,7 @@
 
 import collections
 import contextlib
+from typing import Any, Iterator, Sequence
 
 import munch
 import numpy as np
@@ -24,6 +25,158 @@ import traitlets as tl
 from kubric.utils import next_global_count
 
 
+def _object_array(values) -> np.ndarray:
+  """1D object array of the given values (rows, if values is a multi-dimensional array)."""
+  array = np.empty(len(values), dtype=object)
+  array[:] = list(values)
+  return array
+
+
+class KeyframeTrack:
+  """Keyframes of one animated trait, stored as a sorted frame array and an array of values.
+
+  Behaves like a dict frame -> value (for single keyframes) and additionally supports inserting
+  many keyframes at once (update) and vectorized interpolation over many frames (interpolate).
+  Values of non-numeric traits (e.g. materials) are stored in an object array.
+  """
+
+  def __init__(self):
+    self._frames = np.zeros(0, dtype=np.int64)
+    self._values = None
+    self._size = 0
+
+  @property
+  def frames(self) -> np.ndarray:
+    return self._frames[:self._size]
+
+  @property
+  def values(self) -> np.ndarray:
+    return self._values[:self._size]
+
+  def __len__(self) -> int:
+    return self._size
+
+  def __iter__(self) -> Iterator[int]:
+    return iter(self.frames.tolist())
+
+  def keys(self):
+    return self.frames.tolist()
+
+  def items(self):
+    return zip(self.frames.tolist(), self.values)
+
+  def _find(self, frame) -> int:
+    """Index of frame, or -1 if there is no keyframe at frame."""
+    i = int(np.searchsorted(self.frames, frame))
+    return i if i < self._size and self._frames[i] == frame else -1
+
+  def __contains__(self, frame) -> bool:
+    return self._find(frame) >= 0
+
+  def __getitem__(self, frame):
+    i = self._find(frame)
+    if i < 0:
+      raise KeyError(frame)
+    return self._values[i]
+
+  @staticmethod
+  def _as_array(values) -> np.ndarray:
+    # numeric values (numbers, vectors, colors, ...) are stacked, anything else (e.g. materials)
+    # is kept as is in an object array
+    try:
+      array = np.asarray(values)
+    except (ValueError, TypeError):
+      return _object_array(values)
+    if array.dtype.kind in "biuf":
+      return array
+    return _object_array(values)
+
+  def _reserve(self, size: int, value_array: np.ndarray):
+    if self._values is None:
+      self._values = np.empty((0,) + value_array.shape[1:], dtype=value_array.dtype)
+    elif (self._values.dtype != value_array.dtype or
+          self._values.shape[1:] != value_array.shape[1:]):
+      if self._values.dtype != object and self._values.shape[1:] == value_array.shape[1:]:
+        dtype = np.result_type(self._values.dtype, value_array.dtype)
+      else:
+        dtype = object
+      self._values = (_object_array(self._values) if dtype == object
+                      else self._values.astype(dtype))
+    if size > len(self._frames):
+      capacity = max(size, 2 * len(self._frames), 4)
+      frames = np.zeros(capacity, dtype=np.int64)
+      frames[:self._size] = self.frames
+      values = np.empty((capacity,) + self._values.shape[1:], dtype=self._values.dtype)
+      values[:self._size] = self.values
+      self._frames, self._values = frames, values
+
+  def __setitem__(self, frame, value):
+    self.update([frame], [value])
+
+  def update(self, frames: Sequence[int], values: Sequence[Any]):
+    """Inserts (or overwrites) keyframes at the given frames."""
+    frames = np.asarray(frames, dtype=np.int64)
+    if frames.size == 0:
+      return
+    values = self._as_array(values)
+    self._reserve(self._size + len(frames), values)
+    if self._values.dtype == object:
+      values = _object_array(values)
+
+    if self._size == 0 or (frames[0] > self._frames[self._size - 1] and
+                           np.all(frames[1:] > frames[:-1])):
+      # fast path: appending sorted frames (e.g. inserting keyframes frame by frame)
+      self._frames[self._size:self._size + len(frames)] = frames
+      self._values[self._size:self._size + len(frames)] = values
+      self._size += len(frames)
+      return
+
+    # merge; for duplicate frames the last given value wins
+    all_frames = np.concatenate([self.frames, frames])
+    all_values = np.concatenate([self.values, values.astype(self._values.dtype)])
+    order = np.argsort(all_frames, kind="stable")
+    all_frames, all_values = all_frames[order], all_values[order]
+    last = np.append(all_frames[1:] != all_frames[:-1], True)
+    num = int(last.sum())
+    self._frames[:num] = all_frames[last]
+    self._values[:num] = all_values[last]
+    self._size = num
+
+  def interpolate(self, frames: Sequence[float], interpolation: str = "linear") -> np.ndarray:
+    """Values at all given frames (interpolated between and held constant outside keyframes)."""
+    frames = np.asarray(frames)
+    keyframes, values = self.frames, self.values
+    right = np.searchsorted(keyframes, frames)
+    right_c = np.minimum(right, self._size - 1)
+    left_c = np.maximum(right - 1, 0)
+    exact = keyframes[right_c] == frames
+    # outside of the keyframes (and at keyframes) use the closest keyframe
+    outside = exact | (right == 0) | (right == self._size)
+    closest = np.where(exact | (right == 0), right_c, left_c)
+
+    if interpolation == "const":
+      idx = np.where(outside, closest, left_c)
+    elif interpolation == "nearest":
+      take_left = np.abs(frames - keyframes[left_c]) <= np.abs(frames - keyframes[right_c])
+      idx = np.where(outside, closest, np.where(take_left, left_c, right_c))
+    elif interpolation == "linear" and values.dtype == object:
+      # objects (e.g. materials) cannot be mixed
+      idx = np.where(outside, closest, left_c)
+    elif interpolation == "linear":
+      # float tracks keep their dtype, values at and outside keyframes are returned unchanged
+      dtype = values.dtype if np.issubdtype(values.dtype, np.floating) else np.float64
+      result = values[np.where(outside, closest, left_c)].astype(dtype)
+      inner = ~outside
+      left_frames, right_frames = keyframes[left_c[inner]], keyframes[right_c[inner]]
+      mixing = ((frames[inner] - left_frames) / (right_frames - left_frames)).astype(dtype)
+      mixing = mixing.reshape(mixing.shape + (1,) * (values.ndim - 1))
+      result[inner] = (1 - mixing) * result[inner] + mixing * values[right_c[inner]]
+      return result
+    else:
+      raise ValueError(f"Unknown interpolation '{interpolation}'")
+    return values[idx]
+
+
 class Asset(tl.HasTraits):
   """ Base class for the entire OO interface in Kubric.
   All objects, materials, lights, and cameras inherit from Asset.
@@ -61,7 +214,7 @@ class Asset(tl.HasTraits):
     self.scenes = []
     # """Docstring for scenes TODO (klausg)."""
 
-    self.keyframes = collections.defaultdict(dict)
+    self.keyframes = collections.defaultdict(KeyframeTrack)
     # """Docstring for keyframes TODO (klausg)."""
 
     # --- Initialize traits
@@ -91,6 +244,30 @@ class Asset(tl.HasTraits):
     self.notify_change(munch.Munch(name=member,
                                    owner=self,
                                    frame=frame,
+                                   frames=(frame,),
+                                   frame_values=(self.keyframes[member][frame],),
+                                   type="keyframe"))
+
+  def set_keyframes(self, member: str, frames: Sequence[int], values: Sequence[Any]):
+    """Inserts keyframes with the given values for many frames at once.
+
+    Unlike calling keyframe_insert for every frame, this neither changes the current value of
+    member nor notifies the observers once per frame: they receive a single "keyframe" change
+    with the lists `frames` and `frame_values` (and without `frame`).
+    """
+    if not self.has_trait(member):
+      raise KeyError(f"Unknown member '{member}'")
+    if len(frames) != len(values):
+      raise ValueError(f"Got {len(frames)} frames but {len(values)} values for '{member}'")
+    trait = self.traits()[member]
+    values = tuple(trait.validate(self, value) for value in values)
+    frames = tuple(int(frame) for frame in frames)
+    self.keyframes[member].update(frames, values)
+
+    self.notify_change(munch.Munch(name=member,
+                                   owner=self,
+                                   frames=frames,
+                                   frame_values=values,
                                    type="keyframe"))
 
   @contextlib.contextmanager
@@ -117,38 +294,16 @@ class Asset(tl.HasTraits):
     if name not in self.keyframes:
       # no animation data found, try retrieving static value
       return getattr(self, name)
-    keyframes = self.keyframes[name]
-
-    if frame in keyframes:
-      return keyframes[frame]
-
-    available_frames = sorted(keyframes.keys())
-    right_idx = np.searchsorted(available_frames, frame)
-    if right_idx == 0:
-      return keyframes[available_frames[0]]
-    if right_idx == len(available_frames):
-      return keyframes[available_frames[-1]]
-    left_frame, right_frame = available_frames[right_idx-1], available_frames[right_idx]
-
-    if interpolation == "const":
-      return keyframes[left_frame]
-    elif interpolation == "nearest":
-      if abs(frame - left_frame) <= abs(frame - right_frame):
-        return keyframes[left_frame]
-      else:
-        return keyframes[right_frame]
-    elif interpolation == "linear":
-      mixing = (frame - left_frame) / (right_frame - left_frame)
-      left_val = np.array(keyframes[left_frame])
-      right_val = np.array(keyframes[right_frame])
-      return (1-mixing) * left_val + mixing * right_val
+    return self.keyframes[name].interpolate([frame], interpolation=interpolation)[0]
 
   def get_values_over_time(self, name, frames=None, interpolation="linear"):
     if frames is None:
       frames = list(range(self.active_scene.frame_start,
                           self.active_scene.frame_end+1))
-    return np.array([self.get_value_at(name, frame=f, interpolation=interpolation)
-                     for f in frames], dtype=np.float32)
+    if name not in self.keyframes:
+      return np.array([getattr(self, name)] * len(frames), dtype=np.float32)
+    return np.asarray(self.keyframes[name].interpolate(frames, interpolation=interpolation),
+                      dtype=np.float32)
 
   def __hash__(self):
     return hash(self.uid)
@@ -14,6 +14,8 @@
 
 # pylint: disable=line-too-long, unexpected-keyword-arg
 """TODO(klausg): description."""
+import concurrent.futures
+import functools
 import json
 
 import numpy as np
@@ -21,17 +23,79 @@ import tensorflow as tf
 import tensorflow_datasets as tfds
 
 from kubric import file_io
+from kubric import sequence_store
 
 DEFAULT_LAYERS = ("rgba", "segmentation", "forward_flow", "backward_flow",
                   "depth", "normal", "object_coordinates")
 
-def load_scene_directory(scene_dir, target_size, layers=DEFAULT_LAYERS):
+def _read_frame(path):
+  if path.suffix == ".tiff":
+    return file_io.read_tiff(path)
+  return file_io.read_png(path)
+
+
+def _decode_and_subsample(path, channels, subsample):
+  return subsample(_read_frame(path)[..., :channels])
+
+
+def _submit_layer_files(executor, scene_dir, num_frames, key, channels, subsample):
+  """Submits decoding (and subsampling) every frame of a layer, returns the futures in frame order."""
+  suffix = "tiff" if key == "depth" else "png"
+  return [executor.submit(_decode_and_subsample, scene_dir / f"{key}_{f:05d}.{suffix}",
+                          channels, subsample)
+          for f in range(num_frames)]
+
+
+def _stack_frames(futures):
+  """Collects the decoded frames of a layer into a preallocated (num_frames, H, W, C) array."""
+  first = futures[0].result()
+  frames = np.empty((len(futures),) + first.shape, dtype=first.dtype)
+  frames[0] = first
+  for i, future in enumerate(futures[1:], start=1):
+    frames[i] = future.result()
+  return frames
+
+
+def _as_png_values(frame):
+  """The values that reading the frame back from the png written by file_io would give."""
+  if frame.dtype in [np.float32, np.float64]:
+    return (frame * 65535).astype(np.uint16)
+  if frame.dtype in [np.uint32, np.uint64]:
+    return frame.astype(np.uint16)
+  return np.asarray(frame)
+
+
+def _read_layer_store(store, data_ranges, key, channels, target_size, average):
+  """All frames of a layer in a sequence store, converted like the png/tiff writers would."""
+  frames = store[key][..., :channels]
+  if not average:
+    # nearest neighbour only selects pixels, so subsampling before the (elementwise) conversion
+    # gives the same result and converts far fewer values
+    frames = subsample_nearest_neighbor(frames, target_size)
+  if key == "depth":
+    frames = np.array(frames)
+  elif key in data_ranges:  # flow: quantized with the range over the whole sequence
+    min_value, max_value = data_ranges[key]["min"], data_ranges[key]["max"]
+    frames = ((frames - min_value) * 65535 / (max_value - min_value)).astype(np.uint16)
+  elif key == "segmentation":
+    frames = frames.astype(np.uint8)
+  else:
+    frames = _as_png_values(frames)
+  if average:
+    frames = subsample_avg(frames, target_size)
+  return frames
+
+
+def load_scene_directory(scene_dir, target_size, layers=DEFAULT_LAYERS, max_read_threads=16):
+  """Loads a scene written as per-frame png/tiff files or as a (local) sequence store.
+
+  Only the given layers are read. Png/tiff frames of all layers are decoded (and subsampled)
+  concurrently by max_read_threads threads; every layer is returned as a single
+  (num_frames, height, width, channels) array.
+  """
   scene_dir = file_io.as_path(scene_dir)
   example_key = f"{scene_dir.name}"
 
-  with tf.io.gfile.GFile(str(scene_dir / "data_ranges.json"), "r") as fp:
-    data_ranges = json.load(fp)
-
   with tf.io.gfile.GFile(str(scene_dir / "metadata.json"), "r") as fp:
     metadata = json.load(fp)
 
@@ -60,16 +124,35 @@ def load_scene_directory(scene_dir, target_size, layers=DEFAULT_LAYERS):
   scale = resolution[1] / target_size[0]
   assert scale == resolution[1] // target_size[0]
 
-  paths = {
-      key: [scene_dir / f"{key}_{f:05d}.png" for f in range(num_frames)]
-      for key in layers if key != "depth"
-  }
+  # layer -> (channels to keep, average instead of nearest neighbour subsampling)
+  layer_specs = {key: (None, False) for key in layers}
+  for key in ["forward_flow", "backward_flow"]:
+    if key in layer_specs:
+      layer_specs[key] = (2, False)
+  if "rgba" in layer_specs:
+    layer_specs["rgba"] = (3, True)
+
+  if sequence_store.is_sequence_store(scene_dir):
+    store = sequence_store.SequenceStore(scene_dir)
+    data_ranges = {}
+    for key in ["forward_flow", "backward_flow"]:
+      if key in layers:
+        data_ranges[key] = {"min": float(np.min(store[key])), "max": float(np.max(store[key]))}
+    frames = {key: _read_layer_store(store, data_ranges, key, channels, target_size, average)
+              for key, (channels, average) in layer_specs.items()}
+  else:
+    with tf.io.gfile.GFile(str(scene_dir / "data_ranges.json"), "r") as fp:
+      data_ranges = json.load(fp)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_read_threads) as executor:
+      futures = {}
+      for key, (channels, average) in layer_specs.items():
+        subsample = subsample_avg if average else subsample_nearest_neighbor
+        futures[key] = _submit_layer_files(executor, scene_dir, num_frames, key, channels,
+                                           functools.partial(subsample, size=target_size))
+      frames = {key: _stack_frames(layer_futures) for key, layer_futures in futures.items()}
 
   if "depth" in layers:
-    depth_paths = [scene_dir / f"depth_{f:05d}.tiff" for f in range(num_frames)]
-    depth_frames = np.array([
-      subsample_nearest_neighbor(file_io.read_tiff(frame_path), target_size)
-      for frame_path in depth_paths])
+    depth_frames = frames["depth"]
     depth_min, depth_max = np.min(depth_frames), np.max(depth_frames)
     result["depth"] = convert_float_to_uint16(depth_frames, depth_min, depth_max)
     result["metadata"]["depth_range"] = [depth_min, depth_max]
@@ -78,39 +161,25 @@ def load_scene_directory(scene_dir, target_size, layers=DEFAULT_LAYERS):
     result["metadata"]["forward_flow_range"] = [
         data_ranges["forward_flow"]["min"] / scale,
         data_ranges["forward_flow"]["max"] / scale]
-    result["forward_flow"] = [
-        subsample_nearest_neighbor(file_io.read_png(frame_path)[..., :2],
-                                   target_size)
-        for frame_path in paths["forward_flow"]]
+    result["forward_flow"] = frames["forward_flow"]
 
   if "backward_flow" in layers:
     result["metadata"]["backward_flow_range"] = [
         data_ranges["backward_flow"]["min"] / scale,
         data_ranges["backward_flow"]["max"] / scale]
-    result["backward_flow"] = [
-        subsample_nearest_neighbor(file_io.read_png(frame_path)[..., :2],
-                                   target_size)
-        for frame_path in paths["backward_flow"]]
+    result["backward_flow"] = frames["backward_flow"]
 
   for key in ["normal", "object_coordinates", "uv"]:
     if key in layers:
-      result[key] = [
-          subsample_nearest_neighbor(file_io.read_png(frame_path),
-                                     target_size)
-        for frame_path in paths[key]]
+      result[key] = frames[key]
 
   if "segmentation" in layers:
     # somehow we ended up calling this "segmentations" in TFDS and
     # "segmentation" in kubric. So we have to treat it separately.
-    result["segmentations"] = [
-        subsample_nearest_neighbor(file_io.read_png(frame_path),
-                                   target_size)
-        for frame_path in paths["segmentation"]]
+    result["segmentations"] = frames["segmentation"]
 
   if "rgba" in layers:
-    result["video"] = [
-        subsample_avg(file_io.read_png(frame_path), target_size)[..., :3]
-        for frame_path in paths["rgba"]]
+    result["video"] = frames["rgba"]
 
   return example_key, result, metadata
 
@@ -208,7 +277,8 @@ def format_instance_information(obj):
 
 
 def subsample_nearest_neighbor(arr, size):
-  src_height, src_width, _ = arr.shape
+  """Subsamples a (H, W, C) frame or a (..., H, W, C) stack of frames (returns a view)."""
+  src_height, src_width, _ = arr.shape[-3:]
   dst_height, dst_width = size
   height_step = src_height // dst_height
   width_step = src_width // dst_width
@@ -217,7 +287,7 @@ def subsample_nearest_neighbor(arr, size):
 
   height_offset = int(np.floor((height_step-1)/2))
   width_offset = int(np.floor((width_step-1)/2))
-  subsampled = arr[height_offset::height_step, width_offset::width_step, :]
+  subsampled = arr[..., height_offset::height_step, width_offset::width_step, :]
   return subsampled
 
 
@@ -227,18 +297,24 @@ def convert_float_to_uint16(array, min_val, max_val):
 
 
 def subsample_avg(arr, size):
-  src_height, src_width, channels = arr.shape
+  """Averages (H, W, C) frames or (..., H, W, C) stacks of frames over size bins."""
+  src_height, src_width, channels = arr.shape[-3:]
   dst_height, dst_width = size
   height_bin = src_height // dst_height
   width_bin = src_width // dst_width
-  return np.round(arr.reshape((dst_height, height_bin,
-                               dst_width, width_bin,
-                               channels)).mean(axis=(1, 3))).astype(np.uint8)
+  return np.round(arr.reshape(arr.shape[:-3] + (dst_height, height_bin,
+                                                dst_width, width_bin,
+                                                channels)).mean(axis=(-4, -2))).astype(np.uint8)
 
 
 def is_complete_dir(video_dir, layers=DEFAULT_LAYERS):
   video_dir = file_io.as_path(video_dir)
   filenames = [d.name for d in video_dir.iterdir()]
+  if sequence_store.STORE_FILE in filenames:
+    if not ("metadata.json" in filenames and "events.json" in filenames):
+      return False
+    store = sequence_store.SequenceStore(video_dir)
+    return all(key in store for key in layers)
   if not ("data_ranges.json" in filenames and
           "metadata.json" in filenames and
           "events.json" in filenames):
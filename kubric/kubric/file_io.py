@@ -12,13 +12,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import atexit
+import concurrent.futures
 import contextlib
 import functools
 import logging
 import json
 import multiprocessing
 import pickle
-from typing import Any, Dict
+import threading
+from typing import Any, Dict, Optional
 
 from etils import epath
 import imageio
@@ -76,8 +79,11 @@ class _NumpyEncoder(json.JSONEncoder):
     return json.JSONEncoder.default(self, o)
 
 
-def write_png(data: np.array, filename: PathLike) -> None:
-  """Writes data as a png file (and convert datatypes if necessary)."""
+def write_png(data: np.array, filename: PathLike, compression: Optional[int] = None) -> None:
+  """Writes data as a png file (and convert datatypes if necessary).
+
+  compression is the zlib compression level (0-9, lower is faster), None uses the default (6).
+  """
 
   if data.dtype in [np.uint32, np.uint64]:
     max_value = np.amax(data)
@@ -104,7 +110,8 @@ def write_png(data: np.array, filename: PathLike) -> None:
   height, width, channels = data.shape
   greyscale = (channels == 1)
   alpha = (channels == 4)
-  w = png.Writer(width=width, height=height, greyscale=greyscale, bitdepth=bitdepth, alpha=alpha)
+  w = png.Writer(width=width, height=height, greyscale=greyscale, bitdepth=bitdepth, alpha=alpha,
+                 compression=compression)
 
   if channels == 2:
     # Pad two-channel images with a zero channel.
@@ -118,7 +125,7 @@ def write_png(data: np.array, filename: PathLike) -> None:
 
 
 def write_palette_png(data: np.array, filename: PathLike,
-                      palette: np.ndarray = None):
+                      palette: np.ndarray = None, compression: Optional[int] = None):
   """Writes grayscale data as pngs to path using a fixed palette (e.g. for segmentations)."""
   assert data.ndim == 3, data.shape
   height, width, channels = data.shape
@@ -138,7 +145,8 @@ def write_palette_png(data: np.array, filename: PathLike,
   if palette is None:
     palette = plotting.hls_palette(np.max(data) + 1)
 
-  w = png.Writer(width=width, height=height, palette=palette, bitdepth=8)
+  w = png.Writer(width=width, height=height, palette=palette, bitdepth=8,
+                 compression=compression)
   with gopen(filename, "wb") as fp:
     w.write(fp, data[:, :, 0])
 
@@ -186,12 +194,21 @@ def read_png(filename: PathLike, rescale_range=None) -> np.ndarray:
   return pngdata.reshape((height, width, plane_count))
 
 
-def write_tiff(data: np.ndarray, filename: PathLike):
-  """Save data as as tif image (which natively supports float values)."""
+def write_tiff(data: np.ndarray, filename: PathLike, compression: Optional[int] = None):
+  """Save data as as tif image (which natively supports float values).
+
+  compression is the zlib compression level (0-9), None writes an uncompressed tif.
+  """
   assert data.ndim == 3, data.shape
   assert data.shape[2] in [1, 3, 4], "Must be grayscale, RGB, or RGBA"
 
-  img_as_bytes = imageio.imwrite("<bytes>", data, format="tiff")
+  if compression is None:
+    img_as_bytes = imageio.imwrite("<bytes>", data, format="tiff")
+  else:
+    writer = imageio.get_writer("<bytes>", format="tiff")
+    writer.append_data(data, {"compression": "zlib", "compressionargs": {"level": compression}})
+    writer.close()
+    img_as_bytes = writer.request.get_result()
   filename = as_path(filename)
   filename.write_bytes(img_as_bytes)
 
@@ -204,9 +221,49 @@ def read_tiff(filename: PathLike) -> np.ndarray:
   return img
 
 
+_write_executors = {}
+_write_executors_lock = threading.Lock()
+
+
+def get_write_executor(max_workers: int = 16,
+                       use_processes: bool = False) -> concurrent.futures.Executor:
+  """Long-lived executor shared by all image writers (created on first use).
+
+  Encoding pngs is mostly CPU-bound Python code (pypng), so with use_processes=True images are
+  encoded by a pool of (spawned) worker processes instead of threads. Spawning is not free: every
+  worker imports kubric, and with it TensorFlow (a few seconds each), as well as the main module
+  of the program if it has one. The pool is kept for the lifetime of the process, so processes
+  only pay off when many frames are written; short runs should stick to threads.
+  """
+  key = (use_processes, max_workers)
+  with _write_executors_lock:
+    executor = _write_executors.get(key)
+    if executor is None:
+      if use_processes:
+        executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+      else:
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers,
+                                                         thread_name_prefix="kubric_write")
+      _write_executors[key] = executor
+    return executor
+
+
+def shutdown_write_executors(wait: bool = True) -> None:
+  """Shuts down the shared writer executors (they are recreated when needed again)."""
+  with _write_executors_lock:
+    executors = list(_write_executors.values())
+    _write_executors.clear()
+  for executor in executors:
+    executor.shutdown(wait=wait)
+
+
+atexit.register(shutdown_write_executors)
+
+
 def multi_write_image(data: np.ndarray, path_template: str, write_fn=write_png,
-                      max_write_threads=16, **kwargs):
-  """Write a batch of images to a series of files using a ThreadPool.
+                      max_write_threads=16, use_processes=False, **kwargs):
+  """Write a batch of images to a series of files using the shared writer executor.
   Args:
     data: Batch of images to write. Shape = (batch_size, height, width, channels)
     path_template: a template for the filenames (e.g. "rgb_frame_{:05d}.png").
@@ -215,72 +272,79 @@ def multi_write_image(data: np.ndarray, path_template: str, write_fn=write_png,
       Must take an image array as its first and a filename as its second argument.
       May take other keyword arguments. (Defaults to the write_png function)
     max_write_threads: number of threads to use for writing images. (default = 16)
+    use_processes: encode the images in worker processes instead of threads.
     **kwargs: additional kwargs to pass to the write_fn.
   """
-  num_threads = min(data.shape[0], max_write_threads)
-  with multiprocessing.pool.ThreadPool(num_threads) as pool:
-    args = [(img, path_template.format(i)) for i, img in enumerate(data)]
-
-    def write_single_image_fn(arg):
-      write_fn(*arg, **kwargs)
+  executor = get_write_executor(max_write_threads, use_processes)
+  futures = [executor.submit(write_fn, img, path_template.format(i), **kwargs)
+             for i, img in enumerate(data)]
+  concurrent.futures.wait(futures)
+  for future in futures:
+    future.result()  # re-raises the exception of a failed write
 
-    for result in pool.imap_unordered(write_single_image_fn, args):
-      if isinstance(result,  Exception):
-        logger.warning("Exception while writing image %s", result)
 
-    pool.close()
-    pool.join()
-
-
-def write_rgb_batch(data, directory, file_template="rgb_{:05d}.png", max_write_threads=16):
+def write_rgb_batch(data, directory, file_template="rgb_{:05d}.png", max_write_threads=16,
+                    compression=None, use_processes=False):
   assert data.ndim == 4 and data.shape[-1] == 3, data.shape
   path_template = str(as_path(directory) / file_template)
-  multi_write_image(data, path_template, write_fn=write_png, max_write_threads=max_write_threads)
+  multi_write_image(data, path_template, write_fn=write_png, max_write_threads=max_write_threads,
+                    use_processes=use_processes, compression=compression)
 
 
-def write_rgba_batch(data, directory, file_template="rgba_{:05d}.png", max_write_threads=16):
+def write_rgba_batch(data, directory, file_template="rgba_{:05d}.png", max_write_threads=16,
+                     compression=None, use_processes=False):
   assert data.ndim == 4 and data.shape[-1] == 4, data.shape
   path_template = str(as_path(directory) / file_template)
-  multi_write_image(data, path_template, write_fn=write_png, max_write_threads=max_write_threads)
+  multi_write_image(data, path_template, write_fn=write_png, max_write_threads=max_write_threads,
+                    use_processes=use_processes, compression=compression)
 
 
-def write_uv_batch(data, directory, file_template="uv_{:05d}.png", max_write_threads=16):
+def write_uv_batch(data, directory, file_template="uv_{:05d}.png", max_write_threads=16,
+                   compression=None, use_processes=False):
   assert data.ndim == 4 and data.shape[-1] == 3, data.shape
   path_template = str(as_path(directory) / file_template)
-  multi_write_image(data, path_template, write_fn=write_png, max_write_threads=max_write_threads)
+  multi_write_image(data, path_template, write_fn=write_png, max_write_threads=max_write_threads,
+                    use_processes=use_processes, compression=compression)
 
 
-def write_normal_batch(data, directory, file_template="normal_{:05d}.png", max_write_threads=16):
+def write_normal_batch(data, directory, file_template="normal_{:05d}.png", max_write_threads=16,
+                       compression=None, use_processes=False):
   assert data.ndim == 4 and data.shape[-1] == 3, data.shape
   path_template = str(as_path(directory) / file_template)
-  multi_write_image(data, path_template, write_fn=write_png, max_write_threads=max_write_threads)
+  multi_write_image(data, path_template, write_fn=write_png, max_write_threads=max_write_threads,
+                    use_processes=use_processes, compression=compression)
 
 
 def write_coordinates_batch(data, directory, file_template="object_coordinates_{:05d}.png",
-                            max_write_threads=16):
+                            max_write_threads=16, compression=None, use_processes=False):
   assert data.ndim == 4 and data.shape[-1] == 3, data.shape
   path_template = str(as_path(directory) / file_template)
-  multi_write_image(data, path_template, write_fn=write_png, max_write_threads=max_write_threads)
+  multi_write_image(data, path_template, write_fn=write_png, max_write_threads=max_write_threads,
+                    use_processes=use_processes, compression=compression)
 
 
-def write_depth_batch(data, directory, file_template="depth_{:05d}.tiff", max_write_threads=16):
+def write_depth_batch(data, directory, file_template="depth_{:05d}.tiff", max_write_threads=16,
+                      compression=None, use_processes=False):
   assert data.ndim == 4 and data.shape[-1] == 1, data.shape
   path_template = str(as_path(directory) / file_template)
-  multi_write_image(data, path_template, write_fn=write_tiff, max_write_threads=max_write_threads)
+  multi_write_image(data, path_template, write_fn=write_tiff, max_write_threads=max_write_threads,
+                    use_processes=use_processes, compression=compression)
 
 
 def write_segmentation_batch(data, directory, file_template="segmentation_{:05d}.png",
-                             max_write_threads=16):
+                             max_write_threads=16, compression=None, use_processes=False):
   assert data.ndim == 4 and data.shape[-1] == 1, data.shape
   assert data.dtype in [np.uint8, np.uint16, np.uint32, np.uint64], data.dtype
   path_template = str(as_path(directory) / file_template)
   palette = plotting.hls_palette(np.max(data) + 1)
   multi_write_image(data, path_template, write_fn=write_palette_png,
-                    max_write_threads=max_write_threads, palette=palette)
+                    max_write_threads=max_write_threads, use_processes=use_processes,
+                    palette=palette, compression=compression)
 
 
 def write_flow_batch(data, directory, file_template="flow_{:05d}.png", name="flow",
-                     max_write_threads=16, range_file="data_ranges.json"):
+                     max_write_threads=16, range_file="data_ranges.json", compression=None,
+                     use_processes=False):
   assert data.ndim == 4 and data.shape[-1] == 2, data.shape
   assert data.dtype in [np.float32, np.float64], data.dtype
   directory = as_path(directory)
@@ -292,7 +356,8 @@ def write_flow_batch(data, directory, file_template="flow_{:05d}.png", name="flo
   data = (data - min_value) * 65535 / (max_value - min_value)
   data = data.astype(np.uint16)
   multi_write_image(data, path_template, write_fn=write_png,
-                    max_write_threads=max_write_threads)
+                    max_write_threads=max_write_threads, use_processes=use_processes,
+                    compression=compression)
 
   if range_file_path.exists():
     ranges = read_json(range_file_path)
@@ -322,10 +387,165 @@ DEFAULT_WRITERS = {
 
 
 def write_image_dict(data_dict: Dict[str, np.ndarray], directory: PathLike,
-                     file_templates: Dict[str, str] = (), max_write_threads=16):
+                     file_templates: Dict[str, str] = (), max_write_threads=16,
+                     compression=None, use_processes=False):
   for key, data in data_dict.items():
+    kwargs = dict(max_write_threads=max_write_threads, compression=compression,
+                  use_processes=use_processes)
     if key in file_templates:
-      DEFAULT_WRITERS[key](data, directory, file_template=file_templates[key],
-                           max_write_threads=max_write_threads)
-    else:
-      DEFAULT_WRITERS[key](data, directory, max_write_threads=max_write_threads)
+      kwargs["file_template"] = file_templates[key]
+    DEFAULT_WRITERS[key](data, directory, **kwargs)
+
+
+# write function and default file template of a single frame of each layer
+FRAME_WRITERS = {
+    "rgb": (write_png, "rgb_{:05d}.png"),
+    "rgba": (write_png, "rgba_{:05d}.png"),
+    "depth": (write_tiff, "depth_{:05d}.tiff"),
+    "uv": (write_png, "uv_{:05d}.png"),
+    "normal": (write_png, "normal_{:05d}.png"),
+    "segmentation": (write_palette_png, "segmentation_{:05d}.png"),
+    "object_coordinates": (write_png, "object_coordinates_{:05d}.png"),
+}
+
+
+class StreamingFrameWriter:
+  """Writes the layers of single frames on background threads, while the next frames are rendered.
+
+  Frames are passed one at a time to write(), which returns as soon as the frame is queued.
+  At most max_queued_frames frames are held in memory: write() blocks if the writer threads fall
+  behind. Flow layers are normalized with the range over the whole sequence, so they are the
+  exception: they are collected and written by close() with the corresponding batch writers.
+  The first exception raised by a writer thread is re-raised by write() or close().
+
+  Example:
+    with StreamingFrameWriter({"rgba": "output/rgba", "depth": "output/depth"}) as writer:
+      for frame_nr, frame in renderer.render_iter():
+        writer.write(frame_nr - scene.frame_start, frame)
+  """
+
+  def __init__(self,
+               directories: Dict[str, PathLike],
+               file_templates: Dict[str, str] = (),
+               max_write_threads: int = 16,
+               max_queued_frames: int = 4,
+               num_segmentation_ids: Optional[int] = None,
+               compression: Optional[int] = None,
+               use_processes: bool = False):
+    """
+    Args:
+      directories: output directory of each layer to write. Layers of a frame that are not in
+        directories are ignored.
+      file_templates: file templates (e.g. "rgba_{:05d}.png") overriding the default ones.
+      max_write_threads: number of threads used for writing images.
+      max_queued_frames: maximum number of frames waiting to be written.
+      num_segmentation_ids: number of segmentation ids (including the background) used to build
+        the segmentation palette. Has to be fixed in advance, because the frames are written one
+        at a time (defaults to the palette of each single frame).
+      compression: zlib compression level (0-9) of the written images (None for the defaults).
+      use_processes: encode the images in worker processes instead of threads.
+    """
+    unknown = set(directories) - set(FRAME_WRITERS) - set(DEFAULT_WRITERS)
+    if unknown:
+      raise ValueError(f"No writer for layers {sorted(unknown)}")
+    self.directories = {key: as_path(d) for key, d in directories.items()}
+    self.file_templates = dict(file_templates)
+    self.max_write_threads = max_write_threads
+    self.compression = compression
+    self.use_processes = use_processes
+    self.palette = (None if num_segmentation_ids is None else
+                    plotting.hls_palette(num_segmentation_ids))
+    for directory in self.directories.values():
+      directory.mkdir(parents=True, exist_ok=True)
+
+    self._executor = get_write_executor(max_write_threads, use_processes)
+    self._slots = threading.Semaphore(max_queued_frames)
+    self._lock = threading.Lock()
+    self._error = None
+    self._pending = set()  # futures of the layers that are being written
+    self._buffered = {}  # layers that can only be written as a batch (flow)
+    self._closed = False
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close(write_buffered=exc_type is None)
+
+  def _raise_pending_error(self):
+    with self._lock:
+      error, self._error = self._error, None
+    if error is not None:
+      raise error
+
+  def _submit_frame(self, index: int, frame: Dict[str, np.ndarray]):
+    remaining = [len(frame)]
+
+    def layer_done(future):
+      error = future.exception()
+      with self._lock:
+        self._pending.discard(future)
+        if error is not None:
+          logger.error("Exception while writing frame %d", index, exc_info=error)
+          if self._error is None:
+            self._error = error
+        remaining[0] -= 1
+        frame_done = remaining[0] == 0
+      if frame_done:
+        self._slots.release()
+
+    for key, data in frame.items():
+      write_fn, file_template = FRAME_WRITERS[key]
+      filename = self.directories[key] / self.file_templates.get(key, file_template).format(index)
+      kwargs = {"compression": self.compression}
+      if key == "segmentation":
+        kwargs["palette"] = self.palette
+      future = self._executor.submit(write_fn, data, str(filename), **kwargs)
+      with self._lock:
+        self._pending.add(future)
+      future.add_done_callback(layer_done)
+
+  def write(self, index: int, frame: Dict[str, np.ndarray]) -> None:
+    """Queues the layers of a single frame for writing (index is used in the filenames)."""
+    if self._closed:
+      raise RuntimeError("StreamingFrameWriter is closed")
+    self._raise_pending_error()
+
+    per_frame = {}
+    for key, data in frame.items():
+      if key not in self.directories:
+        continue
+      if key in FRAME_WRITERS:
+        per_frame[key] = data
+      else:
+        self._buffered.setdefault(key, {})[index] = data
+    if not per_frame:
+      return
+
+    self._slots.acquire()
+    self._submit_frame(index, per_frame)
+
+  def close(self, write_buffered: bool = True) -> None:
+    """Waits for all queued frames to be written and writes the buffered (flow) layers."""
+    if self._closed:
+      return
+    self._closed = True
+    with self._lock:
+      pending = list(self._pending)
+    concurrent.futures.wait(pending)
+    self._raise_pending_error()
+    if not write_buffered:
+      return
+    for key, frames in self._buffered.items():
+      indices = sorted(frames)
+      if indices != list(range(len(indices))):
+        raise ValueError(f"Layer {key} can only be written for frames 0..n-1, got {indices}")
+      data = np.stack([frames[i] for i in indices])
+      kwargs = {}
+      if key in self.file_templates:
+        kwargs["file_template"] = self.file_templates[key]
+      DEFAULT_WRITERS[key](data, self.directories[key],
+                           max_write_threads=self.max_write_threads,
+                           compression=self.compression, use_processes=self.use_processes,
+                           **kwargs)
+    self._buffered = {}
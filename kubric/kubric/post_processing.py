@@ -13,10 +13,53 @@
 # limitations under the License.
 
 import numpy as np
-from typing import Sequence
+from typing import Dict, Sequence
 from kubric import core
 from kubric.kubric_typing import ArrayLike
 
+# labels up to this value are remapped with a dense lookup table, larger ones via np.unique
+MAX_DENSE_LABEL = 1 << 20
+
+
+def remap_labels(labels: ArrayLike, mapping: Dict[int, int], default: int = 0,
+                 dtype=None) -> np.ndarray:
+  """Replaces every label by mapping[label] (or default if it is not in mapping) in one pass.
+
+  Small non-negative integer labels are looked up in a dense table, any others (e.g. cryptomatte
+  hashes) by first reducing them to their unique values.
+  """
+  labels = np.asarray(labels)
+  dtype = labels.dtype if dtype is None else dtype
+  if labels.size == 0:
+    return np.zeros(labels.shape, dtype=dtype)
+
+  if labels.dtype.kind in "iub":
+    low, high = int(labels.min()), int(labels.max())
+    if low >= 0 and high <= MAX_DENSE_LABEL:
+      lut = np.full(high + 1, default, dtype=dtype)
+      for label, value in mapping.items():
+        if 0 <= label <= high:
+          lut[label] = value
+      return lut[labels]
+
+  unique_labels, inverse = np.unique(labels, return_inverse=True)
+  lut = np.array([mapping.get(label.item(), default) for label in unique_labels], dtype=dtype)
+  return lut[inverse].reshape(labels.shape)
+
+
+def label_counts(labels: ArrayLike, num_labels: int) -> np.ndarray:
+  """Number of occurrences of each label 0..num_labels (other values are not counted)."""
+  labels = np.asarray(labels).ravel()
+  if labels.dtype.kind in "iub" and (labels.size == 0 or labels.min() >= 0):
+    return np.bincount(labels.astype(np.int64, copy=False),
+                       minlength=num_labels + 1)[:num_labels + 1]
+  counts = np.zeros(num_labels + 1, dtype=np.int64)
+  unique_labels, unique_counts = np.unique(labels, return_counts=True)
+  for label, count in zip(unique_labels, unique_counts):
+    if label == int(label) and 0 <= label <= num_labels:
+      counts[int(label)] = count
+  return counts
+
 
 def compute_visibility(segmentation: np.ndarray, assets: Sequence[core.Asset]):
   """Compute how many pixels are visible for each instance at each frame.
@@ -26,9 +69,10 @@ def compute_visibility(segmentation: np.ndarray, assets: Sequence[core.Asset]):
     assets: The list of assets in the scene (whose ordering corresponds to the segmentation indices)
 
   """
+  counts = np.stack([label_counts(segmentation[t], len(assets))
+                     for t in range(segmentation.shape[0])], axis=1)
   for i, asset in enumerate(assets, start=1):
-    asset.metadata["visibility"] = [int(np.sum(segmentation[t] == i))
-                                    for t in range(segmentation.shape[0])]
+    asset.metadata["visibility"] = [int(c) for c in counts[i]]
 
 
 def adjust_segmentation_idxs(
@@ -41,29 +85,42 @@ def adjust_segmentation_idxs(
   Note that this starts with index=1 for the first asset in new_assets_list, to leave id=0 for
   background assets.
   """
-  new_segmentation = np.zeros_like(segmentation)
+  new_indices = {asset: i for i, asset in reversed(list(enumerate(new_assets_list, start=1)))}
+  mapping = {}
   for i, asset in enumerate(old_assets_list, start=1):
     if isinstance(asset, core.PhysicalObject) and asset.segmentation_id is not None:
-      new_segmentation[segmentation == i] = asset.segmentation_id
-    elif asset in new_assets_list:
-      new_segmentation[segmentation == i] = new_assets_list.index(asset) + 1
+      mapping[i] = asset.segmentation_id
     else:
-      new_segmentation[segmentation == i] = ignored_label
-  return new_segmentation
+      mapping[i] = new_indices.get(asset, ignored_label)
+  return remap_labels(segmentation, mapping)
 
 
 def compute_bboxes(segmentation: ArrayLike, asset_list: Sequence[core.Asset]):
-  for k, asset in enumerate(asset_list, start=1):
+  num_labels = len(asset_list)
+  for asset in asset_list:
     asset.metadata["bboxes"] = []
     asset.metadata["bbox_frames"] = []
-    for t in range(segmentation.shape[0]):
-      seg = segmentation[t, ..., 0]
-      idxs = np.array(np.where(seg == k), dtype=np.float32)
-      if idxs.size > 0:
-        y_min = float(idxs[0].min() / seg.shape[0])
-        x_min = float(idxs[1].min() / seg.shape[1])
-        y_max = float((idxs[0].max() + 1) / seg.shape[0])
-        x_max = float((idxs[1].max() + 1) / seg.shape[1])
-        asset.metadata["bboxes"].append((y_min, x_min, y_max, x_max))
-        asset.metadata["bbox_frames"].append(t)
-
+  for t in range(segmentation.shape[0]):
+    seg = np.asarray(segmentation[t, ..., 0])
+    height, width = seg.shape
+    # labels outside of 1..num_labels are collected in row 0 (background) and ignored
+    labels = seg.astype(np.int64)
+    labels[(seg != labels) | (labels < 0) | (labels > num_labels)] = 0
+    # in a single pass over the pixels: which labels occur in which rows / columns
+    rows = np.zeros((num_labels + 1, height), dtype=bool)
+    cols = np.zeros((num_labels + 1, width), dtype=bool)
+    rows[labels, np.arange(height)[:, None]] = True
+    cols[labels, np.arange(width)[None, :]] = True
+    visible = rows.any(axis=1)
+    y_min = rows.argmax(axis=1)
+    y_max = height - 1 - rows[:, ::-1].argmax(axis=1)
+    x_min = cols.argmax(axis=1)
+    x_max = width - 1 - cols[:, ::-1].argmax(axis=1)
+    for k in np.nonzero(visible[1:])[0] + 1:
+      asset = asset_list[k - 1]
+      # same float32 arithmetic as computing the box from the pixel coordinates directly
+      asset.metadata["bboxes"].append((float(np.float32(y_min[k]) / height),
+                                       float(np.float32(x_min[k]) / width),
+                                       float(np.float32(y_max[k] + 1) / height),
+                                       float(np.float32(x_max[k] + 1) / width)))
+      asset.metadata["bbox_frames"].append(t)
@@ -14,6 +14,8 @@
 
 """Utilities to generate randomly generated quantities (rotations, positions, colors)."""
 
+import itertools
+
 import numpy as np
 import pyquaternion as pyquat
 from typing import Optional, Tuple
@@ -125,6 +127,80 @@ def move_until_no_overlap(asset, simulator, spawn_region=((-1, -1, -1), (1, 1, 1
                         rng=rng)
 
 
+def random_rotations(num: int, rng=default_rng()) -> np.ndarray:
+  """Samples num rotations uniformly over all orientations.
+
+  Returns an array of shape (num, 4) of (w, x, y, z) quaternions.
+  """
+  r1, r2, r3 = rng.random((3, num))
+  return np.stack([np.sqrt(1.0 - r1) * np.sin(2 * np.pi * r2),
+                   np.sqrt(1.0 - r1) * np.cos(2 * np.pi * r2),
+                   np.sqrt(r1) * np.sin(2 * np.pi * r3),
+                   np.sqrt(r1) * np.cos(2 * np.pi * r3)], axis=-1)
+
+
+def quaternions_to_matrices(quaternions: np.ndarray) -> np.ndarray:
+  """Converts an array of (w, x, y, z) unit quaternions of shape [N, 4] to rotations [N, 3, 3]."""
+  w, x, y, z = np.moveaxis(np.asarray(quaternions, dtype=np.float64), -1, 0)
+  return np.stack([
+      np.stack([1 - 2 * (y*y + z*z), 2 * (x*y - z*w), 2 * (x*z + y*w)], axis=-1),
+      np.stack([2 * (x*y + z*w), 1 - 2 * (x*x + z*z), 2 * (y*z - x*w)], axis=-1),
+      np.stack([2 * (x*z - y*w), 2 * (y*z + x*w), 1 - 2 * (x*x + y*y)], axis=-1),
+  ], axis=-2)
+
+
+def rotated_aabboxes(obj: objects.PhysicalObject, quaternions: np.ndarray) -> np.ndarray:
+  """Axis-aligned bounding boxes [N, 2, 3] of obj at the origin, for each of N rotations."""
+  bounds = np.array(obj.bounds, dtype=np.float64) * obj.scale
+  corners = np.array(list(itertools.product(*bounds.T)))  # [8, 3]
+  rotated = np.einsum("nij,kj->nki", quaternions_to_matrices(quaternions), corners)
+  return np.stack([rotated.min(axis=1), rotated.max(axis=1)], axis=1)
+
+
+def aabb_overlaps(boxes: np.ndarray, others: np.ndarray) -> np.ndarray:
+  """Boolean matrix [N, M] of which of the N boxes [N, 2, 3] overlap with the M boxes [M, 2, 3]."""
+  return np.all((boxes[:, None, 0] < others[None, :, 1]) &
+                (boxes[:, None, 1] > others[None, :, 0]), axis=-1)
+
+
+def place_without_overlap(asset, simulator, spawn_region=((-1, -1, -1), (1, 1, 1)),
+                          max_trials=100, batch_size=16, rng=default_rng()):
+  """Places asset at a random pose in spawn_region where it does not overlap other objects.
+
+  Same as move_until_no_overlap, but candidate poses are sampled batch_size at a time and first
+  tested against the bounding boxes of the other objects in the simulator with a vectorized test.
+  Candidates whose bounding box does not touch any other box are free without further checks;
+  the others are checked exactly by the simulator, but only against the objects whose boxes they
+  overlap. The first free candidate (in sampling order) is used.
+  """
+  region = np.array(spawn_region, dtype=np.float64)
+  others = [a for a in simulator.scene.assets
+            if a is not asset and isinstance(a, objects.PhysicalObject)
+            and simulator in a.linked_objects]
+  other_boxes = (np.array([simulator.get_aabb(o) for o in others], dtype=np.float64)
+                 if others else np.zeros((0, 2, 3)))
+
+  num_tried = 0
+  while num_tried < max_trials:
+    n = min(batch_size, max_trials - num_tried)
+    num_tried += n
+    quaternions = random_rotations(n, rng=rng)
+    boxes = rotated_aabboxes(asset, quaternions)
+    # same as position_sampler: keep the whole bounding box inside the region
+    low, high = region[0] - boxes[:, 0], region[1] - boxes[:, 1]
+    positions = low + rng.random((n, 3)) * (high - low)
+    overlaps = aabb_overlaps(boxes + positions[:, None], other_boxes)
+
+    for i in range(n):
+      asset.quaternion = quaternions[i]
+      asset.position = positions[i]
+      if not overlaps[i].any():
+        return
+      if not simulator.check_overlap(asset, [o for o, hit in zip(others, overlaps[i]) if hit]):
+        return
+  raise RuntimeError("Failed to place", asset)
+
+
 def sample_color(
     strategy: str,
     rng: np.random.RandomState = default_rng()
@@ -12,7 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import collections
+import concurrent.futures
 from contextlib import redirect_stdout
 import functools
 import io
@@ -20,7 +20,7 @@ import logging
 import os
 import sys
 import tempfile
-from typing import Any, Dict, Optional, Sequence, Union
+from typing import Any, Dict, Iterator, Optional, Sequence, Tuple, Union
 
 import kubric as kb
 from kubric import core
@@ -54,6 +54,34 @@ def add_top_level_empty_parent(name: str = "Empty") -> bpy.types.Object:
   return parent_obj
 
 
+# EXR layers (render passes) needed to compute each of the return layers.
+# rgba / rgb are read from the rendered PNG and need no additional pass.
+RENDER_LAYER_PASSES = {
+    "rgba": (),
+    "rgb": (),
+    "depth": ("Depth",),
+    "z": ("Depth",),
+    "backward_flow": ("Vector",),
+    "forward_flow": ("Vector",),
+    "uv": ("UV",),
+    "normal": ("Normal",),
+    "object_coordinates": ("ObjectCoordinates",),
+    "segmentation": ("CryptoObject00",),
+}
+
+DEFAULT_RENDER_LAYERS = ("rgba", "backward_flow", "forward_flow", "depth", "normal",
+                         "object_coordinates", "segmentation")
+
+
+def passes_for_layers(layers: Sequence[str]):
+  """Returns the set of EXR layers required to compute the given return layers."""
+  unknown = set(layers) - set(RENDER_LAYER_PASSES)
+  if unknown:
+    raise ValueError(f"Unknown render layers {sorted(unknown)}. "
+                     f"Valid layers are {sorted(RENDER_LAYER_PASSES)}")
+  return {p for layer in layers for p in RENDER_LAYER_PASSES[layer]}
+
+
 # noinspection PyUnresolvedReferences
 class Blender(core.View):
   """ An implementation of a rendering backend in Blender/Cycles."""
@@ -68,6 +96,7 @@ class Blender(core.View):
                verbose: bool = False,
                custom_scene: Optional[str] = None,
                motion_blur: Optional[float] = None,
+               render_layers: Optional[Sequence[str]] = None,
                ):
     """
     Args:
@@ -89,6 +118,10 @@ class Blender(core.View):
         If this argument is set to the path for a `.blend` file, then that scene is loaded instead.
         Note that this scene only affects the rendering output. It is not accessible from Kubric and
         not taken into account by the simulator.
+      motion_blur: Strength of the (optical flow based) motion blur, or None to disable it.
+      render_layers: The layers that will be returned by render() (see Blender.post_processors).
+        Only the render passes needed for these layers are activated and written to EXR.
+        By default (None) all passes are activated and render() returns DEFAULT_RENDER_LAYERS.
     """
     self.scratch_dir = tempfile.mkdtemp() if scratch_dir is None else scratch_dir
     self.ambient_node = None
@@ -107,7 +140,21 @@ class Blender(core.View):
     bpy.context.scene.render.engine = "CYCLES"
     self.use_gpu = os.getenv("KUBRIC_USE_GPU", "False").lower() in ("true", "1", "t")
 
-    blender_utils.activate_render_passes(normal=True, optical_flow=True, segmentation=True, uv=True)
+    self.render_layers = DEFAULT_RENDER_LAYERS if render_layers is None else tuple(render_layers)
+    if render_layers is None:
+      passes = {"Depth", "Vector", "UV", "Normal", "CryptoObject00", "ObjectCoordinates"}
+    else:
+      passes = passes_for_layers(self.render_layers)
+    if motion_blur is not None:
+      passes |= {"Depth", "Vector"}
+    self.render_passes = passes
+
+    blender_utils.activate_render_passes(normal="Normal" in passes,
+                                         optical_flow="Vector" in passes,
+                                         segmentation="CryptoObject00" in passes,
+                                         uv="UV" in passes,
+                                         depth="Depth" in passes,
+                                         object_coordinates="ObjectCoordinates" in passes)
     self._setup_scene_shading()
 
     self.adaptive_sampling = adaptive_sampling  # speeds up rendering
@@ -115,7 +162,12 @@ class Blender(core.View):
     self.samples_per_pixel = samples_per_pixel
     self.background_transparency = background_transparency
 
-    self.exr_output_node = blender_utils.set_up_exr_output_node(motion_blur=motion_blur)
+    self.exr_output_node = blender_utils.set_up_exr_output_node(
+        default_layers=("Image", "Depth") if "Depth" in passes else ("Image",),
+        aux_layers=tuple(layer for layer in ("UV", "Normal", "CryptoObject00", "ObjectCoordinates")
+                         if layer in passes),
+        motion_blur=motion_blur,
+        vector="Vector" in passes)
 
     self.post_processors = {
         "backward_flow": blender_utils.process_backward_flow,
@@ -252,10 +304,7 @@ class Blender(core.View):
   def render(self,
              frames: Optional[Sequence[int]] = None,
              ignore_missing_textures: bool = False,
-             return_layers: Sequence[str] = ("rgba", "backward_flow",
-                                             "forward_flow", "depth",
-                                             "normal", "object_coordinates",
-                                             "segmentation"),
+             return_layers: Optional[Sequence[str]] = None,
              ) -> Dict[str, np.ndarray]:
     """Renders all frames (or a subset) of the animation and returns images as a dict of arrays.
 
@@ -264,8 +313,9 @@ class Blender(core.View):
       ignore_missing_textures: if False then raise a RuntimeError when missing textures are
         detected. Otherwise, proceed to render (with purple color instead of missing texture).
       return_layers: list of layers to return. For possible values refer to
-        the Blender.post_processors dict. Defaults to ("backward_flow",
-        "forward_flow", "depth", "normal", "object_coordinates", "segmentation").
+        the Blender.post_processors dict. Defaults to the render_layers given to the
+        constructor (by default "rgba", "backward_flow", "forward_flow", "depth", "normal",
+        "object_coordinates", "segmentation").
 
     Returns:
       A dictionary with one entry for each return layer. By default:
@@ -278,6 +328,7 @@ class Blender(core.View):
         - "normal": shape = (nr_frames, height, width, 3) (uint16)
     """
     logger.info("Using scratch rendering folder: '%s'", self.scratch_dir)
+    return_layers = self.render_layers if return_layers is None else return_layers
     if not ignore_missing_textures:
       self._check_missing_textures()
     self.set_exr_output_path(self.scratch_dir / "exr" / "frame_")
@@ -297,6 +348,63 @@ class Blender(core.View):
     # --- post process the rendered frames
     return self.postprocess(self.scratch_dir, return_layers=return_layers)
 
+  def render_iter(self,
+                  frames: Optional[Sequence[int]] = None,
+                  ignore_missing_textures: bool = False,
+                  return_layers: Optional[Sequence[str]] = None,
+                  ) -> Iterator[Tuple[int, Dict[str, np.ndarray]]]:
+    """Renders frames one by one and yields (frame_nr, layers) as soon as each frame is done.
+
+    In contrast to render(), at most two frames are held in memory: while Blender renders a frame,
+    the previous one is decoded on a background thread. The yielded layers have the same
+    format as those returned by render() but without the leading frame dimension.
+
+    Args:
+      frames: list of frames to render (defaults to range(scene.frame_start, scene.frame_end+1)).
+      ignore_missing_textures: if False then raise a RuntimeError when missing textures are
+        detected. Otherwise, proceed to render (with purple color instead of missing texture).
+      return_layers: list of layers to return (defaults to the render_layers given to the
+        constructor).
+    """
+    logger.info("Using scratch rendering folder: '%s'", self.scratch_dir)
+    return_layers = self.render_layers if return_layers is None else return_layers
+    if not ignore_missing_textures:
+      self._check_missing_textures()
+    self.set_exr_output_path(self.scratch_dir / "exr" / "frame_")
+    if frames is None:
+      frames = range(self.scene.frame_start, self.scene.frame_end + 1)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as decoder:
+      pending = None
+      for frame_nr in frames:
+        with RedirectStream(stream=sys.stdout, disabled=self.verbose):
+          bpy.context.scene.frame_set(frame_nr)
+          png_filename = self.scratch_dir / "images" / f"frame_{frame_nr:04d}.png"
+          bpy.context.scene.render.filepath = str(png_filename)
+          bpy.ops.render.render(animation=False, write_still=True)
+        logger.info("Rendered frame '%s'", png_filename)
+
+        exr_filename = self.scratch_dir / "exr" / f"frame_{frame_nr:04d}.exr"
+        current = (frame_nr, decoder.submit(self._decode_frame, exr_filename, png_filename,
+                                            return_layers))
+        if pending is not None:
+          yield pending[0], pending[1].result()
+        pending = current
+
+      if pending is not None:
+        yield pending[0], pending[1].result()
+
+  def _decode_frame(self, exr_filename: PathLike, png_filename: PathLike,
+                    return_layers: Sequence[str]) -> Dict[str, np.ndarray]:
+    """Reads a single rendered frame and applies the post-processors of the return_layers."""
+    source_layers = blender_utils.get_render_layers_from_exr(
+        exr_filename, layers=passes_for_layers(return_layers))
+    if any(key in ("rgba", "rgb") for key in return_layers):
+      # Use the contrast-normalized PNG instead of the EXR for RGBA.
+      source_layers["rgba"] = file_io.read_png(png_filename)
+    return {key: self.post_processors[key](source_layers, self.scene)
+            for key in return_layers}
+
   def _check_missing_textures(self):
     missing_textures = sorted({img.filepath for img in bpy.data.images
             if tuple(img.size) == (0, 0) and img.filepath})
@@ -307,9 +415,7 @@ class Blender(core.View):
       self,
       frame: Optional[int] = None,
       ignore_missing_textures: bool = False,
-      return_layers: Sequence[str] = ("rgba", "backward_flow", "forward_flow",
-                                      "depth", "normal", "object_coordinates",
-                                      "segmentation"),
+      return_layers: Optional[Sequence[str]] = None,
   ):
     """Render a single frame (first frame by default).
 
@@ -318,8 +424,7 @@ class Blender(core.View):
     ignore_missing_textures: if False then raise a RuntimeError when missing textures are
       detected. Otherwise, proceed to render (with purple color instead of missing texture).
     return_layers: list of layers to return. For possible values refer to
-      the Blender.post_processors dict. Defaults to ("backward_flow",
-      "forward_flow", "depth", "normal", "object_coordinates", "segmentation").
+      the Blender.post_processors dict. Defaults to the render_layers given to the constructor.
     Returns:
     A dictionary with one entry for each return layer. By default:
         - "rgba": shape = (height, width, 4)
@@ -340,26 +445,43 @@ class Blender(core.View):
   def postprocess(
       self,
       from_dir: PathLike,
-      return_layers: Sequence[str]):
-
+      return_layers: Sequence[str],
+      max_workers: Optional[int] = None):
+    """Reads the rendered frames from from_dir and applies the post-processors.
+
+    Frames are decoded concurrently by a pool of max_workers threads (None for the
+    ThreadPoolExecutor default) and written directly into preallocated arrays of shape
+    (nr_frames, height, width, channels). Only the EXR layers (and the PNG) needed for the
+    requested return_layers are read.
+    """
     from_dir = kb.as_path(from_dir)
-    # --- collect all layers for all frames
-    data_stack = collections.defaultdict(list)
     exr_frames = sorted((from_dir / "exr").glob("*.exr"))
     png_frames = [from_dir / "images" / (exr_filename.stem + ".png")
                   for exr_filename in exr_frames]
+    if not exr_frames or not return_layers:
+      return {}
 
-    for exr_filename, png_filename in zip(exr_frames, png_frames):
-      source_layers = blender_utils.get_render_layers_from_exr(exr_filename)
-      # Use the contrast-normalized PNG instead of the EXR for RGBA.
-      source_layers["rgba"] = file_io.read_png(png_filename)
+    def decode_frame(frame_idx):
+      # only decodes the EXR layers that are needed for the requested return layers
+      return self._decode_frame(exr_frames[frame_idx], png_frames[frame_idx], return_layers)
+
+    # --- the first frame determines shapes and dtypes of the output arrays
+    first_frame = decode_frame(0)
+    result = {key: np.empty((len(exr_frames),) + value.shape, dtype=value.dtype)
+              for key, value in first_frame.items()}
+    for key, value in first_frame.items():
+      result[key][0] = value
+    del first_frame
 
-      for key in return_layers:
-        post_processor = self.post_processors[key]
-        data_stack[key].append(post_processor(source_layers, self.scene))
+    def fill_frame(frame_idx):
+      for key, value in decode_frame(frame_idx).items():
+        result[key][frame_idx] = value
 
-    return {key: np.stack(data_stack[key], axis=0)
-            for key in data_stack}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+      # list() re-raises exceptions from the workers
+      list(executor.map(fill_frame, range(1, len(exr_frames))))
+
+    return result
 
   @staticmethod
   def clear_and_reset_blender_scene(verbose: bool = False, custom_scene: str = None):
@@ -805,12 +927,40 @@ class AttributeSetter:
 
 
 class KeyframeSetter:
+  """Observer that mirrors the keyframes of an asset trait on an attribute of a blender object.
+
+  A change with a frame (Asset.keyframe_insert) inserts a single keyframe with the current value
+  of the attribute. A change with frames and frame_values (Asset.set_keyframes) sets all of them
+  at once: numeric values are written directly into the fcurves, other values are keyframed one
+  by one.
+  """
+
   def __init__(self, blender_obj, attribute_path: str):
     self.attribute_path = attribute_path
     self.blender_obj = blender_obj
 
   def __call__(self, change):
-    self.blender_obj.keyframe_insert(self.attribute_path, frame=change.frame)
+    if "frame" in change:
+      self.blender_obj.keyframe_insert(self.attribute_path, frame=change.frame)
+      return
+
+    # many keyframes at once (see Asset.set_keyframes)
+    try:
+      values = np.asarray(change.frame_values, dtype=np.float64)
+    except (TypeError, ValueError):
+      values = None  # not numeric (e.g. materials)
+    if values is not None and values.size:
+      blender_utils.set_fcurves(self.blender_obj, self.attribute_path, change.frames, values)
+      return
+
+    # otherwise keyframe each value, keep the current one
+    current = getattr(self.blender_obj, self.attribute_path)
+    if hasattr(current, "__len__"):
+      current = current[:]
+    for frame, value in zip(change.frames, change.frame_values):
+      setattr(self.blender_obj, self.attribute_path, value)
+      self.blender_obj.keyframe_insert(self.attribute_path, frame=frame)
+    setattr(self.blender_obj, self.attribute_path, current)
 
 
 def register_object3d_setters(obj, blender_obj):
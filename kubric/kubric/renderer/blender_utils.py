@@ -16,7 +16,7 @@ import contextlib
 import copy
 import functools
 import sys
-from typing import Dict, Sequence, Tuple, Union
+from typing import Collection, Dict, Optional, Sequence, Tuple, Union
 
 import numpy as np
 import OpenEXR
@@ -25,6 +25,7 @@ import sklearn.utils
 import trimesh
 
 from kubric import core
+from kubric import post_processing
 from kubric.kubric_typing import AddAssetFunction, ArrayLike
 from kubric.redirect_io import RedirectStream
 from kubric.safeimport.bpy import bpy
@@ -66,12 +67,15 @@ def prepare_blender_object(func: AddAssetFunction) -> AddAssetFunction:
 
 def set_up_exr_output_node(default_layers=("Image", "Depth"),
                            aux_layers=("UV", "Normal", "CryptoObject00", "ObjectCoordinates"),
-                           motion_blur=None):
+                           motion_blur=None,
+                           vector=True):
   """ Set up the blender compositor nodes required for exporting EXR files.
 
   The filename can then be set with:
   out_node.base_path = "my/custom/path/prefix_"
 
+  Only the given layers (and the "Vector" pass if vector=True) are linked to the output node,
+  so passes that are not activated are not exported.
   """
   bpy.context.scene.use_nodes = True
   tree = bpy.context.scene.node_tree
@@ -83,9 +87,10 @@ def set_up_exr_output_node(default_layers=("Image", "Depth"),
 
   # the render node has outputs for all the rendered layers
   render_node = tree.nodes.new(type="CompositorNodeRLayers")
-  render_node_aux = tree.nodes.new(type="CompositorNodeRLayers")
-  render_node_aux.name = "Render Layers Aux"
-  render_node_aux.layer = "AuxOutputs"
+  if aux_layers or vector:
+    render_node_aux = tree.nodes.new(type="CompositorNodeRLayers")
+    render_node_aux.name = "Render Layers Aux"
+    render_node_aux.layer = "AuxOutputs"
 
   # create a new FileOutput node
   out_node = tree.nodes.new(type="CompositorNodeOutputFile")
@@ -101,18 +106,20 @@ def set_up_exr_output_node(default_layers=("Image", "Depth"),
     out_node.file_slots.new(layer_name)
     links.new(render_node_aux.outputs.get(layer_name), out_node.inputs.get(layer_name))
 
-  # manually convert to RGBA. See:
-  # https://blender.stackexchange.com/questions/175621/incorrect-vector-pass-output-no-alpha-zero-values/175646#175646
-  split_rgba = tree.nodes.new(type="CompositorNodeSepRGBA")
-  combine_rgba = tree.nodes.new(type="CompositorNodeCombRGBA")
-  for channel in "RGBA":
-    links.new(split_rgba.outputs.get(channel), combine_rgba.inputs.get(channel))
-  out_node.file_slots.new("Vector")
-  links.new(render_node_aux.outputs.get("Vector"), split_rgba.inputs.get("Image"))
-  links.new(combine_rgba.outputs.get("Image"), out_node.inputs.get("Vector"))
+  if vector:
+    # manually convert to RGBA. See:
+    # https://blender.stackexchange.com/questions/175621/incorrect-vector-pass-output-no-alpha-zero-values/175646#175646
+    split_rgba = tree.nodes.new(type="CompositorNodeSepRGBA")
+    combine_rgba = tree.nodes.new(type="CompositorNodeCombRGBA")
+    for channel in "RGBA":
+      links.new(split_rgba.outputs.get(channel), combine_rgba.inputs.get(channel))
+    out_node.file_slots.new("Vector")
+    links.new(render_node_aux.outputs.get("Vector"), split_rgba.inputs.get("Image"))
+    links.new(combine_rgba.outputs.get("Image"), out_node.inputs.get("Vector"))
 
   if motion_blur is not None:
     assert isinstance(motion_blur, float), motion_blur
+    assert vector and "Depth" in default_layers, "motion blur requires the Vector and Depth passes"
     # we then add a vector blur that uses optical flow to blur the image
     motion_blur_node = tree.nodes.new(type="CompositorNodeVecBlur")
     composite_out = tree.nodes.new(type="CompositorNodeComposite")
@@ -156,7 +163,8 @@ def activate_render_passes(
     optical_flow: bool = True,
     segmentation: bool = True,
     uv: bool = True,
-    depth: bool = True
+    depth: bool = True,
+    object_coordinates: bool = True,
 ):
 
   # We use two separate view layers
@@ -168,17 +176,22 @@ def activate_render_passes(
     default_view_layer = bpy.context.scene.view_layers[0]
     default_view_layer.use_pass_z = True
 
+  # without any auxiliary pass the aux view layer is not created (and thus not rendered) at all
+  if not (normal or optical_flow or segmentation or uv or object_coordinates):
+    return
+
   aux_view_layer = bpy.context.scene.view_layers.new("AuxOutputs")
   aux_view_layer.samples = 1  # only use 1 ray per pixel to disable anti-aliasing
   aux_view_layer.use_pass_z = False  # no need for a separate z-pass
-  aux_view_layer.material_override = add_coordinate_material()
-  if hasattr(aux_view_layer, 'aovs'):
-    object_coords_aov = aux_view_layer.aovs.add()
-  else:
-    # seems that some versions of blender use this form instead
-    object_coords_aov = aux_view_layer.cycles.aovs.add()
+  if object_coordinates:
+    aux_view_layer.material_override = add_coordinate_material()
+    if hasattr(aux_view_layer, 'aovs'):
+      object_coords_aov = aux_view_layer.aovs.add()
+    else:
+      # seems that some versions of blender use this form instead
+      object_coords_aov = aux_view_layer.cycles.aovs.add()
 
-  object_coords_aov.name = "ObjectCoordinates"
+    object_coords_aov.name = "ObjectCoordinates"
   aux_view_layer.cycles.use_denoising = False
 
   # For optical flow, uv, and normals we use the aux view layer
@@ -217,13 +230,25 @@ def read_channels_from_exr(exr: OpenEXR.InputFile, channel_names: Sequence[str])
   return np.stack(outputs, axis=-1)
 
 
-def get_render_layers_from_exr(filename) -> Dict[str, np.ndarray]:
+def get_render_layers_from_exr(filename,
+                               layers: Optional[Collection[str]] = None) -> Dict[str, np.ndarray]:
+  """Reads the render layers of a multilayer EXR file.
+
+  Args:
+    filename: path of the EXR file.
+    layers: names of the EXR layers to decode (e.g. "Depth", "Vector", "CryptoObject00").
+      "CryptoObject00" selects all cryptomatte layers. By default (None) all layers are decoded.
+  """
   exr = OpenEXR.InputFile(str(filename))
   layer_names = set()
   for n, _ in exr.header()["channels"].items():
     layer_name, _, _ = n.partition(".")
     layer_names.add(layer_name)
 
+  if layers is not None:
+    layer_names = {n for n in layer_names
+                   if n in layers or (n.startswith("CryptoObject") and "CryptoObject00" in layers)}
+
   output = {}
   if "Image" in layer_names:
     # Image is in RGBA format with range [0, inf]
@@ -286,15 +311,15 @@ def replace_cryptomatte_hashes_by_asset_index(
     assets: List of assets to use for replacement.
   """
   # replace crypto-ids with asset index
-  new_segmentation_ids = np.zeros_like(segmentation_ids)
+  mapping = {}
   for idx, asset in enumerate(assets, start=1):
     asset_hash = mm3hash(asset.uid)
     if hasattr(asset, "segmentation_id") and asset.segmentation_id is not None:
       uid = asset.segmentation_id
     else:
       uid = idx
-    new_segmentation_ids[segmentation_ids == asset_hash] = uid
-  return new_segmentation_ids
+    mapping[asset_hash] = uid
+  return post_processing.remap_labels(segmentation_ids, mapping)
 
 
 def mm3hash(name):
@@ -371,6 +396,73 @@ def apply_transformations(
     bpy.ops.object.transform_apply(location=position, rotation=rotation, scale=scale)
 
 
+def set_fcurves(blender_obj, attribute_path: str, frames: Sequence[int], values: ArrayLike):
+  """ Keyframes a (vector) property at many frames at once by writing its F-curves directly.
+
+  Equivalent to setting the property and calling keyframe_insert for every frame, but fills
+  each F-curve with a single keyframe_points.add and foreach_set instead of one bpy call per
+  frame and component. Existing keyframes at the given frames are replaced; for frames given
+  more than once the last value is used.
+
+  Args:
+    blender_obj: Blender ID (e.g. an Object) or struct (e.g. a node socket) owning the property
+    attribute_path: name of the property, e.g. "location"
+    frames: the frame numbers, shape=(n_frames,)
+    values: the values of the property at these frames, shape=(n_frames,) or
+      (n_frames, n_components); extra components (e.g. alpha of a color) are dropped
+  """
+  current = getattr(blender_obj, attribute_path)
+  num_components = len(current) if hasattr(current, "__len__") else 1
+  frames = np.asarray(frames, dtype=np.float64)
+  values = np.asarray(values, dtype=np.float64).reshape(len(frames), -1)[:, :num_components]
+
+  id_data = blender_obj.id_data
+  data_path = blender_obj.path_from_id(attribute_path)
+  if id_data.animation_data is None:
+    id_data.animation_data_create()
+  if id_data.animation_data.action is None:
+    id_data.animation_data.action = bpy.data.actions.new(f"{id_data.name}Action")
+  fcurves = id_data.animation_data.action.fcurves
+
+  # same defaults as keyframe_insert
+  preferences = bpy.context.preferences.edit
+  keyframe_rna = bpy.types.Keyframe.bl_rna.properties
+  interpolation = keyframe_rna["interpolation"].enum_items[
+      preferences.keyframe_new_interpolation_type].value
+  handle_type = keyframe_rna["handle_left_type"].enum_items[
+      preferences.keyframe_new_handle_type].value
+
+  for index in range(num_components):
+    fcurve = fcurves.find(data_path, index=index)
+    if fcurve is None:
+      fcurve = fcurves.new(data_path, index=index)
+    curve_frames, curve_values = frames, values[:, index]
+
+    points = fcurve.keyframe_points
+    if len(points):
+      # merge with existing keyframes (the new values win) and rewrite the whole curve
+      existing = np.zeros(2 * len(points))
+      points.foreach_get("co", existing)
+      existing = existing.reshape(-1, 2)
+      keep = ~np.isin(existing[:, 0], frames)
+      curve_frames = np.concatenate([existing[keep, 0], frames])
+      curve_values = np.concatenate([existing[keep, 1], curve_values])
+      points.clear()
+
+    order = np.argsort(curve_frames, kind="stable")
+    curve_frames, curve_values = curve_frames[order], curve_values[order]
+    # for frames given more than once the last value wins, as with repeated keyframe_insert
+    last = np.append(curve_frames[1:] != curve_frames[:-1], True)
+    curve_frames, curve_values = curve_frames[last], curve_values[last]
+    n = len(curve_frames)
+    points.add(n)
+    points.foreach_set("co", np.stack([curve_frames, curve_values], axis=1).ravel())
+    points.foreach_set("interpolation", np.full(n, interpolation, dtype=np.int32))
+    points.foreach_set("handle_left_type", np.full(n, handle_type, dtype=np.int32))
+    points.foreach_set("handle_right_type", np.full(n, handle_type, dtype=np.int32))
+    fcurve.update()
+
+
 def get_vertices_and_faces(obj: bpy.types.Object) -> Tuple[np.ndarray, np.ndarray]:
   """ Get arrays of vertices and faces for a given blender mesh object.
 
@@ -0,0 +1,169 @@
+# Copyright 2024 The Kubric Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Per-sequence tensor store: all layers of a sequence at their native dtype, memory-mappable.
+
+A store is a directory with
+  <layer>.npy   one array of shape (num_frames, height, width, channels) per layer, frames are
+                stored one after the other, so every frame is a contiguous chunk
+  store.json    format version, number of frames, fps, user attributes and the dtype and shape of
+                each layer. It is written last, so a store without it is incomplete.
+
+The layers are plain .npy files, so they can also be read without kubric (np.load(...,
+mmap_mode="r")). Unlike the png writers, no layer is quantized (e.g. flow stays float32).
+"""
+
+import json
+import logging
+import os
+import pathlib
+import threading
+from typing import Any, Dict, Iterator, Optional
+
+import numpy as np
+
+from kubric.kubric_typing import PathLike
+
+logger = logging.getLogger(__name__)
+
+STORE_VERSION = 1
+STORE_FILE = "store.json"
+
+
+def is_sequence_store(path: PathLike) -> bool:
+  return (pathlib.Path(path) / STORE_FILE).is_file()
+
+
+class SequenceStoreWriter:
+  """Writes the layers of a sequence into a store directory, one frame or batch at a time.
+
+  The file of a layer is created when its first frame is written (the shape and dtype are taken
+  from it). Different frames can be written concurrently from several threads.
+
+  Example:
+    with SequenceStoreWriter("output/store/seq0", num_frames=24, fps=12) as store:
+      for frame_nr, frame in renderer.render_iter():
+        store.write_frame(frame_nr - scene.frame_start, frame)
+  """
+
+  def __init__(self, path: PathLike, num_frames: int, fps: Optional[float] = None,
+               attrs: Optional[Dict[str, Any]] = None):
+    self.path = pathlib.Path(path)
+    self.num_frames = num_frames
+    self.fps = fps
+    self.attrs = dict(attrs or {})
+    self.path.mkdir(parents=True, exist_ok=True)
+    # an existing store is overwritten, remove the marker first so it is never seen half written
+    (self.path / STORE_FILE).unlink(missing_ok=True)
+    self._arrays = {}
+    self._written = {}
+    self._lock = threading.Lock()
+    self._closed = False
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    if exc_type is None:
+      self.close()
+    else:
+      self._release()
+
+  def _array(self, layer: str, frame_shape, dtype) -> np.memmap:
+    with self._lock:
+      array = self._arrays.get(layer)
+      if array is None:
+        array = np.lib.format.open_memmap(self.path / f"{layer}.npy", mode="w+", dtype=dtype,
+                                          shape=(self.num_frames,) + tuple(frame_shape))
+        self._arrays[layer] = array
+        self._written[layer] = np.zeros(self.num_frames, dtype=bool)
+    if array.shape[1:] != tuple(frame_shape):
+      raise ValueError(f"Frames of layer {layer} have shape {array.shape[1:]}, got {frame_shape}")
+    return array
+
+  def write_frame(self, index: int, frame: Dict[str, np.ndarray]) -> None:
+    """Writes the layers of a single frame (shape (height, width, channels) each)."""
+    if self._closed:
+      raise RuntimeError("SequenceStoreWriter is closed")
+    for layer, data in frame.items():
+      data = np.asarray(data)
+      array = self._array(layer, data.shape, data.dtype)
+      array[index] = data
+      self._written[layer][index] = True
+
+  def write(self, layer: str, data: np.ndarray) -> None:
+    """Writes all frames of a layer at once (shape (num_frames, height, width, channels))."""
+    data = np.asarray(data)
+    if len(data) != self.num_frames:
+      raise ValueError(f"Expected {self.num_frames} frames of layer {layer}, got {len(data)}")
+    array = self._array(layer, data.shape[1:], data.dtype)
+    array[:] = data
+    self._written[layer][:] = True
+
+  def _release(self):
+    for array in self._arrays.values():
+      array.flush()
+    self._arrays = {}
+    self._closed = True
+
+  def close(self) -> None:
+    """Flushes all layers and writes store.json (all frames of all layers must be written)."""
+    if self._closed:
+      return
+    for layer, written in self._written.items():
+      if not written.all():
+        missing = np.nonzero(~written)[0].tolist()
+        raise ValueError(f"Frames {missing} of layer {layer} were not written")
+    layers = {layer: {"dtype": array.dtype.str, "shape": list(array.shape)}
+              for layer, array in self._arrays.items()}
+    self._release()
+    info = {"version": STORE_VERSION, "num_frames": self.num_frames, "fps": self.fps,
+            "attrs": self.attrs, "layers": layers}
+    tmp_file = self.path / (STORE_FILE + ".tmp")
+    with open(tmp_file, "w", encoding="utf-8") as f:
+      json.dump(info, f, indent=2)
+    os.replace(tmp_file, self.path / STORE_FILE)
+    logger.info("Wrote sequence store %s with layers %s", self.path, sorted(layers))
+
+
+class SequenceStore:
+  """Read access to a store.
+
+  store["rgba"] is a read-only memory-mapped (num_frames, H, W, C) array.
+  """
+
+  def __init__(self, path: PathLike):
+    self.path = pathlib.Path(path)
+    with open(self.path / STORE_FILE, encoding="utf-8") as f:
+      info = json.load(f)
+    if info.get("version") != STORE_VERSION:
+      raise ValueError(f"Unsupported sequence store version {info.get('version')!r} in {self.path}")
+    self.num_frames = info["num_frames"]
+    self.fps = info["fps"]
+    self.attrs = info["attrs"]
+    self._layers = info["layers"]
+
+  @property
+  def layers(self):
+    return sorted(self._layers)
+
+  def __contains__(self, layer: str) -> bool:
+    return layer in self._layers
+
+  def __getitem__(self, layer: str) -> np.ndarray:
+    if layer not in self._layers:
+      raise KeyError(f"No layer {layer!r} in {self.path} (has {self.layers})")
+    return np.load(self.path / f"{layer}.npy", mmap_mode="r")
+
+  def frames(self, layer: str) -> Iterator[np.ndarray]:
+    yield from self[layer]
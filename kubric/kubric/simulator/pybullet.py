@@ -20,10 +20,11 @@ import logging
 import pathlib
 import sys
 import tempfile
-from typing import Dict, List, Optional, Tuple, Union
+from typing import Dict, List, Optional, Sequence, Tuple, Union
 
 from kubric import core
 from kubric.redirect_io import RedirectStream
+import numpy as np
 import tensorflow as tf
 
 # --- hides the "pybullet build time: May 26 2021 18:52:36" message on import
@@ -187,14 +188,21 @@ class PyBullet(core.View):
     register_physical_object_setters(obj, obj_idx, self._physics_client)
     return obj_idx
 
-  def check_overlap(self, obj: core.PhysicalObject) -> bool:
+  def check_overlap(self, obj: core.PhysicalObject,
+                    others: Optional[Sequence[core.PhysicalObject]] = None) -> bool:
+    """Checks whether obj intersects any other body (or any of the given other objects).
+
+    Candidate bodies are found with the broadphase of PyBullet (overlapping axis aligned bounding
+    boxes), and only those are checked exactly with getClosestPoints.
+    """
     obj_idx = obj.linked_objects[self]
+    aabb_min, aabb_max = self.get_aabb(obj)
+    overlapping = self._physics_client.getOverlappingObjects(aabb_min, aabb_max) or ()
+    body_ids = {body_id for body_id, _ in overlapping}
+    if others is not None:
+      body_ids &= {other.linked_objects[self] for other in others if self in other.linked_objects}
 
-    body_ids = [
-        self._physics_client.getBodyUniqueId(i)
-        for i in range(self._physics_client.getNumBodies())
-    ]
-    for body_id in body_ids:
+    for body_id in sorted(body_ids):
       if body_id == obj_idx:
         continue
       overlap_points = self._physics_client.getClosestPoints(
@@ -203,6 +211,14 @@ class PyBullet(core.View):
         return True
     return False
 
+  def get_aabb(self, obj: core.PhysicalObject) -> np.ndarray:
+    """Axis-aligned bounding box [(min_x, min_y, min_z), (max_x, max_y, max_z)] of the collision
+    shape of obj (over all its links)."""
+    obj_idx = obj.linked_objects[self]
+    aabbs = np.array([self._physics_client.getAABB(obj_idx, link_idx)
+                      for link_idx in range(-1, self._physics_client.getNumJoints(obj_idx))])
+    return np.array([aabbs[:, 0].min(axis=0), aabbs[:, 1].max(axis=0)])
+
   def get_position_and_rotation(self, obj_idx: int):
     pos, quat = self._physics_client.getBasePositionAndOrientation(obj_idx)
     return pos, xyzw2wxyz(quat)  # convert quaternion format
@@ -221,8 +237,9 @@ class PyBullet(core.View):
   def run(
       self,
       frame_start: int = 0,
-      frame_end: Optional[int] = None
-  ) -> Tuple[Dict[core.PhysicalObject, Dict[str, list]], List[dict]]:
+      frame_end: Optional[int] = None,
+      collision_stride: int = 1,
+  ) -> Tuple[Dict[core.PhysicalObject, Dict[str, np.ndarray]], List[dict]]:
     """
     Run the physics simulation.
 
@@ -234,73 +251,86 @@ class PyBullet(core.View):
         Also the first frame for which keyframes are stored.
       frame_end: The last frame (inclusive) that is simulated (and for which animations
         are computed).
+      collision_stride: Collect collision events every collision_stride physics steps
+        (1 = every step). If 0, no collisions are collected, which is considerably faster
+        for scenes with many contacts.
 
     Returns:
-      A dict of all animations and a list of all collision events.
+      A dict of all animations (arrays with one row per frame) and a list of all collision events.
     """
 
     frame_end = self.scene.frame_end if frame_end is None else frame_end
     steps_per_frame = self.scene.step_rate // self.scene.frame_rate
-    max_step = (frame_end - frame_start + 1) * steps_per_frame
-
-    obj_idxs = [
-        self._physics_client.getBodyUniqueId(i)
-        for i in range(self._physics_client.getNumBodies())
-    ]
-    animation = {obj_id: {"position": [], "quaternion": [], "velocity": [], "angular_velocity": []}
-                 for obj_id in obj_idxs}
+    num_frames = frame_end - frame_start + 1
+    max_step = num_frames * steps_per_frame
+    client = self._physics_client
+
+    obj_idxs = [client.getBodyUniqueId(i) for i in range(client.getNumBodies())]
+    idx_to_asset = {asset.linked_objects[self]: asset for asset in self.scene.assets
+                    if self in asset.linked_objects}
+    # static bodies do not move, so their state is only read once
+    dynamic = np.array([client.getDynamicsInfo(obj_idx, -1)[0] > 0 for obj_idx in obj_idxs],
+                       dtype=bool)
+
+    positions = np.zeros((len(obj_idxs), num_frames, 3))
+    quaternions = np.zeros((len(obj_idxs), num_frames, 4))
+    velocities = np.zeros((len(obj_idxs), num_frames, 3))
+    angular_velocities = np.zeros((len(obj_idxs), num_frames, 3))
+    for i, obj_idx in enumerate(obj_idxs):
+      if not dynamic[i]:
+        positions[i], quaternions[i] = self.get_position_and_rotation(obj_idx)
+        velocities[i], angular_velocities[i] = self.get_velocities(obj_idx)
+    dynamic_idxs = [(i, obj_idx) for i, obj_idx in enumerate(obj_idxs) if dynamic[i]]
+
+    get_position_and_orientation = client.getBasePositionAndOrientation
+    get_base_velocity = client.getBaseVelocity
+    get_contact_points = client.getContactPoints
+    step_simulation = client.stepSimulation
 
     collisions = []
     for current_step in range(max_step):
 
-      contact_points = self._physics_client.getContactPoints()
-      for collision in contact_points:
-        (contact_flag,
-         body_a, body_b,
-         link_a, link_b,
-         position_a, position_b, contact_normal_b,
-         contact_distance, normal_force,
-         lateral_friction1, lateral_friction_dir1,
-         lateral_friction2, lateral_friction_dir2) = collision
-        del link_a, link_b  # < unused
-        del contact_flag, contact_distance, position_a  # < unused
-        del lateral_friction1, lateral_friction2  # < unused
-        del lateral_friction_dir1, lateral_friction_dir2  # < unused
-        if normal_force > 1e-6:
-          collisions.append({
-              "instances": (self._obj_idx_to_asset(body_b), self._obj_idx_to_asset(body_a)),
-              "position": position_b,
-              "contact_normal": contact_normal_b,
-              "frame": current_step / steps_per_frame,
-              "force": normal_force,
-          })
+      if collision_stride and current_step % collision_stride == 0:
+        for collision in get_contact_points():
+          body_a, body_b = collision[1], collision[2]
+          position_b, contact_normal_b, normal_force = collision[6], collision[7], collision[9]
+          if normal_force > 1e-6:
+            collisions.append({
+                "instances": (idx_to_asset.get(body_b), idx_to_asset.get(body_a)),
+                "position": position_b,
+                "contact_normal": contact_normal_b,
+                "frame": current_step / steps_per_frame,
+                "force": normal_force,
+            })
 
       if current_step % steps_per_frame == 0:
-        for obj_idx in obj_idxs:
-          position, quaternion = self.get_position_and_rotation(obj_idx)
-          velocity, angular_velocity = self.get_velocities(obj_idx)
-
-          animation[obj_idx]["position"].append(position)
-          animation[obj_idx]["quaternion"].append(quaternion)
-          animation[obj_idx]["velocity"].append(velocity)
-          animation[obj_idx]["angular_velocity"].append(angular_velocity)
-
-      self._physics_client.stepSimulation()
-
-    animation = {asset: animation[asset.linked_objects[self]] for asset in self.scene.assets
-                 if asset.linked_objects.get(self) in obj_idxs}
+        frame_id = current_step // steps_per_frame
+        for i, obj_idx in dynamic_idxs:
+          position, quaternion = get_position_and_orientation(obj_idx)
+          velocity, angular_velocity = get_base_velocity(obj_idx)
+          positions[i, frame_id] = position
+          quaternions[i, frame_id] = xyzw2wxyz(quaternion)
+          velocities[i, frame_id] = velocity
+          angular_velocities[i, frame_id] = angular_velocity
+
+      step_simulation()
+
+    animation = {}
+    for i, obj_idx in enumerate(obj_idxs):
+      asset = idx_to_asset.get(obj_idx)
+      if asset is not None:
+        animation[asset] = {"position": positions[i],
+                            "quaternion": quaternions[i],
+                            "velocity": velocities[i],
+                            "angular_velocity": angular_velocities[i]}
 
     # --- Transfer simulation to renderer keyframes
-    for obj in animation.keys():
-      for frame_id in range(frame_end - frame_start + 1):
-        obj.position = animation[obj]["position"][frame_id]
-        obj.quaternion = animation[obj]["quaternion"][frame_id]
-        obj.velocity = animation[obj]["velocity"][frame_id]
-        obj.angular_velocity = animation[obj]["angular_velocity"][frame_id]
-        obj.keyframe_insert("position", frame_id + frame_start)
-        obj.keyframe_insert("quaternion", frame_id + frame_start)
-        obj.keyframe_insert("velocity", frame_id + frame_start)
-        obj.keyframe_insert("angular_velocity", frame_id + frame_start)
+    frames = range(frame_start, frame_end + 1)
+    for obj, obj_animation in animation.items():
+      for key, values in obj_animation.items():
+        obj.set_keyframes(key, frames, values)
+        # leave the object in the state of the last frame
+        setattr(obj, key, values[-1])
 
     return animation, collisions
 
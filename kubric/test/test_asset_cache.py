@@ -0,0 +1,153 @@
+# Copyright 2024 The Kubric Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import tarfile
+import threading
+import time
+
+import pytest
+
+from kubric.assets import asset_cache
+from kubric.assets import asset_source
+
+
+def make_asset_archive(data_dir, asset_id, payload_size=100):
+  asset_dir = data_dir / "src" / asset_id
+  asset_dir.mkdir(parents=True)
+  (asset_dir / "data.json").write_text(json.dumps({"id": asset_id}))
+  (asset_dir / "payload.bin").write_bytes(b"x" * payload_size)
+  archive = data_dir / f"{asset_id}.tar.gz"
+  with tarfile.open(archive, "w:gz") as tar:
+    tar.add(asset_dir, arcname=asset_id)
+  return archive
+
+
+def make_source(data_dir, asset_ids, cache_dir, max_cache_size=None):
+  assets = {a: {"asset_type": "Texture", "kwargs": {}, "metadata": {}} for a in asset_ids}
+  return asset_source.AssetSource(name="test", data_dir=data_dir, assets=assets,
+                                  cache_dir=cache_dir, max_cache_size=max_cache_size)
+
+
+def test_cache_populates_once(tmp_path):
+  cache = asset_cache.AssetCache(tmp_path / "cache")
+  calls = []
+
+  def populate(target_dir):
+    calls.append(target_dir)
+    (target_dir / "file.txt").write_text("content")
+
+  entry = cache.get("abc", populate)
+  assert (entry / "file.txt").read_text() == "content"
+  cache.release_all()
+
+  other = asset_cache.AssetCache(tmp_path / "cache")
+  assert other.get("abc", populate) == entry
+  assert len(calls) == 1
+
+
+def test_cache_failed_populate_leaves_no_entry(tmp_path):
+  cache = asset_cache.AssetCache(tmp_path / "cache")
+
+  def populate(target_dir):
+    (target_dir / "partial.txt").write_text("partial")
+    raise IOError("download failed")
+
+  with pytest.raises(IOError):
+    cache.get("abc", populate)
+  assert not cache.entries()
+  assert list((tmp_path / "cache" / "entries").iterdir()) == []
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+  cache = asset_cache.AssetCache(tmp_path / "cache")
+  for key in ["a", "b", "c"]:
+    cache.get(key, lambda d: (d / "payload.bin").write_bytes(b"x" * 100))
+  cache.release("a")
+  cache.release("b")
+  cache.get("a", lambda d: None)  # "a" is now more recently used than "b"
+  cache.release("a")
+
+  assert cache.evict(max_size=150) == 2
+  # "c" is still in use and is kept even though the cache is too large
+  assert set(cache.entries()) == {"c"}
+
+
+def test_asset_source_reuses_cache_across_instances(tmp_path):
+  make_asset_archive(tmp_path, "obj1")
+  cache_dir = tmp_path / "cache"
+
+  with make_source(tmp_path, ["obj1"], cache_dir) as source:
+    asset_dir = source.fetch(source._resolve_asset_path("", "obj1"), "obj1")
+    assert (asset_dir / "data.json").exists()
+    assert asset_dir.parent.parent == cache_dir / "entries"
+
+  with make_source(tmp_path, ["obj1"], cache_dir) as source:
+    mtime = (asset_dir / "data.json").stat().st_mtime_ns
+    assert source.fetch(source._resolve_asset_path("", "obj1"), "obj1") == asset_dir
+    assert (asset_dir / "data.json").stat().st_mtime_ns == mtime
+  assert (asset_dir / "data.json").exists()
+
+
+def test_asset_source_without_cache_uses_local_dir(tmp_path, monkeypatch):
+  monkeypatch.delenv(asset_cache.CACHE_DIR_ENV, raising=False)
+  make_asset_archive(tmp_path, "obj1")
+  with make_source(tmp_path, ["obj1"], cache_dir=None) as source:
+    asset_dir = source.fetch(source._resolve_asset_path("", "obj1"), "obj1")
+    assert asset_dir == source.local_dir / "obj1"
+    assert (asset_dir / "data.json").exists()
+  assert not asset_dir.exists()
+
+
+def test_cache_populate_does_not_wait_for_holders(tmp_path):
+  holder = asset_cache.AssetCache(tmp_path / "cache")
+  other = asset_cache.AssetCache(tmp_path / "cache")
+  checked, holder_done = threading.Event(), threading.Event()
+  is_complete = other._is_complete
+
+  def is_complete_then_wait(key):
+    # both clients find the entry incomplete before either of them populates it
+    complete = is_complete(key)
+    if not checked.is_set():
+      checked.set()
+      holder_done.wait(timeout=5)
+    return complete
+
+  other._is_complete = is_complete_then_wait
+  other_thread = threading.Thread(target=other.get, args=("abc", lambda d: pytest.fail("populated twice")))
+  other_thread.start()
+  checked.wait()
+  holder_thread = threading.Thread(
+      target=holder.get, args=("abc", lambda d: (d / "file.txt").write_text("content")))
+  holder_thread.start()
+  holder_thread.join(timeout=5)
+  holder_finished = not holder_thread.is_alive()
+  holder_done.set()
+  other_thread.join(timeout=5)
+  # the holder keeps its shared lock, the other client must not wait for its release
+  assert holder_finished and not other_thread.is_alive()
+  assert "abc" in holder._held and "abc" in other._held
+
+
+def test_asset_source_release_allows_eviction(tmp_path):
+  make_asset_archive(tmp_path, "obj1")
+  with make_source(tmp_path, ["obj1"], tmp_path / "cache") as source:
+    source.fetch(source._resolve_asset_path("", "obj1"), "obj1")
+    assert source.cache.evict(max_size=0) == 0
+    source.release()
+    assert source.cache.evict(max_size=0) == 1
+    # fetched (and held) again after the release
+    asset_dir = source.fetch(source._resolve_asset_path("", "obj1"), "obj1")
+    assert (asset_dir / "data.json").exists()
+    assert source.cache.evict(max_size=0) == 0
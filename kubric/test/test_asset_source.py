@@ -0,0 +1,129 @@
+# Copyright 2024 The Kubric Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import tarfile
+import threading
+
+import pytest
+
+from kubric.assets import asset_source
+
+
+@pytest.fixture
+def bucket(tmp_path):
+  """A local directory standing in for the asset bucket, with five archived assets."""
+  data_dir = tmp_path / "bucket"
+  for i in range(5):
+    asset_id = f"obj{i}"
+    src = tmp_path / "src" / asset_id
+    src.mkdir(parents=True)
+    (src / "data.json").write_text(json.dumps({"id": asset_id}))
+    data_dir.mkdir(exist_ok=True)
+    with tarfile.open(data_dir / f"{asset_id}.tar.gz", "w:gz") as tar:
+      tar.add(src, arcname=asset_id)
+  return data_dir
+
+
+def make_source(data_dir, **kwargs):
+  assets = {f"obj{i}": {"asset_type": "Texture", "kwargs": {}, "metadata": {}} for i in range(5)}
+  return asset_source.AssetSource(name="test", data_dir=data_dir, assets=assets, **kwargs)
+
+
+@pytest.mark.parametrize("use_cache", [False, True])
+def test_prefetch_fetches_in_background(bucket, tmp_path, monkeypatch, use_cache):
+  monkeypatch.delenv("KUBRIC_ASSET_CACHE", raising=False)
+  cache_dir = tmp_path / "cache" if use_cache else None
+  with make_source(bucket, cache_dir=cache_dir) as source:
+    calls = []
+    original_copy_and_extract = source._copy_and_extract
+
+    def copy_and_extract(asset_path, asset_id, target_dir):
+      calls.append((asset_id, threading.current_thread().name))
+      original_copy_and_extract(asset_path, asset_id, target_dir)
+
+    monkeypatch.setattr(source, "_copy_and_extract", copy_and_extract)
+    futures = source.prefetch(["obj1", "obj2", "obj1"], max_workers=2)
+    asset_dirs = [f.result() for f in futures]
+    assert asset_dirs[0] == asset_dirs[2]
+    assert all((d / "data.json").exists() for d in asset_dirs)
+    assert sorted(a for a, _ in calls) == ["obj1", "obj2"]
+    assert all(name.startswith("prefetch_test") for _, name in calls)
+
+    # fetching a prefetched asset reuses it, other assets are fetched synchronously
+    assert source.fetch(source._resolve_asset_path("", "obj1"), "obj1") == asset_dirs[0]
+    source.fetch(source._resolve_asset_path("", "obj3"), "obj3")
+    assert sorted(a for a, _ in calls) == ["obj1", "obj2", "obj3"]
+
+
+def test_failed_prefetch_is_retried_by_fetch(bucket, tmp_path, monkeypatch):
+  monkeypatch.delenv("KUBRIC_ASSET_CACHE", raising=False)
+  archive = bucket / "obj4.tar.gz"
+  moved = tmp_path / "obj4.tar.gz"
+  archive.rename(moved)
+  with make_source(bucket) as source:
+    (future,) = source.prefetch(["obj4"])
+    with pytest.raises(Exception):
+      future.result()
+
+    moved.rename(archive)
+    asset_dir = source.fetch(source._resolve_asset_path("", "obj4"), "obj4")
+    assert (asset_dir / "data.json").exists()
+
+
+def test_fetch_retries_prefetch_failing_while_waiting(bucket, monkeypatch):
+  monkeypatch.delenv("KUBRIC_ASSET_CACHE", raising=False)
+  with make_source(bucket) as source:
+    started, fail = threading.Event(), threading.Event()
+    original_fetch = source._fetch
+    calls = []
+
+    def flaky_fetch(asset_path, asset_id):
+      calls.append(asset_id)
+      if len(calls) == 1:
+        started.set()
+        fail.wait(timeout=5)
+        raise IOError("connection reset")
+      return original_fetch(asset_path, asset_id)
+
+    monkeypatch.setattr(source, "_fetch", flaky_fetch)
+    source.prefetch(["obj1"])
+    started.wait(timeout=5)
+    threading.Timer(0.1, fail.set).start()
+    # joins the running prefetch, which fails, and fetches again
+    asset_dir = source.fetch(source._resolve_asset_path("", "obj1"), "obj1")
+    assert (asset_dir / "data.json").exists()
+    assert calls == ["obj1", "obj1"]
+
+
+def test_release_keeps_prefetched_assets(bucket, tmp_path, monkeypatch):
+  monkeypatch.delenv("KUBRIC_ASSET_CACHE", raising=False)
+  with make_source(bucket, cache_dir=tmp_path / "cache") as source:
+    for future in source.prefetch(["obj1", "obj2"]):
+      future.result()
+    source.fetch(source._resolve_asset_path("", "obj1"), "obj1")
+    source.release()
+    # only obj1 was created: obj2 is still held for the next sequence
+    assert source.cache.evict(max_size=0) == 1
+    calls = []
+    monkeypatch.setattr(source, "_copy_and_extract", lambda *args: calls.append(args))
+    asset_dir = source.fetch(source._resolve_asset_path("", "obj2"), "obj2")
+    assert (asset_dir / "data.json").exists()
+    assert not calls
+
+
+def test_prefetch_unknown_asset_raises(bucket):
+  with make_source(bucket) as source:
+    with pytest.raises(KeyError):
+      source.prefetch(["missing"])
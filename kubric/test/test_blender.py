@@ -12,6 +12,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import numpy as np
+import pytest
+
 from kubric.safeimport.bpy import bpy
 
 from kubric import core
@@ -141,3 +144,56 @@ def test_blender_samples_per_pixel_init(tmp_path):
   renderer = blender.Blender(core.Scene(), tmp_path, samples_per_pixel=256)
   assert renderer.samples_per_pixel == 256
   assert renderer.blender_scene.cycles.samples == 256
+
+
+def test_passes_for_layers():
+  assert blender.passes_for_layers(["rgba"]) == set()
+  assert blender.passes_for_layers(["rgba", "forward_flow", "backward_flow"]) == {"Vector"}
+  assert blender.passes_for_layers(["depth", "segmentation"]) == {"Depth", "CryptoObject00"}
+  with pytest.raises(ValueError):
+    blender.passes_for_layers(["not_a_layer"])
+
+
+def test_blender_render_layers(tmp_path):
+  renderer = blender.Blender(core.Scene(), tmp_path, render_layers=["rgba"])
+  assert renderer.render_layers == ("rgba",)
+  assert renderer.render_passes == set()
+  assert "AuxOutputs" not in renderer.blender_scene.view_layers
+  assert [slot.path for slot in renderer.exr_output_node.file_slots] == ["Image"]
+
+
+def _fcurve_points(blender_obj, data_path="location"):
+  curves = {}
+  for fcurve in blender_obj.animation_data.action.fcurves:
+    if fcurve.data_path == data_path:
+      curves[fcurve.array_index] = [
+          (tuple(point.co), point.interpolation, point.handle_left_type, point.handle_right_type)
+          for point in fcurve.keyframe_points]
+  return curves
+
+
+def test_set_fcurves_matches_keyframe_insert():
+  bpy.ops.mesh.primitive_cube_add()
+  reference = bpy.context.active_object
+  bpy.ops.mesh.primitive_cube_add()
+  batched = bpy.context.active_object
+
+  def insert_keyframes(frames, values):
+    for frame, value in zip(frames, values):
+      reference.location = value
+      reference.keyframe_insert("location", frame=frame)
+
+  frames = [1, 2, 3, 5]
+  values = np.arange(12, dtype=np.float64).reshape(4, 3)
+  insert_keyframes(frames, values)
+  blender_utils.set_fcurves(batched, "location", frames, values)
+  assert _fcurve_points(batched) == _fcurve_points(reference)
+
+  # a second call replaces existing frames, adds new ones and uses the last of duplicate frames
+  frames = [2, 4, 5, 4]
+  values = -np.arange(12, dtype=np.float64).reshape(4, 3)
+  insert_keyframes(frames, values)
+  blender_utils.set_fcurves(batched, "location", frames, values)
+  points = _fcurve_points(batched)
+  assert points == _fcurve_points(reference)
+  assert [co[0] for co, *_ in points[0]] == [1, 2, 3, 4, 5]
@@ -24,9 +24,11 @@ from traitlets import TraitError
 from unittest import mock
 
 from kubric.core import Asset
+from kubric.core import KeyframeTrack
 from kubric.core import UndefinedAsset
 from kubric.core import objects
 from kubric.core import materials
+from kubric.core import lights
 
 
 def test_asset_default_uid():
@@ -278,3 +280,109 @@ def test_keyframe_insert():
   assert change_argument.frame == 7
   assert change_argument.type == "keyframe"
 
+
+def test_set_keyframes():
+  obj = objects.Object3D(position=(1, 1, 1))
+  handler = mock.Mock()
+  obj.observe(handler, "position", type="keyframe")
+
+  obj.set_keyframes("position", [3, 4, 5], [(0, 0, 0), (1, 2, 3), (4, 5, 6)])
+
+  assert handler.call_count == 1
+  change_argument = handler.call_args[0][0]
+  assert change_argument.name == "position"
+  assert change_argument.frames == (3, 4, 5)
+  assert "frame" not in change_argument
+  assert_allclose(change_argument.frame_values[1], (1, 2, 3))
+  assert_allclose(obj.position, (1, 1, 1))
+  assert sorted(obj.keyframes["position"]) == [3, 4, 5]
+  assert obj.keyframes["position"][5].dtype == np.float32
+  assert_allclose(obj.get_value_at("position", 4), (1, 2, 3))
+
+
+def test_set_keyframes_raises():
+  obj = objects.Object3D()
+  with pytest.raises(KeyError):
+    obj.set_keyframes("doesnotexist", [1], [1])
+  with pytest.raises(ValueError):
+    obj.set_keyframes("position", [1, 2], [(0, 0, 0)])
+
+
+def test_keyframe_track_unordered_and_overwrite():
+  track = KeyframeTrack()
+  track[5] = np.array([5., 5.])
+  track[1] = np.array([1., 1.])
+  track.update([3, 5, 3], [np.array([3., 3.]), np.array([6., 6.]), np.array([4., 4.])])
+  assert list(track) == [1, 3, 5]
+  assert 3 in track and 2 not in track
+  assert_allclose(track[3], (4, 4))  # last given value wins
+  assert_allclose(track[5], (6, 6))
+  with pytest.raises(KeyError):
+    _ = track[2]
+
+
+@pytest.mark.parametrize("interpolation", ["linear", "const", "nearest"])
+def test_keyframe_track_interpolate(interpolation):
+  track = KeyframeTrack()
+  track.update([2, 4, 8], [np.array([0., 1.]), np.array([2., 3.]), np.array([10., 11.])])
+  frames = np.arange(0, 11)
+  values = track.interpolate(frames, interpolation=interpolation)
+  assert values.shape == (11, 2)
+  assert_allclose(values[[0, 1, 2]], [[0, 1]] * 3)
+  assert_allclose(values[[8, 9, 10]], [[10, 11]] * 3)
+  assert_allclose(values[4], (2, 3))
+  expected_3 = {"linear": (1, 2), "const": (0, 1), "nearest": (0, 1)}[interpolation]
+  expected_7 = {"linear": (8, 9), "const": (2, 3), "nearest": (10, 11)}[interpolation]
+  assert_allclose(values[3], expected_3)
+  assert_allclose(values[7], expected_7)
+
+
+def test_keyframe_track_object_values():
+  track = KeyframeTrack()
+  mat_a, mat_b = materials.UndefinedMaterial(), materials.FlatMaterial()
+  track[1] = mat_a
+  track[3] = mat_b
+  assert track[3] is mat_b
+  assert list(track.interpolate([0, 2, 4], interpolation="const")) == [mat_a, mat_a, mat_b]
+
+
+def test_get_value_at_keyframed_material():
+  mat_a, mat_b = materials.UndefinedMaterial(), materials.FlatMaterial()
+  obj = objects.FileBasedObject(material=mat_a)
+  obj.keyframe_insert("material", 1)
+  obj.material = mat_b
+  obj.keyframe_insert("material", 3)
+  assert obj.get_value_at("material", 0) is mat_a
+  assert obj.get_value_at("material", 2) is mat_a  # objects are not interpolated
+  assert obj.get_value_at("material", 3) is mat_b
+  with obj.at_frame(2):
+    assert obj.material is mat_a
+  assert obj.material is mat_b
+
+
+def test_get_value_at_keyframed_color():
+  light = lights.DirectionalLight(color=(0, 0, 0))
+  light.keyframe_insert("color", 0)
+  light.color = (1, 1, 1)
+  light.keyframe_insert("color", 10)
+  assert_allclose(light.get_value_at("color", 5), (0.5, 0.5, 0.5))
+  values = light.get_values_over_time("color", frames=range(11))
+  assert values.shape == (11, 3)
+  assert_allclose(values[:, 0], np.linspace(0, 1, 11), rtol=1e-6)
+
+
+def test_keyframe_track_linear_keeps_dtype():
+  track = KeyframeTrack()
+  track.update([0, 2], [np.array([0.1, 0.2], dtype=np.float32), np.array([1., 2.], dtype=np.float32)])
+  values = track.interpolate([-1, 0, 1, 2, 3])
+  assert values.dtype == np.float32
+  assert_allclose(values[[0, 1]], [[0.1, 0.2]] * 2)
+  assert values[1][0] == np.float32(0.1)  # exact keyframes are returned unchanged
+
+
+def test_get_values_over_time():
+  obj = objects.Object3D()
+  obj.set_keyframes("position", [0, 10], [(0, 0, 0), (10, 20, 30)])
+  values = obj.get_values_over_time("position", frames=range(11))
+  assert values.dtype == np.float32
+  assert_allclose(values, np.linspace((0, 0, 0), (10, 20, 30), 11), rtol=1e-6)
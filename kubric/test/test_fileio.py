@@ -97,6 +97,30 @@ def test_write_read_float32_tiff(tmpdir):
   np.testing.assert_array_equal(img_data_recovered, img_data)
 
 
+@pytest.mark.parametrize("compression", [0, 1, 9])
+def test_write_compressed_png_and_tiff(tmpdir, compression):
+  img_data = np.linspace(0, 1., 32*32, dtype=np.float32).reshape((32, 32, 1))
+  file_io.write_png(img_data, tmpdir / "img.png", compression=compression)
+  file_io.write_tiff(img_data, tmpdir / "img.tiff", compression=compression)
+  np.testing.assert_array_equal(file_io.read_png(tmpdir / "img.png"),
+                                (img_data * 65535).astype(np.uint16))
+  np.testing.assert_array_equal(file_io.read_tiff(tmpdir / "img.tiff"), img_data)
+
+
+def test_multi_write_image_raises_write_errors(tmpdir):
+  data = np.full((3, 4, 4, 1), 2., dtype=np.float32)  # png needs values in [0, 1]
+  with pytest.raises(ValueError):
+    file_io.multi_write_image(data, str(tmpdir / "img_{:05d}.png"))
+
+
+def test_write_rgb_batch_in_processes(tmpdir):
+  data = np.arange(3*4*4*3, dtype=np.uint8).reshape((3, 4, 4, 3))
+  # a single worker: each spawned worker imports kubric (and tensorflow) before the first write
+  file_io.write_rgb_batch(data, tmpdir, max_write_threads=1, compression=1, use_processes=True)
+  for i in range(3):
+    np.testing.assert_array_equal(file_io.read_png(tmpdir / f"rgb_{i:05d}.png"), data[i])
+
+
 def test_write_image_dict(tmpdir):
   img_dict = {
       "rgb": np.arange(4*4*4*3, dtype=np.uint8).reshape((4, 4, 4, 3)),
@@ -146,3 +170,34 @@ def test_write_image_dict(tmpdir):
 
       assert img.shape == img_recovered.shape
       np.testing.assert_allclose(img_recovered, img, rtol=1e-4, atol=1e-4)
+
+
+def test_streaming_frame_writer(tmpdir):
+  img_dict = {
+      "rgba": np.arange(4*4*4*4, dtype=np.uint8).reshape((4, 4, 4, 4)),
+      "depth": np.linspace(0, 100000., 4*4*4, dtype=np.float32).reshape((4, 4, 4, 1)),
+      "forward_flow": np.linspace(0, 100., 4*4*4*2, dtype=np.float32).reshape((4, 4, 4, 2)),
+      "segmentation": np.ones(4*4*4, dtype=np.uint8).reshape((4, 4, 4, 1)),
+  }
+  directories = {key: tmpdir / key for key in img_dict}
+  with file_io.StreamingFrameWriter(directories, max_queued_frames=2,
+                                    num_segmentation_ids=2) as writer:
+    for i in range(4):
+      writer.write(i, {key: value[i] for key, value in img_dict.items()})
+
+  for i in range(4):
+    np.testing.assert_array_equal(
+        file_io.read_png(tmpdir / "rgba" / f"rgba_{i:05d}.png"), img_dict["rgba"][i])
+    np.testing.assert_allclose(
+        file_io.read_tiff(tmpdir / "depth" / f"depth_{i:05d}.tiff"), img_dict["depth"][i])
+    assert (tmpdir / "segmentation" / f"segmentation_{i:05d}.png").exists()
+    assert (tmpdir / "forward_flow" / f"forward_flow_{i:05d}.png").exists()
+  data_ranges = file_io.read_json(tmpdir / "forward_flow" / "data_ranges.json")
+  assert data_ranges["forward_flow"]["max"] == pytest.approx(100.)
+
+
+def test_streaming_frame_writer_raises_write_errors(tmpdir):
+  writer = file_io.StreamingFrameWriter({"depth": tmpdir})
+  writer.write(0, {"depth": np.zeros((4, 4, 2), dtype=np.float32)})  # tiff needs 1, 3 or 4 channels
+  with pytest.raises(AssertionError):
+    writer.close()
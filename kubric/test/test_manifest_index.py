@@ -0,0 +1,95 @@
+# Copyright 2024 The Kubric Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+
+import numpy as np
+
+from kubric import file_io
+from kubric.assets import asset_source
+from kubric.assets import manifest_index
+
+
+def make_manifest(path, num_assets=10):
+  categories = ["chair", "table", ""]
+  assets = {
+      f"obj{i:02d}": {
+          "asset_type": "FileBasedObject",
+          "kwargs": {"render_filename": "{asset_dir}/model.obj", "bounds": [[0, 0, 0], [1, 1, 1]]},
+          "metadata": {"category": categories[i % 3], "nr": i},
+      } for i in range(num_assets)}
+  path.write_text(json.dumps({"name": "test_manifest", "data_dir": str(path.parent),
+                              "assets": assets}))
+  return assets
+
+
+def test_indexed_manifest_matches_manifest(tmp_path):
+  assets = make_manifest(tmp_path / "manifest.json")
+  index = manifest_index.compile_manifest({"assets": assets}, "test_manifest", str(tmp_path),
+                                          tmp_path / "index")
+  assert len(index) == len(assets)
+  assert list(index) == sorted(assets)
+  for asset_id, entry in assets.items():
+    assert index[asset_id] == entry
+  assert "missing" not in index
+  assert index.get("missing") is None
+  assert index.category_index == manifest_index.category_index(assets)
+  assert index.category_index["chair"] == ["obj00", "obj03", "obj06", "obj09"]
+
+
+def test_from_manifest_compiles_and_reuses_index(tmp_path, monkeypatch):
+  manifest_path = tmp_path / "manifest.json"
+  make_manifest(manifest_path)
+
+  with asset_source.AssetSource.from_manifest(manifest_path, index_dir=tmp_path / "idx") as source:
+    assert isinstance(source._assets, manifest_index.IndexedManifest)
+    assert source.name == "test_manifest"
+  (index_path,) = (tmp_path / "idx").iterdir()
+
+  # the second source opens the index without parsing the manifest
+  original_read_json = file_io.read_json
+
+  def read_json(filename):
+    assert str(filename) != str(manifest_path), "manifest should not be parsed again"
+    return original_read_json(filename)
+
+  monkeypatch.setattr(asset_source.file_io, "read_json", read_json)
+  with asset_source.AssetSource.from_manifest(manifest_path, index_dir=tmp_path / "idx") as source:
+    assert source._assets.index_dir == index_path
+    assert len(source.all_asset_ids) == 10
+
+
+def test_category_lookup_and_test_split(tmp_path):
+  manifest_path = tmp_path / "manifest.json"
+  assets = make_manifest(manifest_path, num_assets=20)
+  plain = asset_source.AssetSource("plain", tmp_path, assets)
+  indexed = asset_source.AssetSource.from_manifest(manifest_path, index_dir=tmp_path / "idx")
+
+  for source in [plain, indexed]:
+    assert source.categories == ["chair", "table"]
+    assert source.ids_for_category("table") == sorted(
+        k for k, v in assets.items() if v["metadata"]["category"] == "table")
+    assert source.ids_for_category("lamp") == []
+
+    train_ids, test_ids = source.get_test_split(fraction=0.25)
+    assert len(test_ids) == 5
+    assert sorted(list(train_ids) + list(test_ids)) == sorted(assets)
+
+    db = source.db
+    assert len(db) == 20
+    chair_rows = db[db["category"] == "chair"]
+    np.testing.assert_array_equal(chair_rows["category_id"], 0)
+    assert np.isnan(db[db["category"] == ""]["category_id"]).all()
+  plain.close()
+  indexed.close()
@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from kubric import post_processing
 from kubric.renderer import blender_utils
 
 from kubric.core.scene import Scene
@@ -65,6 +66,42 @@ def test_mm3hash():
     assert blender_utils.mm3hash(name) == expected
 
 
+def test_replace_cryptomatte_hashes_by_asset_index():
+  assets = [objects.Cube(name=name) for name, _ in name_to_crypto[1:4]]
+  assets[1].segmentation_id = 7
+  hashes = np.array([h for _, h in name_to_crypto[:4]] + [12345], dtype=np.uint32)
+  segmentation = hashes[[[0, 1, 2], [3, 4, 1]]][..., None]
+  result = blender_utils.replace_cryptomatte_hashes_by_asset_index(segmentation, assets)
+  assert result.dtype == np.uint32
+  np.testing.assert_array_equal(result[..., 0], [[0, 1, 7], [3, 0, 1]])
+
+
+def test_compute_visibility_and_bboxes():
+  assets = [objects.Cube(), objects.Sphere(), objects.Cube()]
+  segmentation = np.zeros((2, 4, 5, 1), dtype=np.uint8)
+  segmentation[0, 1:3, 2:4] = 1
+  segmentation[1, 0, 0] = 2
+  segmentation[1, 3, 4] = 2
+  segmentation[1, 2, 1] = 9  # not an asset
+  post_processing.compute_visibility(segmentation, assets)
+  post_processing.compute_bboxes(segmentation, assets)
+  assert [a.metadata["visibility"] for a in assets] == [[4, 0], [0, 2], [0, 0]]
+  assert assets[0].metadata["bbox_frames"] == [0]
+  np.testing.assert_allclose(assets[0].metadata["bboxes"], [(0.25, 0.4, 0.75, 0.8)])
+  assert assets[1].metadata["bbox_frames"] == [1]
+  np.testing.assert_allclose(assets[1].metadata["bboxes"], [(0., 0., 1., 1.)])
+  assert assets[2].metadata["bboxes"] == []
+
+
+def test_adjust_segmentation_idxs():
+  old_assets = [objects.Cube(), objects.Sphere(), objects.Cube(segmentation_id=5)]
+  segmentation = np.array([[0, 1, 2], [3, 4, 1]], dtype=np.int32)
+  result = post_processing.adjust_segmentation_idxs(segmentation, old_assets, [old_assets[1]],
+                                                    ignored_label=9)
+  assert result.dtype == np.int32
+  np.testing.assert_array_equal(result, [[0, 9, 1], [5, 0, 9]])
+
+
 @pytest.mark.skip(reason="TODO(klausg)")
 def test_optical_flow():
   # --- create scene and attach a renderer to it
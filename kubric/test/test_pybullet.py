@@ -50,3 +50,28 @@ def test_simulator_in_loop():
     scene.add(cube)
     simulator.run()
     np.testing.assert_allclose(cube.position[1], -0.5 * 10, atol=0.1)
+
+
+def test_run_keyframes_and_collisions():
+  scene = kb.Scene(gravity=(0, 0, -10), frame_end=12)
+  simulator = KubricSimulator(scene)
+  floor = kb.Cube(name="floor", scale=(5, 5, 0.1), position=(0, 0, -0.1), static=True)
+  cube = kb.Cube(name="cube", scale=0.5, position=(0, 0, 1))
+  scene.add([floor, cube])
+
+  animation, collisions = simulator.run(frame_start=1, frame_end=12)
+
+  assert animation[cube]["position"].shape == (12, 3)
+  assert animation[cube]["quaternion"].shape == (12, 4)
+  assert sorted(cube.keyframes["position"]) == list(range(1, 13))
+  np.testing.assert_allclose(cube.keyframes["position"][7], animation[cube]["position"][6],
+                             atol=1e-6)
+  np.testing.assert_allclose(cube.position, animation[cube]["position"][-1], atol=1e-6)
+  np.testing.assert_allclose(animation[floor]["position"], [[0, 0, -0.1]] * 12, atol=1e-6)
+  assert collisions
+  assert {c["instances"] for c in collisions} <= {(cube, floor), (floor, cube)}
+
+  _, strided = simulator.run(frame_start=13, frame_end=24, collision_stride=4)
+  assert 0 < len(strided)
+  _, none = simulator.run(frame_start=25, frame_end=36, collision_stride=0)
+  assert none == []
@@ -0,0 +1,83 @@
+# Copyright 2024 The Kubric Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pyquaternion as pyquat
+import pytest
+
+import kubric as kb
+from kubric import randomness
+from kubric.simulator.pybullet import PyBullet as KubricSimulator
+
+
+def test_quaternions_to_matrices():
+  quaternions = randomness.random_rotations(10, rng=np.random.RandomState(0))
+  np.testing.assert_allclose(np.linalg.norm(quaternions, axis=-1), 1.)
+  matrices = randomness.quaternions_to_matrices(quaternions)
+  for q, m in zip(quaternions, matrices):
+    np.testing.assert_allclose(m, pyquat.Quaternion(*q).rotation_matrix, atol=1e-12)
+
+
+def test_rotated_aabboxes_match_aabbox():
+  cube = kb.Cube(scale=(1., 2., 0.5))
+  quaternions = randomness.random_rotations(5, rng=np.random.RandomState(1))
+  boxes = randomness.rotated_aabboxes(cube, quaternions)
+  for q, box in zip(quaternions, boxes):
+    cube.quaternion = q
+    np.testing.assert_allclose(box, cube.aabbox, atol=1e-5)
+
+
+def test_aabb_overlaps():
+  boxes = np.array([[[0, 0, 0], [1, 1, 1]], [[5, 5, 5], [6, 6, 6]]], dtype=np.float64)
+  others = np.array([[[0.5, 0.5, 0.5], [2, 2, 2]]], dtype=np.float64)
+  np.testing.assert_array_equal(randomness.aabb_overlaps(boxes, others), [[True], [False]])
+  assert randomness.aabb_overlaps(boxes, np.zeros((0, 2, 3))).shape == (2, 0)
+
+
+def test_place_without_overlap():
+  scene = kb.Scene()
+  simulator = KubricSimulator(scene)
+  rng = np.random.RandomState(0)
+  cubes = []
+  for i in range(8):
+    cube = kb.Cube(name=f"cube{i}", scale=0.5, position=(0, 0, 0))
+    scene.add(cube)
+    randomness.place_without_overlap(cube, simulator, spawn_region=[(-4, -4, 0), (4, 4, 2)],
+                                     rng=rng)
+    cubes.append(cube)
+
+  # exhaustive check of all pairs of bodies (independent of the broadphase of check_overlap)
+  client = simulator._physics_client
+  body_ids = [client.getBodyUniqueId(i) for i in range(client.getNumBodies())]
+  assert len(body_ids) == len(cubes)
+  for i, body_a in enumerate(body_ids):
+    for body_b in body_ids[i + 1:]:
+      assert not client.getClosestPoints(body_a, body_b, distance=0)
+
+  for cube in cubes:
+    box = cube.aabbox
+    assert np.all(box[0] >= (-4 - 1e-5, -4 - 1e-5, -1e-5))
+    assert np.all(box[1] <= (4 + 1e-5, 4 + 1e-5, 2 + 1e-5))
+
+
+def test_place_without_overlap_fails_without_space():
+  scene = kb.Scene()
+  simulator = KubricSimulator(scene)
+  blocker = kb.Cube(name="blocker", scale=3, position=(0, 0, 0), static=True)
+  scene.add(blocker)
+  cube = kb.Cube(name="cube", scale=0.5)
+  scene.add(cube)
+  with pytest.raises(RuntimeError):
+    randomness.place_without_overlap(cube, simulator, spawn_region=[(-1, -1, -1), (1, 1, 1)],
+                                     max_trials=20, rng=np.random.RandomState(0))
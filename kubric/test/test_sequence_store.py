@@ -0,0 +1,62 @@
+# Copyright 2024 The Kubric Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+
+from kubric import sequence_store
+
+
+def test_write_and_read_frames(tmpdir):
+  rgba = np.arange(3*4*5*4, dtype=np.uint8).reshape((3, 4, 5, 4))
+  flow = np.linspace(-10, 10, 3*4*5*2, dtype=np.float32).reshape((3, 4, 5, 2))
+  with sequence_store.SequenceStoreWriter(tmpdir, num_frames=3, fps=12,
+                                          attrs={"seq": 7}) as writer:
+    for i in [2, 0, 1]:
+      writer.write_frame(i, {"rgba": rgba[i], "forward_flow": flow[i]})
+    assert not sequence_store.is_sequence_store(tmpdir)
+  assert sequence_store.is_sequence_store(tmpdir)
+
+  store = sequence_store.SequenceStore(tmpdir)
+  assert store.layers == ["forward_flow", "rgba"]
+  assert store.num_frames == 3 and store.fps == 12 and store.attrs == {"seq": 7}
+  assert isinstance(store["rgba"], np.memmap)
+  np.testing.assert_array_equal(store["rgba"], rgba)
+  assert store["forward_flow"].dtype == np.float32  # not quantized
+  np.testing.assert_array_equal(store["forward_flow"], flow)
+  np.testing.assert_array_equal(list(store.frames("rgba"))[1], rgba[1])
+  # plain .npy files, readable without kubric
+  np.testing.assert_array_equal(np.load(str(tmpdir / "rgba.npy")), rgba)
+
+
+def test_write_batch(tmpdir):
+  depth = np.random.rand(2, 4, 4, 1).astype(np.float32)
+  with sequence_store.SequenceStoreWriter(tmpdir, num_frames=2) as writer:
+    writer.write("depth", depth)
+  np.testing.assert_array_equal(sequence_store.SequenceStore(tmpdir)["depth"], depth)
+
+
+def test_close_raises_for_missing_frames(tmpdir):
+  writer = sequence_store.SequenceStoreWriter(tmpdir, num_frames=3)
+  writer.write_frame(0, {"rgba": np.zeros((2, 2, 4), np.uint8)})
+  with pytest.raises(ValueError, match=r"Frames \[1, 2\]"):
+    writer.close()
+  assert not sequence_store.is_sequence_store(tmpdir)
+
+
+def test_write_frame_raises_for_wrong_shape(tmpdir):
+  writer = sequence_store.SequenceStoreWriter(tmpdir, num_frames=2)
+  writer.write_frame(0, {"rgba": np.zeros((2, 2, 4), np.uint8)})
+  with pytest.raises(ValueError):
+    writer.write_frame(1, {"rgba": np.zeros((3, 2, 4), np.uint8)})
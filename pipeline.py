@@ -1,14 +1,65 @@
+import argparse
+import json
 import subprocess
 import os
-import shutil
 import logging
+import threading
+import time
+from pathlib import Path
+
+import natsort
+
 from rpg_vid2e.upsampling.utils import Upsampler
 from event_generator import EventGenerator
+import export_shards
+import render_server
+import stage_graph
+import tracing
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def start_simulation(simulation_type = "gso"):
+OUTPUT_DIR = Path("output")
+# marker <seq>/<stage>.done delle sequenze completate da ogni stage (render è scritto dal generatore)
+MARKER_DIR = OUTPUT_DIR / "markers"
+# span di tutti i processi con "trace": true, una directory per esecuzione (vedi tracing.py)
+TRACE_DIR = OUTPUT_DIR / "traces"
+# coda dei job di render_server.py, con "render_server": true
+RENDER_QUEUE_DIR = OUTPUT_DIR / "render_queue"
+
+
+def load_config(config_file):
+    if not os.path.isfile(config_file):
+        logging.warning(f"⚠️ File di configurazione {config_file} non trovato, uso valori di default")
+        return {}
+    with open(config_file) as f:
+        return json.load(f)
+
+
+def generator_args(config):
+    """Argomenti di generator_shapenet.py per le chiavi presenti nella configurazione (come pipeline.sh)."""
+    def words(value):
+        return [str(v) for v in value] if isinstance(value, list) else str(value).replace(",", " ").split()
+
+    args = []
+    for key, flag in [("classes", "--classes"), ("light_levels", "--light_levels"), ("layers", "--layers")]:
+        if key in config:
+            args += [flag] + words(config[key])
+    for key in ["light_orientations", "camera_positions", "light_colors"]:
+        if key in config:
+            args += [f"--{key}"] + [str(x) for name, values in config[key].items() for x in [name] + list(values)]
+    for key, flag in [("random_generation", "--rand_gen"), ("reuse_scene", "--reuse_scene"),
+                      ("stream_render", "--stream_render"), ("write_processes", "--write_processes")]:
+        if key in config:
+            args += [flag, str(config[key]).lower()]
+    for key in ["num_workers", "prefetch", "compression", "output_format"]:
+        if key in config:
+            args += [f"--{key}", str(config[key])]
+    return args
+
+
+def start_simulation(simulation_type = "gso", extra_args=(), asset_cache_max_gb=20):
+    """Avvia la simulazione in docker e restituisce il processo (senza attenderne la fine)."""
     user_id = os.getuid()
     group_id = os.getgid()
     current_dir = os.getcwd()
@@ -25,39 +76,157 @@ def start_simulation(simulation_type = "gso"):
             "docker", "run", "--rm", "--interactive",
             "--user", f"{user_id}:{group_id}",
             "--volume", f"{current_dir}:/kubric",
+            "--env", "KUBRIC_ASSET_CACHE=/kubric/.asset_cache",
+            "--env", f"KUBRIC_ASSET_CACHE_MAX_BYTES={int(float(asset_cache_max_gb) * 2**30)}",
+            # tracing attivo anche nel generatore (la directory è relativa a /kubric)
+            "--env", f"{tracing.ENV_VAR}={os.environ.get(tracing.ENV_VAR, '')}",
             "kubricdockerhub/kubruntu",
-            "/usr/bin/python3", "generator_shapenet.py"
-        ]
+            "/usr/bin/python3", "generator_shapenet.py",
+            "--output_root", str(OUTPUT_DIR),
+            # le sequenze già renderizzate in un'esecuzione precedente non vengono rifatte
+            "--skip_done", "true",
+        ] + list(extra_args)
+
+    return subprocess.Popen(cmd)
+
+
+def submit_render(queue, extra_args=()):
+    """Accoda il rendering a un server già avviato (render_server.py) e restituisce l'id del job."""
+    return queue.submit_grid([
+        "--output_root", str(OUTPUT_DIR),
+        "--skip_done", "true",
+    ] + list(extra_args) + [
+        # il server renderizza nel suo processo (più server possono servire la stessa coda)
+        "--num_workers", "1",
+    ])
+
+
+def rendered_sequences(finished, poll_interval=2.0):
+    """Sequenze renderizzate, restituite appena il generatore ne scrive il marker render.done.
+
+    Una sequenza renderizzata di nuovo (marker riscritto) viene restituita un'altra volta, così
+    gli stage successivi la rielaborano. finished() indica se il rendering è terminato (processo
+    docker uscito o job del server concluso).
+    """
+    emitted = {}
+
+    def new_sequences():
+        markers = {}
+        for path in MARKER_DIR.glob("*/render.done"):
+            try:
+                markers[path.parent.name] = path.stat().st_mtime
+            except FileNotFoundError:  # rimosso dal generatore prima di renderizzare di nuovo
+                continue
+        return natsort.natsorted(seq for seq, mtime in markers.items() if emitted.get(seq) != mtime), markers
 
-    subprocess.run(cmd)
+    while True:
+        done = finished()
+        sequences, markers = new_sequences()
+        for seq in sequences:
+            emitted[seq] = markers[seq]
+            yield seq
+        if done:
+            break
+        time.sleep(poll_interval)
 
-def pipeline():
+    # sequenze scritte senza marker (es. simulatore gso)
+    rendered = {d.name for layer in ("rgb", "store") for d in (OUTPUT_DIR / layer).glob("seq*") if d.is_dir()}
+    yield from natsort.natsorted(rendered - emitted.keys())
+
+
+# modelli caricati una volta per worker
+_worker_state = threading.local()
+
+
+def upsample_sequence(seq):
+    if not hasattr(_worker_state, "upsampler"):
+        _worker_state.upsampler = Upsampler()
+        tracing.instrument(_worker_state.upsampler.interpolator, "interpolate", "interpolation")
+        tracing.instrument(_worker_state.upsampler, "_write_img", "png_write")
+    # con --output_format store i frame RGB sono negli store di output/store
+    src_dir = OUTPUT_DIR / "rgb" / seq
+    if not src_dir.is_dir():
+        src_dir = OUTPUT_DIR / "store" / seq
+    _worker_state.upsampler.upsample_directory(str(src_dir), str(OUTPUT_DIR / "upsampled_rgb" / seq))
+
+
+def generate_events(seq):
+    if not hasattr(_worker_state, "event_generator"):
+        _worker_state.event_generator = EventGenerator(
+            base_dir=OUTPUT_DIR / "upsampled_rgb",
+            output_base_dir=OUTPUT_DIR / "events"
+        )
+    if not _worker_state.event_generator.generate_single(seq):
+        raise RuntimeError(f"Generazione eventi fallita per {seq}")
+
+
+def pipeline(config_file="config.json"):
+    """Render → upsampling → eventi, con ogni sequenza che passa allo stage successivo appena pronta.
+
+    Il rendering gira in docker (o su un server già avviato con "render_server": true, vedi
+    render_server.py) per tutte le sequenze mentre upsampling ed eventi elaborano quelle
+    già renderizzate, ognuno con il proprio pool di worker (upsample_workers, event_workers).
+    Gli stage già completati (marker in output/markers) non vengono rifatti.
+    """
+    config = load_config(config_file)
+    trace_dir = TRACE_DIR / time.strftime("%Y%m%d-%H%M%S")
+    if config.get("trace", False):
+        # ereditato dai processi dei worker e passato al container del generatore
+        os.environ[tracing.ENV_VAR] = str(trace_dir)
+        tracing.enable(trace_dir)
     logging.info("🚀 Avvio pipeline completa")
-    
+
     # Start the Kubric simulation to generate initial RGB frames
-    logging.info("📹 Avvio simulazione Kubric...")
-    start_simulation("shapenet")
-    
-    # Clean up any existing upsampled output directory
-    output_dir = "output/upsampled_rgb"
-    if os.path.exists(output_dir):
-        logging.info(f"🧹 Pulizia directory esistente: {output_dir}")
-        shutil.rmtree(output_dir)
-
-    # Upsample ALL RGB sequences from the simulation
-    logging.info("📈 Avvio upsampling per tutte le sequenze...")
-    upsampler = Upsampler(input_dir="output/rgb", output_dir=output_dir)
-    upsampler.upsample()
-    
-    # Generate events for ALL upsampled sequences
-    logging.info("⚡ Generazione eventi per tutte le sequenze...")
-    generator = EventGenerator(
-        base_dir="output/upsampled_rgb",
-        output_base_dir="output/events"
-    )
-    successful, failed = generator.generate_all()
-    
-    logging.info(f"✅ Pipeline completata: {successful} sequenze elaborate con successo, {failed} fallimenti")
+    queue = render_server.RenderQueue(RENDER_QUEUE_DIR) if config.get("render_server", False) else None
+    if queue is not None and not queue.servers():
+        logging.warning(f"⚠️ Nessun server di rendering attivo su {RENDER_QUEUE_DIR}, avvio un container docker")
+        queue = None
+    if queue is not None:
+        logging.info(f"📹 Rendering sui server {', '.join(queue.servers())}...")
+        job_id = submit_render(queue, generator_args(config))
+        render = None
+        # il job è concluso, oppure il suo server non dà segni di vita da molto tempo
+        finished = lambda: queue.status(job_id) in ("done", "failed") or queue.abandoned(job_id)
+    else:
+        logging.info("📹 Avvio simulazione Kubric...")
+        render = start_simulation("shapenet", generator_args(config), config.get("asset_cache_max_gb", 20))
+        finished = lambda: render.poll() is not None
+
+    graph = stage_graph.StageGraph([
+        stage_graph.Stage("upsample", upsample_sequence, num_workers=config.get("upsample_workers", 1)),
+        stage_graph.Stage("events", generate_events, num_workers=config.get("event_workers", 1)),
+    ], MARKER_DIR, source_stage="render")
+    try:
+        completed = graph.run(rendered_sequences(finished))
+    finally:
+        if render is not None and render.poll() is None:
+            render.terminate()
+    if render is not None and render.returncode != 0:
+        logging.error(f"❌ Simulazione terminata con codice {render.returncode}")
+    if queue is not None:
+        if queue.abandoned(job_id):
+            logging.error(f"❌ Il server del job {job_id} non risponde, job ancora in {queue.status(job_id)}")
+        try:
+            queue.result(job_id)
+        except (RuntimeError, FileNotFoundError) as e:
+            logging.error(f"❌ Rendering sul server fallito: {e}")
+
+    # Pack frames, events, segmentations and annotations of each sequence into shards for training
+    # (una copia di tutti i dati: solo con "export_shards": true)
+    if config.get("export_shards", False):
+        logging.info("📦 Esportazione in shard...")
+        with tracing.span("export_shards"):
+            export_shards.export(OUTPUT_DIR, OUTPUT_DIR / "shards")
+
+    if tracing.enabled():
+        logging.info(f"⏱️ Tempi per stage (trace in {trace_dir / tracing.TRACE_FILE}):\n{tracing.write_report(trace_dir)}")
+
+    for seq, (stage, error) in natsort.natsorted(graph.failed.items()):
+        logging.warning(f"⚠️ {seq}: {stage} fallito ({error})")
+    logging.info(f"✅ Pipeline completata: {len(set(completed))} sequenze elaborate con successo, {len(graph.failed)} fallimenti")
+
 
 if __name__ == "__main__":
-    pipeline()
+    parser = argparse.ArgumentParser("Render, upsampling e generazione eventi per sequenza")
+    parser.add_argument("--config", default="config.json")
+    pipeline(parser.parse_args().config)
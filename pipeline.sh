@@ -18,6 +18,15 @@ if [ -f "$CONFIG_FILE" ]; then
     CAMERA_POSITIONS=$(python3 -c "import json; c=json.load(open('$CONFIG_FILE')); d=c.get('camera_positions', {}); print(' '.join([f\"{k} {v[0]} {v[1]} {v[2]}\" for k,v in d.items()]))")
     LIGHT_COLORS=$(python3 -c "import json; c=json.load(open('$CONFIG_FILE')); d=c.get('light_colors', {}); print(' '.join([f\"{k} {v[0]} {v[1]} {v[2]} {v[3]}\" for k,v in d.items()]))")
     RAND_GEN=$(python3 -c "import json; c=json.load(open('$CONFIG_FILE')); print(str(c.get('random_generation', True)).lower())")
+    NUM_WORKERS=$(python3 -c "import json; c=json.load(open('$CONFIG_FILE')); print(int(c.get('num_workers', 1)))")
+    LAYERS=$(python3 -c "import json; c=json.load(open('$CONFIG_FILE')); v=c.get('layers', ['rgba', 'backward_flow', 'forward_flow', 'depth', 'normal', 'object_coordinates', 'segmentation']); print(' '.join(v if isinstance(v, list) else str(v).replace(',', ' ').split()))")
+    REUSE_SCENE=$(python3 -c "import json; c=json.load(open('$CONFIG_FILE')); print(str(c.get('reuse_scene', False)).lower())")
+    STREAM_RENDER=$(python3 -c "import json; c=json.load(open('$CONFIG_FILE')); print(str(c.get('stream_render', False)).lower())")
+    PREFETCH=$(python3 -c "import json; c=json.load(open('$CONFIG_FILE')); print(int(c.get('prefetch', 2)))")
+    COMPRESSION=$(python3 -c "import json; c=json.load(open('$CONFIG_FILE')); print(int(c.get('compression', -1)))")
+    OUTPUT_FORMAT=$(python3 -c "import json; c=json.load(open('$CONFIG_FILE')); print(c.get('output_format', 'png'))")
+    WRITE_PROCESSES=$(python3 -c "import json; c=json.load(open('$CONFIG_FILE')); print(str(c.get('write_processes', False)).lower())")
+    ASSET_CACHE_MAX_GB=$(python3 -c "import json; c=json.load(open('$CONFIG_FILE')); print(c.get('asset_cache_max_gb', 20))")
 echo "📋 Configurazioni caricate da $CONFIG_FILE"
 else
     echo "⚠️  File di configurazione $CONFIG_FILE non trovato, uso valori di default"
@@ -26,6 +35,15 @@ else
     LIGHT_COLORS="white 1.0 1.0 1.0 1.0 red 1.0 0.0 0.0 1.0"
     CAMERA_POSITIONS="front 0 0 5 side 5 0 0 top 0 5 5"
     LIGHT_ORIENTATIONS="top 0 0 1 side 1 0 0"
+    NUM_WORKERS=1
+    REUSE_SCENE=false
+    STREAM_RENDER=false
+    PREFETCH=2
+    COMPRESSION=-1
+    WRITE_PROCESSES=false
+    OUTPUT_FORMAT=png
+    ASSET_CACHE_MAX_GB=20
+    LAYERS="rgba backward_flow forward_flow depth normal object_coordinates segmentation"
 fi
 
 
@@ -39,6 +57,14 @@ echo "  - Livelli di luce: $LIGHT_LEVELS"
 echo "  - Colori luce: $LIGHT_COLORS"
 echo "  - Posizioni camera: $CAMERA_POSITIONS"
 echo "  - Orientamenti luce: $LIGHT_ORIENTATIONS"
+echo "  - Worker paralleli: $NUM_WORKERS"
+echo "  - Riuso scena: $REUSE_SCENE"
+echo "  - Rendering in streaming: $STREAM_RENDER"
+echo "  - Sequenze prefetch: $PREFETCH"
+echo "  - Formato output: $OUTPUT_FORMAT"
+echo "  - Compressione PNG/TIFF: $COMPRESSION (processi di scrittura: $WRITE_PROCESSES)"
+echo "  - Cache asset: .asset_cache (max $ASSET_CACHE_MAX_GB GB)"
+echo "  - Layer renderizzati: $LAYERS"
 echo ""
 
 # Utente e gruppo corrente (per Docker)
@@ -52,6 +78,8 @@ if [ "$SIMULATION_TYPE" = "shapenet" ]; then
     docker run --rm -it \
         --user ${USER_ID}:${GROUP_ID} \
         --volume ${CURRENT_DIR}:/kubric \
+        --env KUBRIC_ASSET_CACHE=/kubric/.asset_cache \
+        --env KUBRIC_ASSET_CACHE_MAX_BYTES=$(python3 -c "print(int(float('$ASSET_CACHE_MAX_GB') * 2**30))") \
         kubricdockerhub/kubruntu \
         /usr/bin/python3 generator_shapenet.py \
             --output_root "$OUTPUT_DIR" \
@@ -60,7 +88,15 @@ if [ "$SIMULATION_TYPE" = "shapenet" ]; then
             --light_orientations $LIGHT_ORIENTATIONS \
             --camera_positions $CAMERA_POSITIONS \
             --light_colors $LIGHT_COLORS \
-            --rand_gen $RAND_GEN
+            --rand_gen $RAND_GEN \
+            --num_workers $NUM_WORKERS \
+            --reuse_scene $REUSE_SCENE \
+            --stream_render $STREAM_RENDER \
+            --prefetch $PREFETCH \
+            --compression $COMPRESSION \
+            --write_processes $WRITE_PROCESSES \
+            --output_format $OUTPUT_FORMAT \
+            --layers $LAYERS
 
 fi
 
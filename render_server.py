@@ -0,0 +1,284 @@
+"""Long-running render worker: bpy and the asset manifests are loaded once and reused by every batch.
+
+Starting generator_shapenet.py means starting a container, importing bpy and loading the
+ShapeNet, HDRI and KuBasic manifests before the first sequence is rendered. The server does that
+once and then renders the jobs submitted to a queue of json files in a directory shared with the
+clients (output/render_queue by default, so it is visible through the /kubric volume of docker):
+
+  docker run --rm --user $(id -u):$(id -g) --volume $(pwd):/kubric \
+      --env KUBRIC_ASSET_CACHE=/kubric/.asset_cache \
+      kubricdockerhub/kubruntu /usr/bin/python3 render_server.py [generator arguments]
+
+  queue = RenderQueue("output/render_queue")
+  job_id = queue.submit_grid(["--classes", "airplane", "--light_levels", "0.5"])
+  job_id = queue.submit_sequence(7, shape_id, 0.5, (0, 0, 0.78), (7, -4, 5), (1, 1, 1, 1))
+  result = queue.wait(job_id)  # {"outputs": {"<seq_id>": {"layers": ..., "store": ..., "metadata": ...}}, ...}
+
+A job is <queue_dir>/pending/<job_id>.json; a server claims it by renaming it into running/ (so
+several servers, e.g. one per GPU, can share a queue) and moves it to done/ with the output paths
+of its sequences, or to failed/ with the traceback. The arguments of a job are parsed after those
+of the server, so they override them. Every rendered sequence also gets its render marker, as
+with generator_shapenet.py (see stage_graph.py). Each running server refreshes
+<queue_dir>/servers/<host>-<pid>.json, which tells clients whether anybody is serving the queue
+(and, with RenderQueue.abandoned, whether the server of a running job is gone).
+
+This module only imports generator_shapenet (and bpy) when the server is started, so the client
+can be used outside the kubric container. pipeline.py submits its renders to the queue when the
+configuration has "render_server": true and a server is running.
+"""
+import argparse
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+from pathlib import Path
+
+QUEUE_DIR = Path("output/render_queue")
+STATES = ("pending", "running", "done", "failed")
+
+# arguments of generator_shapenet.py that do not change the Blender scene (see _session_key)
+_GRID_ARGS = {"classes", "light_levels", "light_orientations", "camera_positions", "light_colors", "rand_gen",
+              "grid_seed", "shard_index", "num_shards", "num_workers", "skip_done", "prefetch", "output_root"}
+
+
+def _write_json(path, data):
+    tmp_path = path.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps(data))
+    tmp_path.replace(path)
+
+
+class RenderQueue:
+    """Client (and storage) of the queue of render jobs in queue_dir."""
+
+    def __init__(self, queue_dir=QUEUE_DIR):
+        self.queue_dir = Path(queue_dir)
+        for state in STATES + ("servers",):
+            (self.queue_dir / state).mkdir(parents=True, exist_ok=True)
+
+    def path(self, state, job_id):
+        return self.queue_dir / state / f"{job_id}.json"
+
+    def submit(self, job):
+        """Adds the job (a json serializable dict with a "kind") to the queue and returns its id."""
+        # the name orders the jobs by submission time
+        job_id = f"{time.time_ns()}-{os.getpid()}"
+        _write_json(self.path("pending", job_id), dict(job, id=job_id, submitted=time.time()))
+        return job_id
+
+    def submit_grid(self, args=()):
+        """Renders the grid of sequences of generator_shapenet.py with the given command line arguments."""
+        return self.submit({"kind": "grid", "args": [str(arg) for arg in args]})
+
+    def submit_sequence(self, seq_id, shape_id, light_intensity, orientation, camera_position, light_color,
+                        hdri_id=None, random=False, args=()):
+        """Renders a single sequence, with the parameters of generator_shapenet.generate_sequence."""
+        return self.submit({"kind": "sequence", "args": [str(arg) for arg in args], "seq_id": seq_id,
+                            "shape_id": shape_id, "light_intensity": light_intensity,
+                            "orientation": list(orientation), "camera_position": list(camera_position),
+                            "light_color": list(light_color), "hdri_id": hdri_id, "random": random})
+
+    def status(self, job_id):
+        """State of the job ("pending", "running", "done" or "failed"), None if unknown."""
+        # in the order in which a job moves, so that a job being moved is not missed
+        for state in STATES:
+            if self.path(state, job_id).is_file():
+                return state
+        return None
+
+    def result(self, job_id):
+        """The finished job with its "outputs", raises RuntimeError if it failed."""
+        path = self.path("failed", job_id)
+        if path.is_file():
+            job = json.loads(path.read_text())
+            raise RuntimeError(f"Job {job_id} fallito:\n{job['error']}")
+        return json.loads(self.path("done", job_id).read_text())
+
+    def wait(self, job_id, timeout=None, poll_interval=1.0):
+        """Waits for the job to finish and returns result(job_id)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.status(job_id) not in ("done", "failed"):
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f"Job {job_id} non completato in {timeout}s")
+            time.sleep(poll_interval)
+        return self.result(job_id)
+
+    def servers(self, max_age=60.0):
+        """Names of the servers that refreshed their heartbeat in the last max_age seconds."""
+        now = time.time()
+        return sorted(path.stem for path in (self.queue_dir / "servers").glob("*.json")
+                      if now - path.stat().st_mtime <= max_age)
+
+    def abandoned(self, job_id, max_age=600.0):
+        """Whether the job is not finished and nobody is going to finish it.
+
+        That is the case if the server running the job (or any server, for a pending job) has not
+        refreshed its heartbeat for max_age seconds. The heartbeat is written by a thread of the
+        server, which a long bpy call can hold up, so max_age has to be far above its period.
+        """
+        state = self.status(job_id)
+        if state == "running":
+            try:
+                server = json.loads(self.path("running", job_id).read_text()).get("server")
+            except (FileNotFoundError, json.JSONDecodeError):
+                return False  # moved or being written in the meantime
+            return server is not None and server not in self.servers(max_age)
+        return state == "pending" and not self.servers(max_age)
+
+    def claim(self, server=None):
+        """Moves the oldest pending job to running and returns it, None if there are none."""
+        for path in sorted((self.queue_dir / "pending").glob("*.json")):
+            running = self.path("running", path.stem)
+            try:
+                path.rename(running)
+            except FileNotFoundError:
+                continue  # claimed by another server
+            job = json.loads(running.read_text())
+            if server is not None:
+                _write_json(running, dict(job, server=server))
+            return job
+        return None
+
+    def finish(self, job, error=None, **result):
+        state = "done" if error is None else "failed"
+        _write_json(self.path(state, job["id"]), dict(job, error=error, finished=time.time(), **result))
+        self.path("running", job["id"]).unlink(missing_ok=True)
+
+    def requeue_running(self):
+        """Puts back in pending the jobs left running by a server that was stopped."""
+        for path in (self.queue_dir / "running").glob("*.json"):
+            path.replace(self.path("pending", path.stem))
+
+
+def _session_key(args):
+    return json.dumps({key: value for key, value in vars(args).items() if key not in _GRID_ARGS},
+                      sort_keys=True, default=str)
+
+
+class RenderServer:
+    """Renders the jobs of a RenderQueue with the generator loaded in this process."""
+
+    def __init__(self, queue, generator_argv=(), poll_interval=1.0):
+        import generator_shapenet  # imports bpy and loads the manifests
+        self.generator = generator_shapenet
+        self.queue = queue
+        self.generator_argv = list(generator_argv)
+        self.poll_interval = poll_interval
+        self.name = f"{socket.gethostname()}-{os.getpid()}"
+        self._session = None
+        self._session_key = None
+        self._stopped = threading.Event()
+
+        if self.generator.tracing.enabled():
+            self.generator.instrument_tracing()
+        self.generator.KUBASIC_SOURCE.prefetch(["dome"])
+
+    def session(self, args):
+        """The scene of the previous job if the job has the same scene arguments, with --reuse_scene."""
+        if not args.reuse_scene:
+            return None
+        key = _session_key(args)
+        if key != self._session_key:
+            # a single scene at a time: Blender has one active scene per process
+            self._session = None
+            self._session = self.generator.SceneSession(args)
+            self._session_key = key
+        return self._session
+
+    def jobs(self, job, args, grid):
+        """The sequences (jobs of generator_shapenet.render_jobs) of a queue job."""
+        gen = self.generator
+        if job["kind"] == "grid":
+            if args.num_workers > 1:
+                raise ValueError("num_workers > 1 non supportato dal server: avviare più server sulla stessa coda")
+            return gen.select_jobs(args, *grid)
+        if job["kind"] == "sequence":
+            seq_id = job["seq_id"]
+            orientation, cam_pos, color = (tuple(job[key]) for key in ("orientation", "camera_position", "light_color"))
+            sequence = dict(seq_id=seq_id, random=job.get("random", False), **{"class": job["shape_id"]},
+                            shape_id=job["shape_id"], intensity=job["light_intensity"], orient_name=str(orientation),
+                            orientation=orientation, cam_name=str(cam_pos), cam_pos=cam_pos, color_name=str(color),
+                            color_value=color)
+            if args.skip_done and gen.stage_graph.is_done(args.output_root / "markers", f"seq{seq_id}", "render",
+                                                          params=gen.render_params(sequence, args)):
+                return []
+            gen.stage_graph.clear_done(args.output_root / "markers", f"seq{seq_id}", "render")
+            sequence["hdri_id"] = job.get("hdri_id") or gen.choose_hdri(seq_id, args.seed)
+            return [sequence]
+        raise ValueError(f"Tipo di job sconosciuto: {job['kind']}")
+
+    def render(self, job):
+        """Renders the job and returns the output paths of its sequences, by seq_id."""
+        args = self.generator.parse_args(self.generator_argv + job.get("args", []))
+        grid = self.generator.parse_grid_args(args)  # also validates args.layers
+        jobs = self.jobs(job, args, grid)
+        return self.generator.render_jobs(jobs, args, args.output_root, self.session(args))
+
+    def _heartbeat(self):
+        path = self.queue.queue_dir / "servers" / f"{self.name}.json"
+        while not self._stopped.is_set():
+            _write_json(path, {"name": self.name, "started": self.started})
+            self._stopped.wait(self.poll_interval)
+        path.unlink(missing_ok=True)
+
+    def serve(self, idle_timeout=0, max_jobs=None):
+        """Renders queue jobs until stopped, idle for idle_timeout seconds (0 = never) or after max_jobs jobs."""
+        self.started = time.time()
+        heartbeat = threading.Thread(target=self._heartbeat, daemon=True)
+        heartbeat.start()
+        logging.info(f"🖥️  Server di rendering {self.name} in attesa di job in {self.queue.queue_dir}")
+        served = 0
+        idle_since = time.monotonic()
+        try:
+            while not self._stopped.is_set() and (max_jobs is None or served < max_jobs):
+                job = self.queue.claim(self.name)
+                if job is None:
+                    if idle_timeout and time.monotonic() - idle_since > idle_timeout:
+                        logging.info(f"💤 Nessun job da {idle_timeout}s, arresto del server")
+                        break
+                    time.sleep(self.poll_interval)
+                    continue
+                logging.info(f"▶️  Job {job['id']} ({job['kind']})")
+                start = time.perf_counter()
+                try:
+                    outputs = self.render(job)
+                except Exception:
+                    logging.error(f"❌ Job {job['id']} fallito:\n{traceback.format_exc()}")
+                    self.queue.finish(job, error=traceback.format_exc(), server=self.name)
+                else:
+                    seconds = time.perf_counter() - start
+                    self.queue.finish(job, outputs=outputs, seconds=seconds, server=self.name)
+                    logging.info(f"✅ Job {job['id']}: {len(outputs)} sequenze in {seconds:.1f}s")
+                served += 1
+                idle_since = time.monotonic()
+        finally:
+            self.stop()
+            heartbeat.join()
+
+    def stop(self):
+        self._stopped.set()
+
+
+def main():
+    parser = argparse.ArgumentParser("Server di rendering: renderizza i job della coda senza ricaricare bpy e manifest",
+                                     epilog="Gli altri argomenti sono quelli di generator_shapenet.py, usati come default dei job")
+    parser.add_argument("--queue_dir", type=Path, default=QUEUE_DIR)
+    parser.add_argument("--poll_interval", type=float, default=1.0, help="Secondi tra due controlli della coda")
+    parser.add_argument("--idle_timeout", type=float, default=0, help="Arresta il server dopo questi secondi senza job (0 = mai)")
+    parser.add_argument("--max_jobs", type=int, default=None, help="Arresta il server dopo questo numero di job")
+    parser.add_argument("--requeue_running", type=lambda x: x.lower() == 'true', default=False,
+                        help="Rimette in coda i job rimasti in running (solo se nessun altro server usa la coda)")
+    args, generator_argv = parser.parse_known_args()
+
+    queue = RenderQueue(args.queue_dir)
+    if args.requeue_running:
+        queue.requeue_running()
+    server = RenderServer(queue, generator_argv, args.poll_interval)
+    server.serve(args.idle_timeout, args.max_jobs)
+    server.generator.kb.done()
+
+
+if __name__ == "__main__":
+    main()
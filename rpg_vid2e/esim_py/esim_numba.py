@@ -0,0 +1,232 @@
+"""Multi-threaded CPU implementation of esim_py's EventSimulator based on numba.
+
+Mirrors the interface of the C++ bindings, but returns events as a dict of separate typed arrays
+(x, y: uint16, t: float64, p: int8) instead of an (N, 4) double matrix:
+
+    from esim_numba import EventSimulator
+
+    esim = EventSimulator(contrast_threshold_pos, contrast_threshold_neg, refractory_period, log_eps, use_log)
+    events = esim.generateFromFolder(path_to_image_folder, path_to_timestamps)
+    x, y, t, p = events['x'], events['y'], events['t'], events['p']
+
+Events are generated in parallel over image rows: a first pass counts the events of every row, a
+second pass writes them directly into preallocated output buffers at the offsets given by the counts.
+Frames are processed in chunks of `chunk_size` images, so memory is bounded by the size of a chunk
+and of the generated events.
+"""
+import os
+
+import cv2
+import numba
+import numpy as np
+
+
+TOLERANCE = 1e-6
+
+
+@numba.njit(cache=True)
+def _simulate_row(y, log_images, times, current_time, last_img, ref_values, last_stamp,
+                  ct_pos, ct_neg, refractory_period, write, offset, xs, ys, ts, ps):
+    """Simulates the pixels of row y over all frames of the chunk. Returns the number of events.
+
+    If write is False, only counts the events and leaves the state untouched.
+    Otherwise writes the events starting at offset and updates the state of the row.
+    """
+    num_frames, _, width = log_images.shape
+    count = 0
+    for x in range(width):
+        it = last_img[y, x]
+        prev_cross = ref_values[y, x]
+        stamp = last_stamp[y, x]
+        t_prev = current_time
+
+        for k in range(num_frames):
+            itdt = log_images[k, y, x]
+            delta_t = times[k] - t_prev
+
+            if abs(it - itdt) > TOLERANCE:
+                pol = np.float32(1.0) if itdt >= it else np.float32(-1.0)
+                C = ct_pos if pol > 0 else ct_neg
+                curr_cross = prev_cross
+
+                while True:
+                    curr_cross = np.float32(curr_cross + pol * C)
+                    if (pol > 0 and curr_cross > it and curr_cross <= itdt) or \
+                            (pol < 0 and curr_cross < it and curr_cross >= itdt):
+                        t = t_prev + (curr_cross - it) * delta_t / (itdt - it)
+                        if stamp == 0 or t - stamp >= refractory_period:
+                            if write:
+                                i = offset + count
+                                xs[i] = x
+                                ys[i] = y
+                                ts[i] = t
+                                ps[i] = 1 if pol > 0 else -1
+                            count += 1
+                            stamp = t
+                        prev_cross = curr_cross
+                    else:
+                        break
+
+            it = itdt
+            t_prev = times[k]
+
+        if write:
+            last_img[y, x] = it
+            ref_values[y, x] = prev_cross
+            last_stamp[y, x] = stamp
+
+    return count
+
+
+@numba.njit(parallel=True, cache=True)
+def _count_events(log_images, times, current_time, last_img, ref_values, last_stamp,
+                  ct_pos, ct_neg, refractory_period):
+    height = log_images.shape[1]
+    counts = np.zeros(height, dtype=np.int64)
+    xs = np.empty(0, dtype=np.uint16)
+    ys = np.empty(0, dtype=np.uint16)
+    ts = np.empty(0, dtype=np.float64)
+    ps = np.empty(0, dtype=np.int8)
+    for y in numba.prange(height):
+        counts[y] = _simulate_row(y, log_images, times, current_time, last_img, ref_values, last_stamp,
+                                  ct_pos, ct_neg, refractory_period, False, 0, xs, ys, ts, ps)
+    return counts
+
+
+@numba.njit(parallel=True, cache=True)
+def _fill_events(log_images, times, current_time, last_img, ref_values, last_stamp,
+                 ct_pos, ct_neg, refractory_period, offsets, xs, ys, ts, ps):
+    height = log_images.shape[1]
+    for y in numba.prange(height):
+        _simulate_row(y, log_images, times, current_time, last_img, ref_values, last_stamp,
+                      ct_pos, ct_neg, refractory_period, True, offsets[y], xs, ys, ts, ps)
+
+
+class EventSimulator:
+    def __init__(self, contrast_threshold_pos, contrast_threshold_neg, refractory_period, log_eps, use_log_img,
+                 chunk_size=32):
+        self.setParameters(contrast_threshold_pos, contrast_threshold_neg, refractory_period, log_eps, use_log_img)
+        self.chunk_size = chunk_size
+        self._reset()
+
+    def setParameters(self, contrast_threshold_pos, contrast_threshold_neg, refractory_period, log_eps, use_log_img):
+        self.contrast_threshold_pos = np.float32(contrast_threshold_pos)
+        self.contrast_threshold_neg = np.float32(contrast_threshold_neg)
+        self.refractory_period = float(refractory_period)
+        self.log_eps = np.float32(log_eps)
+        self.use_log_img = bool(use_log_img)
+
+    def generateFromFolder(self, image_folder, timestamps_file_path):
+        image_files = sorted(os.path.join(image_folder, f) for f in os.listdir(image_folder))
+        timestamps = self._read_timestamps(timestamps_file_path, len(image_files))
+        return self._generate(self._read_images(image_files), timestamps)
+
+    def generateFromStampedImageSequence(self, image_paths, timestamps):
+        if len(image_paths) != len(timestamps):
+            raise ValueError("Number of image paths and number of timestamps should be equal. Got %d and %d"
+                             % (len(image_paths), len(timestamps)))
+        timestamps = np.asarray(timestamps, dtype="float64")
+        if np.any(np.diff(timestamps) < 0):
+            raise ValueError("Timestamps must be sorted in ascending order.")
+        return self._generate(self._read_images(image_paths), timestamps)
+
+    def generateFromVideo(self, video_path, timestamps_file_path):
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            raise IOError("Cannot open the video file " + video_path)
+        num_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        timestamps = self._read_timestamps(timestamps_file_path, num_frames)
+
+        def frames():
+            while True:
+                ret, img = cap.read()
+                if not ret:
+                    break
+                yield self._preprocess(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY))
+            cap.release()
+
+        return self._generate(frames(), timestamps)
+
+    def _reset(self):
+        self.is_initialized = False
+        self.current_time = 0.0
+        self.last_img = None
+        self.ref_values = None
+        self.last_stamp = None
+
+    def _preprocess(self, img):
+        img = img.astype("float32") / np.float32(255)
+        if self.use_log_img:
+            img = np.log(img + self.log_eps)
+        return img
+
+    def _read_images(self, image_paths):
+        for path in image_paths:
+            img = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+            if img is None:
+                raise IOError("unable to open the image " + path)
+            yield self._preprocess(img)
+
+    @staticmethod
+    def _read_timestamps(timestamps_file_path, num_images):
+        if not os.path.isfile(timestamps_file_path):
+            raise IOError("unable to open the file " + timestamps_file_path)
+        timestamps = np.atleast_1d(np.loadtxt(timestamps_file_path, dtype="float64"))
+        if len(timestamps) < num_images:
+            raise ValueError("Found %d timestamps for %d images" % (len(timestamps), num_images))
+        return timestamps[:num_images]
+
+    def _generate(self, images, timestamps):
+        chunks = []
+        chunk = []
+        k = 0
+        for img in images:
+            if not self.is_initialized:
+                self._init(img, timestamps[k])
+            else:
+                chunk.append(img)
+                if len(chunk) == self.chunk_size:
+                    chunks.append(self._process_chunk(chunk, timestamps[k - len(chunk) + 1:k + 1]))
+                    chunk = []
+            k += 1
+        if chunk:
+            chunks.append(self._process_chunk(chunk, timestamps[k - len(chunk):k]))
+
+        # reset state to generate new events
+        self._reset()
+
+        if not chunks:
+            return dict(x=np.empty(0, dtype="uint16"), y=np.empty(0, dtype="uint16"),
+                        t=np.empty(0, dtype="float64"), p=np.empty(0, dtype="int8"))
+        if len(chunks) == 1:
+            return chunks[0]
+        return {key: np.concatenate([c[key] for c in chunks]) for key in "xytp"}
+
+    def _init(self, img, time):
+        self.is_initialized = True
+        self.last_img = img.copy()
+        self.ref_values = img.copy()
+        self.last_stamp = np.zeros(img.shape, dtype="float64")
+        self.current_time = float(time)
+
+    def _process_chunk(self, chunk, times):
+        log_images = np.ascontiguousarray(np.stack(chunk))
+        times = np.ascontiguousarray(times, dtype="float64")
+        args = (log_images, times, self.current_time, self.last_img, self.ref_values, self.last_stamp,
+                self.contrast_threshold_pos, self.contrast_threshold_neg, self.refractory_period)
+
+        counts = _count_events(*args)
+        offsets = np.zeros_like(counts)
+        np.cumsum(counts[:-1], out=offsets[1:])
+        num_events = int(counts.sum())
+
+        xs = np.empty(num_events, dtype="uint16")
+        ys = np.empty(num_events, dtype="uint16")
+        ts = np.empty(num_events, dtype="float64")
+        ps = np.empty(num_events, dtype="int8")
+        _fill_events(*args, offsets, xs, ys, ts, ps)
+        self.current_time = float(times[-1])
+
+        # events are written row by row, sort them by time
+        order = np.argsort(ts, kind="stable")
+        return dict(x=xs[order], y=ys[order], t=ts[order], p=ps[order])
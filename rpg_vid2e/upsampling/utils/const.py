@@ -2,6 +2,9 @@ mean = [0.429, 0.431, 0.397]
 std = [1, 1, 1]
 fps_filename = 'fps.txt'
 imgs_dirname = 'imgs'
+# sequence stores written by kubric.sequence_store (one .npy file per layer)
+store_filename = 'store.json'
+store_rgb_layers = ('rgb', 'rgba')
 # TODO(magehrig): Use https://github.com/ahupp/python-magic instead.
 video_formats = {'.webm', '.mp4', '.m4p', '.m4v', '.avi', '.avchd', '.ogg', '.mov', '.ogv', '.vob', '.f4v', '.mkv', '.svi', '.m2v', '.mpg', '.mp2', '.mpeg', '.mpe', '.mpv', '.amv', '.wmv', '.flv', '.mts', '.m2ts', '.ts', '.qt', '.3gp', '.3g2', '.f4p', '.f4a', '.f4b'}
 img_formats = {'.png', '.jpg', '.jpeg', '.bmp', '.pbm', '.pgm', '.ppm', '.pnm', '.webp', '.tiff', '.tif'}
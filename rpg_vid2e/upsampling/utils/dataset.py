@@ -1,13 +1,13 @@
+import json
 import os
 from pathlib import Path
 from typing import Union
 
-from fractions import Fraction
 from PIL import Image
-import skvideo.io
 import numpy as np
 
-from .const import mean, std, img_formats
+from .const import mean, std, img_formats, store_filename, store_rgb_layers
+from .video_reader import VideoReader
 
 
 class Sequence:
@@ -72,42 +72,62 @@ class ImageSequence(Sequence):
         return os.path.join(self.imgs_dirpath, file_names)
 
 
+def load_store_rgb(store_dirpath: str):
+    """RGB frames (N, H, W, 3) of a kubric sequence store (memory-mapped) and its fps."""
+    with open(os.path.join(store_dirpath, store_filename), 'r') as f:
+        info = json.load(f)
+    for layer in store_rgb_layers:
+        if layer in info['layers']:
+            frames = np.load(os.path.join(store_dirpath, layer + '.npy'), mmap_mode='r')
+            return frames[..., :3], info['fps']
+    raise ValueError('No rgb layer in store {}'.format(store_dirpath))
+
+
+class StoreSequence(Sequence):
+    def __init__(self, store_dirpath: str, fps: float=None):
+        super().__init__()
+        self.frames, store_fps = load_store_rgb(store_dirpath)
+        self.fps = fps if fps is not None else store_fps
+        assert self.fps is not None and self.fps > 0, 'No fps for store {}'.format(store_dirpath)
+        assert len(self.frames) > 1
+
+        h_orig, w_orig = self.frames.shape[1:3]
+        h, w = h_orig//32*32, w_orig//32*32
+        top, left = (h_orig - h)//2, (w_orig - w)//2
+        self.crop = (slice(top, top + h), slice(left, left + w))
+
+    def _load(self, idx):
+        img = self.frames[idx][self.crop]
+        if img.dtype == np.uint8:
+            return img.astype("float32") / 255
+        if img.dtype == np.uint16:
+            return img.astype("float32") / 65535
+        return np.asarray(img, dtype="float32")
+
+    def __next__(self):
+        img1 = self._load(0)
+        for idx in range(0, len(self.frames) - 1):
+            img0, img1 = img1, self._load(idx + 1)
+            yield [img0, img1], [idx/self.fps, (idx + 1)/self.fps]
+
+    def __len__(self):
+        return len(self.frames) - 1
+
+
 class VideoSequence(Sequence):
-    def __init__(self, video_filepath: str, fps: float=None):
+    def __init__(self, video_filepath: str, fps: float=None, prefetch: int=8):
         super().__init__()
-        metadata = skvideo.io.ffprobe(os.path.abspath(video_filepath))
-        self.fps = fps
-        if self.fps is None:
-            self.fps = float(Fraction(metadata['video']['@avg_frame_rate']))
-            assert self.fps > 0, 'Could not retrieve fps from video metadata. fps: {}'.format(self.fps)
+        self.reader = VideoReader(video_filepath, fps=fps, crop_multiple=32, prefetch=prefetch)
+        self.fps = self.reader.fps
+        if fps is None:
             print('Using video metadata: Got fps of {} frames/sec'.format(self.fps))
 
         # Length is number of frames - 1 (because we return pairs).
-        self.len = int(metadata['video']['@nb_frames']) - 1
-        self.videogen = skvideo.io.vreader(os.path.abspath(video_filepath))
-        self.last_frame = None
+        self.len = len(self.reader) - 1
 
     def __next__(self):
-        for idx, frame in enumerate(self.videogen):
-            h_orig, w_orig, _ = frame.shape
-            w, h = w_orig//32*32, h_orig//32*32
-
-            left = (w_orig - w)//2
-            upper = (h_orig - h)//2
-            right = left + w
-            lower = upper + h
-            frame = frame[upper:lower, left:right].astype("float32") / 255
-            assert frame.shape[:2] == (h, w)
-
-            if self.last_frame is None:
-                self.last_frame = frame
-                continue
-
-            last_frame_copy = self.last_frame.copy()
-            self.last_frame = frame
-            imgs = [last_frame_copy, frame]
-            times_sec = [(idx - 1)/self.fps, idx/self.fps]
-            yield imgs, times_sec
+        # Pairs are views into the reader's double buffer, valid until the next pair is requested.
+        yield from self.reader.pairs()
 
     def __len__(self):
         return self.len
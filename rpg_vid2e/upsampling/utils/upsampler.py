@@ -14,11 +14,13 @@ from .utils import get_sequence_or_none
 class Upsampler:
     _timestamps_filename = 'timestamps.txt'
 
-    def __init__(self, input_dir: str, output_dir: str):
-        assert os.path.isdir(input_dir), 'The input directory must exist'
-        assert not os.path.exists(output_dir), 'The output directory must not exist'
+    def __init__(self, input_dir: str = None, output_dir: str = None):
+        # without input_dir/output_dir only the model is loaded (see upsample_directory)
+        if input_dir is not None:
+            assert os.path.isdir(input_dir), 'The input directory must exist'
+            assert not os.path.exists(output_dir), 'The output directory must not exist'
 
-        self._prepare_output_dir(input_dir, output_dir)
+            self._prepare_output_dir(input_dir, output_dir)
         self.src_dir = input_dir
         self.dest_dir = output_dir
 
@@ -38,6 +40,16 @@ class Upsampler:
             dest_timestamps_filepath = os.path.join(self.dest_dir, reldirpath, self._timestamps_filename)
             self.upsample_sequence(sequence, dest_imgs_dir, dest_timestamps_filepath)
 
+    def upsample_directory(self, src_dir: str, dest_dir: str):
+        """Upsamples the single sequence in src_dir, replacing the output in dest_dir."""
+        sequence = get_sequence_or_none(src_dir)
+        if sequence is None:
+            raise FileNotFoundError('No sequence found in {}'.format(src_dir))
+        if os.path.exists(dest_dir):
+            shutil.rmtree(dest_dir)
+        self.upsample_sequence(sequence, os.path.join(dest_dir, imgs_dirname),
+                               os.path.join(dest_dir, self._timestamps_filename))
+
     def upsample_sequence(self, sequence: Sequence, dest_imgs_dir: str, dest_timestamps_filepath: str):
         os.makedirs(dest_imgs_dir, exist_ok=True)
         timestamps_list = list()
@@ -2,8 +2,8 @@ import os
 from pathlib import Path
 from typing import Union
 
-from .const import fps_filename, imgs_dirname, video_formats
-from .dataset import Sequence, ImageSequence, VideoSequence
+from .const import fps_filename, imgs_dirname, store_filename, video_formats
+from .dataset import Sequence, ImageSequence, StoreSequence, VideoSequence
 
 def is_video_file(filepath: str) -> bool:
     return Path(filepath).suffix.lower() in video_formats
@@ -37,6 +37,9 @@ def fps_from_file(fps_file) -> float:
 
 def get_sequence_or_none(dirpath: str) -> Union[None, Sequence]:
     fps_file = get_fps_file(dirpath)
+    if os.path.isfile(os.path.join(dirpath, store_filename)):
+        # kubric sequence store: fps from fps.txt if present, otherwise from the store
+        return StoreSequence(dirpath, fps_from_file(fps_file) if fps_file else None)
     if fps_file:
         # Must be a sequence (either ImageSequence or VideoSequence)
         fps = fps_from_file(fps_file)
@@ -0,0 +1,96 @@
+import os
+import queue
+import threading
+from fractions import Fraction
+
+import numpy as np
+import skvideo.io
+
+# This module is also imported by the web app (via sys.path), so it must not use relative imports.
+
+
+class VideoReader:
+    """Decodes a video into a preallocated double buffer of float32 frames.
+
+    Frames are cropped to a multiple of crop_multiple and converted to [0, 1] in place, so decoding a
+    frame does not allocate. Frames and pairs are returned as views into the buffer: they are only valid
+    until the reader advances by two frames (pairs: until the next pair is requested).
+    If prefetch > 0, raw frames are decoded on a background thread, up to prefetch frames ahead.
+    """
+    def __init__(self, video_filepath: str, fps: float=None, crop_multiple: int=32, prefetch: int=0):
+        self.video_filepath = os.path.abspath(video_filepath)
+        self.metadata = skvideo.io.ffprobe(self.video_filepath)
+        self.fps = fps
+        if self.fps is None:
+            self.fps = float(Fraction(self.metadata['video']['@avg_frame_rate']))
+            assert self.fps > 0, 'Could not retrieve fps from video metadata. fps: {}'.format(self.fps)
+        self.num_frames = int(self.metadata['video']['@nb_frames'])
+        self.crop_multiple = crop_multiple
+        self.prefetch = prefetch
+        self._buffer = None
+
+    def __len__(self):
+        return self.num_frames
+
+    def _crop(self, frame):
+        h_orig, w_orig = frame.shape[:2]
+        w, h = w_orig//self.crop_multiple*self.crop_multiple, h_orig//self.crop_multiple*self.crop_multiple
+        left = (w_orig - w)//2
+        upper = (h_orig - h)//2
+        return frame[upper:upper + h, left:left + w]
+
+    def _raw_frames(self):
+        videogen = skvideo.io.vreader(self.video_filepath)
+        if self.prefetch <= 0:
+            yield from videogen
+            return
+
+        frames = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+        end = object()
+
+        def decode():
+            try:
+                for frame in videogen:
+                    while not stop.is_set():
+                        try:
+                            frames.put(frame, timeout=0.1)
+                            break
+                        except queue.Full:
+                            continue
+                    if stop.is_set():
+                        return
+                frames.put(end)
+            except Exception as e:
+                frames.put(e)
+
+        thread = threading.Thread(target=decode, daemon=True)
+        thread.start()
+        try:
+            while True:
+                frame = frames.get()
+                if frame is end:
+                    return
+                if isinstance(frame, Exception):
+                    raise frame
+                yield frame
+        finally:
+            stop.set()
+
+    def frames(self):
+        """Yields (frame, time_sec), where frame is a float32 view into the double buffer."""
+        for idx, raw in enumerate(self._raw_frames()):
+            raw = self._crop(raw)
+            if self._buffer is None or self._buffer.shape[1:] != raw.shape:
+                self._buffer = np.empty((2,) + raw.shape, dtype="float32")
+            slot = self._buffer[idx % 2]
+            np.divide(raw, np.float32(255), out=slot)
+            yield slot, idx/self.fps
+
+    def pairs(self):
+        """Yields ([frame_0, frame_1], [t_0, t_1]) for consecutive frames without copying."""
+        last_frame, last_time = None, None
+        for frame, time_sec in self.frames():
+            if last_frame is not None:
+                yield [last_frame, frame], [last_time, time_sec]
+            last_frame, last_time = frame, time_sec
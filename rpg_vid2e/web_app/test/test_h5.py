@@ -0,0 +1,28 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from utils.h5 import read_events_h5, write_events_h5
+
+
+def test_write_read_events(tmp_path):
+    t = np.array([1000, 1500, 2500, 7000], dtype="int64")
+    x, y, p = np.array([1, 2, 3, 4]), np.array([5, 6, 7, 8]), np.array([1, -1, 1, 1])
+    path = write_events_h5(tmp_path / "events.h5", x, y, t, p)
+
+    events = read_events_h5(path)
+    np.testing.assert_array_equal(events["t"], t)
+    np.testing.assert_array_equal(events["x"], x)
+    window = read_events_h5(path, t0=1500, t1=7000)
+    np.testing.assert_array_equal(window["t"], [1500, 2500])
+
+
+def test_write_read_empty_events(tmp_path):
+    empty = np.zeros(0, dtype="int64")
+    path = write_events_h5(tmp_path / "events.h5", empty, empty, empty, empty)
+
+    events = read_events_h5(path)
+    assert all(len(events[k]) == 0 for k in "xytp")
+    assert len(read_events_h5(path, t0=0, t1=1000)["t"]) == 0
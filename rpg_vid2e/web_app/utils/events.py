@@ -7,19 +7,29 @@ import h5py
 import matplotlib.pyplot as plt
 from utils.viz import Visualizer
 from utils.utils import EventRenderingType
+from utils.h5 import read_events_h5
 
 
-def load_events(f):
+def load_events(f, t0=None, t1=None):
+    """Loads events as an (N, 4) array of x, y, t, p. t0, t1 restrict the result to t0 <= t < t1."""
+    if f.endswith(".h5"):
+        # only the requested time window is read from disk
+        fh = read_events_h5(f, t0, t1)
+        return np.stack([fh['x'].astype("int64"), fh['y'].astype("int64"), fh['t'], fh['p'].astype("int64")], -1)
+
     if f.endswith(".npy"):
-        return np.load(f).astype("int64")
+        events = np.load(f).astype("int64")
     elif f.endswith(".npz"):
         fh = np.load(f)
-        return np.stack([fh['x'], fh['y'], fh['t'], fh['p']], -1)
-    elif f.endswith(".h5"):
-        fh = h5py.File(f, "r")
-        return np.stack([np.array(fh['x']), np.array(fh['y']), np.array(fh['t']), np.array(fh['p'])], -1)
+        events = np.stack([fh['x'], fh['y'], fh['t'], fh['p']], -1)
     else:
-        raise NotImplementedErrort(f"Could not read {f}")
+        raise NotImplementedError(f"Could not read {f}")
+
+    if t0 is not None or t1 is not None:
+        i0 = 0 if t0 is None else np.searchsorted(events[:, 2], t0, side="left")
+        i1 = len(events) if t1 is None else np.searchsorted(events[:, 2], t1, side="left")
+        events = events[i0:i1]
+    return events
 
 class Events:
     def __init__(self, shape=None, events=None):
@@ -36,8 +46,8 @@ class Events:
         return cls(shape=shape, events=events)
 
     @classmethod
-    def from_file(cls, file, shape):
-        events = load_events(file)
+    def from_file(cls, file, shape, t0=None, t1=None):
+        events = load_events(file, t0, t1)
         print(f"Loaded events from {file}, found {len(events)} events with shape {events.shape}")
         return cls(shape=shape, events=events)
 
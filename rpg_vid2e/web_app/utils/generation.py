@@ -0,0 +1,137 @@
+import glob
+import os
+import sys
+
+import cv2
+import numba
+import numpy as np
+import skvideo.io
+import tqdm
+
+from utils.h5 import write_events_h5
+
+
+def load_esim():
+    # same lookup as web_app.py, relative to the web_app directory
+    esim_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "../esim_torch")
+    if esim_dir not in sys.path:
+        sys.path.append(esim_dir)
+    from esim_torch import EventSimulator_torch
+    return EventSimulator_torch
+
+
+def save_to_npz(target_path, data: dict):
+    assert os.path.exists(target_path)
+    path = os.path.join(target_path, "events.npz")
+    np.savez(path, **data)
+    return path
+
+
+def save_to_video(target_path, shape, data: dict):
+    # just convert to 30 fps, non-overlapping windows
+    fps = 30
+    tmin, tmax = data['t'][[0, -1]]
+    t0 = np.arange(tmin, tmax, 1e6/fps)
+    t1, t0 = t0[1:], t0[:-1]
+    idx0 = np.searchsorted(data['t'], t0)
+    idx1 = np.searchsorted(data['t'], t1)
+
+    path = os.path.join(target_path, "outputvideo.mp4")
+    writer = skvideo.io.FFmpegWriter(path)
+
+    red = np.array([255, 0, 0], dtype="uint8")
+    blue = np.array([0, 0, 255], dtype="uint8")
+
+    pbar = tqdm.tqdm(total=len(idx0))
+    for i0, i1 in zip(idx0, idx1):
+        sub_data = {k: v[i0:i1].cpu().numpy().astype("int32") for k, v in data.items()}
+        frame = np.full(shape=shape + (3,), fill_value=255, dtype="uint8")
+        event_processor(sub_data['x'], sub_data['y'], sub_data['p'], red, blue, frame)
+        writer.writeFrame(frame)
+        pbar.update(1)
+    writer.close()
+
+    return path
+
+
+def save_to_h5(target_path, data: dict):
+    assert os.path.exists(target_path)
+    path = os.path.join(target_path, "events.h5")
+    data = {k: v.numpy() if hasattr(v, "numpy") else v for k, v in data.items()}
+    return write_events_h5(path, data['x'], data['y'], data['t'], data['p'])
+
+
+@numba.jit(nopython=True)
+def event_processor(x, y, p, red, blue, output_frame):
+    for x_, y_, p_ in zip(x, y, p):
+        if p_ == 1:
+            output_frame[y_, x_] = blue
+        else:
+            output_frame[y_, x_] = red
+
+    return output_frame
+
+
+def extract_frames(video_path, dest_dir):
+    """Writes the frames of a video as imgs/*.png plus timestamps.txt (used when upsampling is off)."""
+    imgs_dir = os.path.join(dest_dir, "imgs")
+    os.makedirs(imgs_dir, exist_ok=True)
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    assert fps > 0, 'Could not retrieve fps from video metadata. fps: {}'.format(fps)
+
+    timestamps = []
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        cv2.imwrite(os.path.join(imgs_dir, "%08d.png" % len(timestamps)), frame)
+        timestamps.append(len(timestamps) / fps)
+    cap.release()
+
+    with open(os.path.join(dest_dir, "timestamps.txt"), "w") as f:
+        f.writelines([str(t) + '\n' for t in timestamps])
+
+
+def process_dir(outdir, indir, args, sequence_name="video_upload"):
+    print(f"Processing folder {indir}... Generating events in {outdir}")
+    os.makedirs(outdir, exist_ok=True)
+
+    # constructor
+    EventSimulator_torch = load_esim()
+    esim = EventSimulator_torch(args["contrast_threshold_negative"],
+                                args["contrast_threshold_positive"],
+                                args["refractory_period_ns"])
+
+    timestamps = np.genfromtxt(os.path.join(indir, sequence_name, "timestamps.txt"), dtype="float64")
+    timestamps_ns = (timestamps * 1e9).astype("int64")
+    timestamps_ns = torch_from_numpy(timestamps_ns).cuda()
+
+    image_files = sorted(glob.glob(os.path.join(indir, sequence_name, "imgs", "*.png")))
+    images = np.stack([cv2.imread(f, cv2.IMREAD_GRAYSCALE) for f in image_files])
+
+    shape = images.shape[1:]
+
+    log_images = np.log(images.astype("float32") / 255 + 1e-4)
+    log_images = torch_from_numpy(log_images).cuda()
+
+    # generate events with GPU support
+    print("Generating events")
+    generated_events = esim.forward(log_images, timestamps_ns)
+    generated_events = {k: v.cpu() for k, v in generated_events.items()}
+    generated_events['t'] = (generated_events['t'] / 1e3).long()
+
+    if args['format'] == "HDF5":
+        return save_to_h5(outdir, generated_events)
+    elif args['format'] == "NPZ":
+        return save_to_npz(outdir, generated_events)
+    elif args['format'] == "Rendered Video":
+        return save_to_video(outdir, shape, generated_events)
+    else:
+        raise ValueError(f"Unknown output format {args['format']}")
+
+
+def torch_from_numpy(array):
+    # torch is imported lazily so that worker processes only initialize CUDA when they need it
+    import torch
+    return torch.from_numpy(array)
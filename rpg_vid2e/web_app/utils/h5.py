@@ -0,0 +1,98 @@
+import h5py
+import numpy as np
+
+
+# Layout:
+#   events/x, events/y   uint16
+#   events/t             uint32 (or int64 if the sequence is too long), microseconds relative to t_offset
+#   events/p             int8
+#   ms_to_idx            uint64, ms_to_idx[m] is the index of the first event with t - t_offset >= m milliseconds
+#   t_offset             int64, microseconds
+CHUNK_SIZE = 1 << 16
+
+
+def _compact_dtype(values, candidates):
+    for dtype in candidates:
+        info = np.iinfo(dtype)
+        if len(values) == 0 or (values.min() >= info.min and values.max() <= info.max):
+            return dtype
+    return values.dtype
+
+
+def compute_ms_to_idx(t_rel):
+    num_ms = int(t_rel[-1] // 1000) + 2 if len(t_rel) > 0 else 1
+    return np.searchsorted(t_rel, np.arange(num_ms, dtype="int64") * 1000, side="left").astype("uint64")
+
+
+def write_events_h5(path, x, y, t, p, compression="gzip", compression_opts=4, chunk_size=CHUNK_SIZE):
+    """Writes events sorted by t (microseconds) as chunked, compressed datasets with a millisecond index."""
+    x, y, t, p = (np.asarray(a) for a in (x, y, t, p))
+    t = t.astype("int64")
+    assert len(t) == 0 or np.all(t[1:] >= t[:-1]), "Events must be sorted by time"
+
+    t_offset = int(t[0]) if len(t) > 0 else 0
+    t_rel = t - t_offset
+
+    data = {
+        "x": x.astype(_compact_dtype(x, ["uint16", "int32"])),
+        "y": y.astype(_compact_dtype(y, ["uint16", "int32"])),
+        "t": t_rel.astype(_compact_dtype(t_rel, ["uint32", "int64"])),
+        "p": p.astype(_compact_dtype(p, ["int8", "int16"])),
+    }
+
+    # h5py cannot chunk an empty dataset (static or dark sequences have no events)
+    if len(t) > 0:
+        storage = dict(chunks=(min(chunk_size, len(t)),), compression=compression,
+                       compression_opts=compression_opts, shuffle=True)
+    else:
+        storage = {}
+    with h5py.File(path, "w") as h5f:
+        group = h5f.create_group("events")
+        for k, v in data.items():
+            group.create_dataset(k, data=v, **storage)
+        h5f.create_dataset("ms_to_idx", data=compute_ms_to_idx(t_rel), compression=compression,
+                           compression_opts=compression_opts)
+        h5f.create_dataset("t_offset", data=t_offset, dtype="int64")
+    return path
+
+
+def _time_window_to_idx(h5f, t_rel, t0, t1):
+    """Index range [i0, i1) of events with t0 <= t < t1 (relative microseconds), read through ms_to_idx."""
+    ms_to_idx = h5f["ms_to_idx"]
+    num_events = len(t_rel)
+
+    def lookup(t_us, bound):
+        if t_us is None:
+            return bound
+        ms = int(np.clip(t_us // 1000, 0, len(ms_to_idx) - 1))
+        lo = int(ms_to_idx[ms])
+        hi = int(ms_to_idx[ms + 1]) if ms + 1 < len(ms_to_idx) else num_events
+        # refine inside the millisecond bin
+        return lo + int(np.searchsorted(t_rel[lo:hi], t_us, side="left"))
+
+    return lookup(t0, 0), lookup(t1, num_events)
+
+
+def read_events_h5(path, t0=None, t1=None):
+    """Reads events with t0 <= t < t1 (absolute microseconds, None for open bounds) into a dict of arrays."""
+    with h5py.File(path, "r") as h5f:
+        if "events" not in h5f:
+            # flat layout of older exports: x, y, t, p at the root without index
+            events = {k: np.array(h5f[k]) for k in "xytp"}
+            mask = np.ones(len(events["t"]), dtype=bool)
+            if t0 is not None:
+                mask &= events["t"] >= t0
+            if t1 is not None:
+                mask &= events["t"] < t1
+            return {k: v[mask] for k, v in events.items()}
+
+        group = h5f["events"]
+        t_offset = int(h5f["t_offset"][()])
+        t_rel = group["t"]
+        i0, i1 = _time_window_to_idx(h5f,
+                                     t_rel,
+                                     None if t0 is None else t0 - t_offset,
+                                     None if t1 is None else t1 - t_offset)
+        events = {k: group[k][i0:i1] for k in "xytp"}
+        events["t"] = events["t"].astype("int64") + t_offset
+        return events
@@ -0,0 +1,138 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from utils.generation import extract_frames, process_dir
+
+UPSAMPLE_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "../upsampling/upsample.py")
+SEQUENCE_NAME = "video_upload"
+
+
+def job_key(video_bytes: bytes, settings: dict) -> str:
+    """Cache key of a job: hash of the uploaded video and of the settings that change the output."""
+    h = hashlib.sha256()
+    h.update(video_bytes)
+    h.update(json.dumps(settings, sort_keys=True).encode("utf-8"))
+    return h.hexdigest()[:32]
+
+
+def _write_json(path, data):
+    # write then rename, so that readers never see a partial file
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def _report(job_dir, stage, progress, **kwargs):
+    _write_json(os.path.join(job_dir, "progress.json"),
+                dict(stage=stage, progress=progress, time=time.time(), **kwargs))
+
+
+def run_job(job_dir, video_name, settings):
+    """Runs in a worker process: upsampling (optional), event generation, saving."""
+    try:
+        original_dir = os.path.join(job_dir, "original")
+        frames_dir = os.path.join(job_dir, "frames")
+        events_dir = os.path.join(job_dir, "events")
+        video_path = os.path.join(original_dir, SEQUENCE_NAME, video_name)
+
+        # leftovers of an interrupted run
+        shutil.rmtree(frames_dir, ignore_errors=True)
+
+        if settings["upsampling"]:
+            _report(job_dir, "upsampling", 0.1)
+            subprocess.run([sys.executable, UPSAMPLE_SCRIPT,
+                            "--input_dir=" + original_dir,
+                            "--output_dir=" + frames_dir],
+                           cwd=os.path.dirname(UPSAMPLE_SCRIPT), check=True)
+        else:
+            _report(job_dir, "extracting frames", 0.1)
+            extract_frames(video_path, os.path.join(frames_dir, SEQUENCE_NAME))
+
+        _report(job_dir, "generating events", 0.6)
+        args = {
+            "contrast_threshold_negative": settings["contrast_threshold_negative"],
+            "contrast_threshold_positive": settings["contrast_threshold_positive"],
+            "refractory_period_ns": settings["refractory_period_ns"],
+            "format": settings["format"],
+        }
+        file_path = process_dir(events_dir, frames_dir, args, sequence_name=SEQUENCE_NAME)
+
+        _write_json(os.path.join(job_dir, "result.json"), {"file_path": os.path.abspath(file_path)})
+        _report(job_dir, "done", 1.0)
+    except Exception as e:
+        _report(job_dir, "failed", 1.0, error=repr(e))
+        raise
+
+
+class JobQueue:
+    """Local job queue running event generation in a pool of worker processes.
+
+    Every job lives in <root>/<key>/, where key is the hash of the video and of the settings.
+    A job directory containing result.json is a cached result and is returned without recomputing.
+    """
+    def __init__(self, root="data/jobs", max_workers=1):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+        # spawn: CUDA cannot be re-initialized in a forked process
+        self.executor = ProcessPoolExecutor(max_workers=max_workers,
+                                            mp_context=multiprocessing.get_context("spawn"))
+        self.futures = {}
+        self.lock = threading.Lock()
+
+    def job_dir(self, key):
+        return os.path.join(self.root, key)
+
+    def submit(self, video_name, video_bytes, settings) -> str:
+        key = job_key(video_bytes, settings)
+        job_dir = self.job_dir(key)
+
+        with self.lock:
+            if self.result(key) is not None:
+                return key
+            future = self.futures.get(key)
+            if future is not None and not future.done():
+                return key
+
+            video_dir = os.path.join(job_dir, "original", SEQUENCE_NAME)
+            os.makedirs(video_dir, exist_ok=True)
+            with open(os.path.join(video_dir, video_name), "wb") as f:
+                f.write(video_bytes)
+            _report(job_dir, "queued", 0.0)
+
+            self.futures[key] = self.executor.submit(run_job, job_dir, video_name, settings)
+        return key
+
+    def result(self, key):
+        """Path of the generated file, or None if the job has not finished."""
+        result = _read_json(os.path.join(self.job_dir(key), "result.json"))
+        if result is None or not os.path.exists(result["file_path"]):
+            return None
+        return result["file_path"]
+
+    def status(self, key):
+        status = _read_json(os.path.join(self.job_dir(key), "progress.json")) or dict(stage="queued", progress=0.0)
+        future = self.futures.get(key)
+        if future is not None and future.done() and future.exception() is not None and status["stage"] != "failed":
+            # the worker died before it could report the failure
+            status = dict(stage="failed", progress=1.0, error=repr(future.exception()))
+        return status
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -7,10 +7,7 @@ import skvideo.io
 #import esim_torch
 #from esim-cuda
 import os
-import numba
 import cv2
-import tqdm
-from fractions import Fraction
 from typing import Union
 from pathlib import Path
 from io import StringIO
@@ -18,13 +15,15 @@ from io import StringIO
 #from esim_torch import esim_torch
 # from esim_torch.esim_torch import EventSimulator_torch
 #import esim_torch
-import glob
-import h5py
+import time
 from utils.events import Events
+from utils.jobs import JobQueue
 
 import sys
 sys.path.append(os.path.join(os.path.abspath(os.getcwd()), "../esim_torch"))
 from esim_torch import EventSimulator_torch
+sys.path.append(os.path.join(os.path.abspath(os.getcwd()), "../upsampling/utils"))
+from video_reader import VideoReader
 
 st.sidebar.title("Menu")
 add_selectbox = st.sidebar.selectbox(
@@ -74,44 +73,20 @@ if add_selectbox == "Offline Video Generator":
   class VideoSequence(Sequence):
     def __init__(self, video_filepath: str, fps: float=None):
       #super().__init__()
-      self.metadata = skvideo.io.ffprobe(os.path.abspath(video_filepath))
       st.write(video_filepath)
-      #st.write(type(metadata))
-      #st.write(metadata.keys)
-      self.fps = fps
-      if self.fps is None:
-        self.fps = float(Fraction(self.metadata['video']['@avg_frame_rate']))
-        assert self.fps > 0, 'Could not retrieve fps from video metadata. fps: {}'.format(self.fps)
-        #print('Using video metadata: Got fps of {} frames/sec'.format(self.fps))
+      # decodes into a preallocated double buffer on a background thread, frames are views into it
+      self.reader = VideoReader(video_filepath, fps=fps, crop_multiple=1, prefetch=8)
+      self.metadata = self.reader.metadata
+      self.fps = self.reader.fps
 
       # Length is number of frames - 1 (because we return pairs).
-      self.len = int(self.metadata['video']['@nb_frames']) - 1
-      self.videogen = skvideo.io.vreader(os.path.abspath(video_filepath))
-      self.last_frame = None
+      self.len = len(self.reader) - 1
 
     def __next__(self):
-      for idx, frame in enumerate(self.videogen):
-        #h_orig, w_orig, _ = frame.shape
-        #w, h = w_orig//32*32, h_orig//32*32
-
-        #left = (w_orig - w)//2
-        #upper = (h_orig - h)//2
-        #right = left + w
-        #lower = upper + h
-        #frame = frame[upper:lower, left:right]
-        #assert frame.shape[:2] == (h, w)
-        #frame = self.transform(frame)
-
-        if self.last_frame is None:
-          self.last_frame = frame
-          continue
-        #last_frame_copy = self.last_frame.detach().clone()
-        self.last_frame = frame
-        #imgs = [last_frame_copy, frame]
-        #times_sec = [(idx - 1)/self.fps, idx/self.fps]
-        img = frame
-        time_sec = idx/self.fps
-        #yield imgs, times_sec
+      frames = self.reader.frames()
+      # the first frame only starts the first pair
+      next(frames, None)
+      for img, time_sec in frames:
         yield img, time_sec
 
     def __len__(self):
@@ -130,164 +105,59 @@ if add_selectbox == "Offline Video Generator":
       filepath = os.path.join(dirpath, filenames[0])
       return filepath
 
-  def save_to_npz(target_path,  data: dict):
-    assert os.path.exists(target_path)
-    path = os.path.join(target_path, "events.npz")
-    np.savez(path, **data)
-    return path
-
-  def save_to_video(target_path, shape, data: dict):
-      # just convert to 30 fps, non-overlapping windows
-      fps = 30
-      tmin, tmax = data['t'][[0,-1]]
-      t0 = np.arange(tmin, tmax, 1e6/fps)
-      t1, t0 = t0[1:], t0[:-1]
-      idx0 = np.searchsorted(data['t'], t0)
-      idx1 = np.searchsorted(data['t'], t1)
-
-      path = os.path.join(target_path, "outputvideo.mp4")
-      writer = skvideo.io.FFmpegWriter(path)
-
-      red = np.array([255, 0, 0], dtype="uint8")
-      blue = np.array([0,0,255], dtype="uint8")
-
-      pbar = tqdm.tqdm(total=len(idx0))
-      for i0, i1 in zip(idx0, idx1):
-        sub_data = {k: v[i0:i1].cpu().numpy().astype("int32") for k, v in data.items()}
-        frame = np.full(shape=shape + (3,), fill_value=255, dtype="uint8")
-        event_processor(sub_data['x'], sub_data['y'], sub_data['p'], red, blue, frame)  
-        writer.writeFrame(frame)
-        pbar.update(1)
-      writer.close()
-
-      return path
-
-  def save_to_h5(target_path, data: dict):
-      assert os.path.exists(target_path)
-      path = str(target_path+"events.h5")
-      with h5py.File(path, 'w') as h5f:
-          for k, v in data.items():
-            h5f.create_dataset(k, data=v)
-      return path
-
-  @numba.jit(nopython=True)
-  def event_processor(x, y, p, red, blue, output_frame):
-    for x_,y_,p_ in zip(x, y, p):
-        if p_ == 1:
-          output_frame[y_,x_] = blue
-        else:
-          output_frame[y_,x_] = red
-          
-    return output_frame
-
   def print_inventory(dct):
       print("Items held:")
       for item, amount in dct.items():  # dct.iteritems() in Python 2
           print("{} ({})".format(item, amount))
 
-  def process_dir(outdir, indir, args):
-      print(f"Processing folder {indir}... Generating events in {outdir}")
-      os.makedirs(outdir, exist_ok=True)
-
-      # constructor
-      esim = EventSimulator_torch(args["contrast_threshold_negative"],
-                                            args["contrast_threshold_positive"],
-                                            args["refractory_period_ns"])
-
-      timestamps = np.genfromtxt(os.path.join(indir, "video_upload/timestamps.txt"), dtype="float64")
-      timestamps_ns = (timestamps * 1e9).astype("int64")
-      timestamps_ns = torch.from_numpy(timestamps_ns).cuda()
-
-      image_files = sorted(glob.glob(os.path.join(indir, "video_upload/imgs", "*.png")))
-      
-      # pbar = tqdm.tqdm(total=len(image_files)-1)
-      # num_events = 0
-
-      # counter = 0
-      # for image_file, timestamp_ns in zip(image_files, timestamps_ns):
-      #     image = cv2.imread(image_file, cv2.IMREAD_GRAYSCALE)
-      #     log_image = np.log(image.astype("float32") / 255 + 1e-5)
-      #     log_image = torch.from_numpy(log_image).cuda()
-
-      #     sub_events = esim.forward(log_image, timestamp_ns)
-
-      #     # for the first image, no events are generated, so this needs to be skipped
-      #     if sub_events is None:
-      #         continue
-
-      #     sub_events = {k: v.cpu() for k, v in sub_events.items()}    
-      #     num_events += len(sub_events['t'])
-  
-      #     # do something with the events
-      #     np.savez(os.path.join(outdir, "%010d.npz" % counter), **sub_events)
-      #     pbar.set_description(f"Num events generated: {num_events}")
-      #     pbar.update(1)
-      #     counter += 1
-
-      images = np.stack([cv2.imread(f, cv2.IMREAD_GRAYSCALE) for f in image_files])
-
-      shape = images.shape[1:]
-
-      log_images = np.log(images.astype("float32") / 255 + 1e-4)
-      log_images = torch.from_numpy(log_images).cuda()
-      
-      # generate events with GPU support
-      print("Generating events")
-      generated_events = esim.forward(log_images, timestamps_ns)
-      #events = esim.forward(log_image, timestamp_ns)
-      #print_inventory(generated_events)
-      generated_events = {k: v.cpu() for k, v in generated_events.items()}
-      generated_events['t'] = (generated_events['t'] / 1e3).long()
-      print_inventory(generated_events)
-
-      if args['format'] == "HDF5":
-          return save_to_h5(args["output_dir"], generated_events)
-      elif args['format'] == "NPZ":
-          return save_to_npz(args["output_dir"], generated_events)
-      elif args['format'] == "Rendered Video":
-          return save_to_video(args["output_dir"], shape, generated_events)
-      else:
-          raise ValueError
-
-      
-
-  args = {
+  settings = {
       "contrast_threshold_negative": float(ct_n),
       "contrast_threshold_positive": float(ct_p),
       "refractory_period_ns": 0,
-      "input_dir": "data/upsampled/",
-      "output_dir": "data/events/",
+      "upsampling": upsampling,
       "format": format
   }
 
+  @st.cache_resource
+  def get_job_queue():
+    # one queue shared by all sessions of this server
+    return JobQueue(root="data/jobs/")
+
+  job_queue = get_job_queue()
 
   generate_button = st.button("Generate Events")
   if generate_button:
-
-      #Step 1:
-      if video_file is not None:
-        #read the video file
-        #video_object = VideoSequence(video_file.getvalue())
-        #saving the uploaded file on the server
-        save_path = "data/original/video_upload/"
-        completeName = os.path.join(save_path, video_file.name)
-        with open(completeName, "wb") as file:
-          file.write(video_file.getvalue())
-        st.success("Uploaded video file saved on the server")
-
-      #Step 2:
-      if upsampling:
-        print("inside upsampling")
-        os.system("python ../upsampling/upsample.py --input_dir=data/original/ --output_dir=data/upsampled --device=cuda:0")
-
-      #Step 3: Event Generation
-      file_path = process_dir(args["output_dir"], args["input_dir"], args)
-
-      #Step 4: Download Option
-      with open(file_path, "rb") as file:
-        btn = st.download_button(label="Download Events", data=file, file_name=os.path.basename(file_path))
-        if btn:
-          st.markdown(':beer::beer::beer::beer::beer::beer::beer::beer::beer::beer::beer:')
+      if video_file is None:
+        st.error("Upload a video file first")
+      else:
+        #Step 1: enqueue (returns immediately if the same video and settings were already processed)
+        st.session_state["job_key"] = job_queue.submit(video_file.name, video_file.getvalue(), settings)
+        st.success("Uploaded video file queued for event generation")
+
+  job_key = st.session_state.get("job_key")
+  if job_key is not None:
+      #Step 2: Progress
+      progress_bar = st.progress(0.0)
+      status_text = st.empty()
+      file_path = job_queue.result(job_key)
+      while file_path is None:
+        status = job_queue.status(job_key)
+        if status["stage"] == "failed":
+          st.error(f"Event generation failed: {status.get('error')}")
+          break
+        progress_bar.progress(status["progress"])
+        status_text.text(f"Status: {status['stage']}")
+        time.sleep(1)
+        file_path = job_queue.result(job_key)
+
+      #Step 3: Download Option
+      if file_path is not None:
+        progress_bar.progress(1.0)
+        status_text.text("Status: done")
+        with open(file_path, "rb") as file:
+          btn = st.download_button(label="Download Events", data=file, file_name=os.path.basename(file_path))
+          if btn:
+            st.markdown(':beer::beer::beer::beer::beer::beer::beer::beer::beer::beer::beer:')
 
 
 
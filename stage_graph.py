@@ -0,0 +1,200 @@
+"""Runs every sequence independently through a chain of stages (e.g. upsample → events).
+
+Each stage has its own pool of workers (threads, or processes for CPU-bound Python code) and
+reads the names of the sequences to process from a bounded queue filled by the previous stage:
+a sequence enters the next stage as soon as it leaves the previous one, and a slow stage makes
+the faster ones wait instead of piling up work in memory.
+
+When a stage has processed a sequence it writes the marker <marker_dir>/<seq>/<stage>.done. A
+marker is only valid if it is newer than the marker of the previous stage, so sequences that were
+already processed are passed through without running the stage again (after a failure only the
+missing work is redone), while sequences whose input was regenerated are processed again. A
+marker can also store a hash of the parameters the stage ran with (params_hash), so that changing
+them makes the stage run again.
+"""
+import concurrent.futures
+import hashlib
+import json
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from pathlib import Path
+
+import tracing
+
+_DONE = object()
+
+
+def marker_path(marker_dir, seq, stage):
+    return Path(marker_dir) / seq / f"{stage}.done"
+
+
+def mark_done(marker_dir, seq, stage, **info):
+    """Marks the stage as completed for the sequence (info is stored in the marker as json)."""
+    path = marker_path(marker_dir, seq, stage)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps(dict(info, finished=time.time())))
+    tmp_path.replace(path)
+
+
+def clear_done(marker_dir, seq, stage):
+    """Removes the marker of the stage, e.g. before the sequence is produced again."""
+    marker_path(marker_dir, seq, stage).unlink(missing_ok=True)
+
+
+def params_hash(params):
+    """Short hash of json serializable parameters, to be stored in a marker as params."""
+    return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+
+def is_done(marker_dir, seq, stage, previous_stage=None, params=None):
+    """Whether the stage is completed for the sequence (and not older than the previous stage).
+
+    If params is given, the marker must have been written with the same params.
+    """
+    path = marker_path(marker_dir, seq, stage)
+    if not path.is_file():
+        return False
+    if params is not None:
+        try:
+            if json.loads(path.read_text()).get("params") != params:
+                return False
+        except (json.JSONDecodeError, AttributeError):
+            return False
+    if previous_stage is None:
+        return True
+    previous = marker_path(marker_dir, seq, previous_stage)
+    return not previous.is_file() or previous.stat().st_mtime <= path.stat().st_mtime
+
+
+def done_sequences(marker_dir, stage):
+    """Names of the sequences with a marker of the stage."""
+    return {path.parent.name for path in Path(marker_dir).glob(f"*/{stage}.done")}
+
+
+def _run_traced(name, fn, seq):
+    # in the worker process, so that the spans of fn are attributed to the sequence
+    with tracing.span(name, seq=seq):
+        fn(seq)
+
+
+class Stage:
+    """A step of the pipeline: fn(seq) processes the sequence seq and raises if it fails.
+
+    With use_processes, fn runs in a pool of num_workers processes (it must be picklable, i.e. a
+    module level function), otherwise in num_workers threads. queue_size bounds the number of
+    sequences waiting for the stage (default: 2 * num_workers).
+    """
+
+    def __init__(self, name, fn, num_workers=1, use_processes=False, queue_size=None):
+        self.name = name
+        self.fn = fn
+        self.num_workers = num_workers
+        self.use_processes = use_processes
+        self.queue_size = queue_size or 2 * num_workers
+
+
+class StageGraph:
+    """Passes the sequences yielded by a source through the stages, in order.
+
+    source_stage is the name of the marker written by whatever produces the sequences (e.g.
+    "render"): the first stage is redone for sequences produced again after it ran.
+    """
+
+    def __init__(self, stages, marker_dir, source_stage=None):
+        self.stages = list(stages)
+        self.marker_dir = Path(marker_dir)
+        self.source_stage = source_stage
+        self.completed = []
+        self.failed = {}
+        self._lock = threading.Lock()
+
+    def _previous_stage(self, index):
+        return self.stages[index - 1].name if index > 0 else self.source_stage
+
+    def _process(self, index, seq, executor):
+        stage = self.stages[index]
+        if is_done(self.marker_dir, seq, stage.name, self._previous_stage(index)):
+            logging.info(f"⏭️  {seq}: {stage.name} già completato")
+            return True
+        logging.info(f"▶️  {seq}: {stage.name}")
+        start = time.perf_counter()
+        try:
+            if executor is not None:
+                executor.submit(_run_traced, stage.name, stage.fn, seq).result()
+            else:
+                _run_traced(stage.name, stage.fn, seq)
+        except Exception as e:
+            logging.error(f"❌ {seq}: {stage.name} fallito: {e}")
+            with self._lock:
+                self.failed[seq] = (stage.name, str(e))
+            return False
+        seconds = time.perf_counter() - start
+        mark_done(self.marker_dir, seq, stage.name, seconds=seconds)
+        logging.info(f"✅ {seq}: {stage.name} completato in {seconds:.1f}s")
+        return True
+
+    def _worker(self, index, inbox, outbox, executor, alive):
+        try:
+            while True:
+                seq = inbox.get()
+                if seq is _DONE:
+                    inbox.put(_DONE)  # for the other workers of the stage
+                    break
+                try:
+                    processed = self._process(index, seq, executor)
+                except Exception as e:
+                    # e.g. the marker could not be written: the sequence fails, the worker goes on
+                    logging.error(f"❌ {seq}: {self.stages[index].name} fallito: {e}")
+                    with self._lock:
+                        self.failed[seq] = (self.stages[index].name, str(e))
+                    continue
+                if processed:
+                    outbox.put(seq)
+        finally:
+            # the next stage (and run()) wait for _DONE from the last worker of the stage
+            with self._lock:
+                alive[index] -= 1
+                last = alive[index] == 0
+            if last:
+                outbox.put(_DONE)
+
+    def run(self, source):
+        """Processes all sequences of source (an iterable of names, it may block while producing them).
+
+        Returns the names of the sequences that completed all stages; the failed ones (and the
+        stage and error) are in self.failed.
+        """
+        queues = [queue.Queue(maxsize=stage.queue_size) for stage in self.stages] + [queue.Queue()]
+        executors = [concurrent.futures.ProcessPoolExecutor(stage.num_workers,
+                                                            mp_context=multiprocessing.get_context("spawn"))
+                     if stage.use_processes else None for stage in self.stages]
+        alive = [stage.num_workers for stage in self.stages]
+        threads = [threading.Thread(target=self._worker, args=(i, queues[i], queues[i + 1], executors[i], alive),
+                                    name=f"{stage.name}-{j}", daemon=True)
+                   for i, stage in enumerate(self.stages) for j in range(stage.num_workers)]
+        for thread in threads:
+            thread.start()
+
+        # the last queue is unbounded, collect its sequences while the source is still producing
+        def collect():
+            while (seq := queues[-1].get()) is not _DONE:
+                self.completed.append(seq)
+        collector = threading.Thread(target=collect, daemon=True)
+        collector.start()
+
+        try:
+            for seq in source:
+                queues[0].put(seq)
+        finally:
+            queues[0].put(_DONE)
+            collector.join()
+            for thread in threads:
+                thread.join()
+            for executor in executors:
+                if executor is not None:
+                    executor.shutdown()
+        return self.completed
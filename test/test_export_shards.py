@@ -0,0 +1,41 @@
+import os
+import sys
+
+import cv2
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from export_shards import ShardReader, decode_sample, export
+
+
+def _write_frames(output_dir, layer, seq, frames, write):
+    img_dir = output_dir / layer / seq / "imgs"
+    img_dir.mkdir(parents=True)
+    for i, frame in enumerate(frames):
+        write(str(img_dir / f"{layer}_{i:05d}.png"), frame)
+
+
+def _write_palette_png(filename, ids):
+    # come kubric.file_io.write_palette_png
+    img = Image.fromarray(ids[:, :, 0], mode="P")
+    img.putpalette([217, 49, 38, 49, 217, 38, 38, 49, 217, 200, 200, 200])
+    img.save(filename)
+
+
+def test_export_read_decode(tmp_path):
+    rng = np.random.default_rng(0)
+    rgb = rng.integers(0, 256, size=(3, 2, 2, 3), dtype=np.uint8)
+    segmentation = np.array([[[0, 1], [2, 3]], [[3, 2], [1, 0]], [[1, 1], [0, 0]]], dtype=np.uint8)[..., None]
+    _write_frames(tmp_path / "output", "rgb", "seq0", rgb,
+                  lambda filename, frame: cv2.imwrite(filename, cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)))
+    _write_frames(tmp_path / "output", "segmentation", "seq0", segmentation, _write_palette_png)
+
+    assert export(tmp_path / "output", tmp_path / "shards") == 1
+    reader = ShardReader(tmp_path / "shards")
+    assert reader.sequences == ["seq0"]
+    for sample in [reader.read_sequence("seq0")] + [sample for _, sample in reader.iter_samples()]:
+        decoded = decode_sample(sample)
+        assert decoded["meta"]["num_frames"] == {"rgb": 3, "segmentation": 3}
+        np.testing.assert_array_equal(decoded["rgb"], rgb)
+        np.testing.assert_array_equal(decoded["segmentation"], segmentation)
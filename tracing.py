@@ -0,0 +1,205 @@
+"""Lightweight performance tracing: timed spans written per process, merged into a Chrome trace.
+
+  with tracing.span("scene_setup", seq="seq3"):
+      ...
+
+  @tracing.traced("event_save")
+  def save(...): ...
+
+  tracing.instrument(KubricSimulator, "run", "physics")  # wraps a method of a class or object
+
+Tracing is off until enable(trace_dir) is called or the environment variable VMR_TRACE_DIR is set,
+which also turns it on in subprocesses and docker containers started with that variable. When it
+is off a span costs a single check. Every process appends its spans to its own
+<trace_dir>/<host>-<pid>.jsonl (one Chrome trace event per line); write_report() merges them into
+trace.json (chrome://tracing or ui.perfetto.dev) and summary.txt, a table of the time spent in each
+span, in total and per sequence. Spans without a seq argument are attributed to the sequence of
+the span with a seq argument that encloses them in the same process.
+"""
+import collections
+import contextlib
+import functools
+import glob
+import inspect
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+ENV_VAR = "VMR_TRACE_DIR"
+TRACE_FILE = "trace.json"
+SUMMARY_FILE = "summary.txt"
+
+_lock = threading.Lock()
+_file = None
+_trace_dir = None
+
+
+def enable(trace_dir):
+    """Starts writing the spans of this process to trace_dir."""
+    global _file, _trace_dir
+    with _lock:
+        if _file is not None:
+            return
+        os.makedirs(trace_dir, exist_ok=True)
+        _trace_dir = trace_dir
+        _file = open(os.path.join(trace_dir, f"{socket.gethostname()}-{os.getpid()}.jsonl"), "a")
+    _write({"name": "process_name", "ph": "M", "pid": os.getpid(),
+            "args": {"name": f"{os.path.basename(sys.argv[0]) or 'python'} ({os.getpid()})"}})
+
+
+def disable():
+    global _file
+    with _lock:
+        if _file is not None:
+            _file.close()
+        _file = None
+
+
+def enabled():
+    return _file is not None
+
+
+def _write(event):
+    line = json.dumps(event) + "\n"
+    with _lock:
+        if _file is not None:
+            _file.write(line)
+            _file.flush()
+
+
+def begin(name, **args):
+    """Starts a span that is ended by end(token); for spans that do not fit in a with block."""
+    if _file is None:
+        return None
+    return name, args, time.time_ns(), time.perf_counter()
+
+
+def end(token, **args):
+    if token is None:
+        return
+    name, begin_args, start_ns, start = token
+    _write({"name": name, "ph": "X", "ts": start_ns / 1000, "dur": (time.perf_counter() - start) * 1e6,
+            "pid": os.getpid(), "tid": threading.get_native_id(), "args": dict(begin_args, **args)})
+
+
+@contextlib.contextmanager
+def span(name, **args):
+    token = begin(name, **args)
+    try:
+        yield
+    finally:
+        end(token)
+
+
+def traced(name=None, **args):
+    """Decorator: every call of the function is a span (named after the function by default)."""
+    def decorator(fn):
+        span_name = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*fn_args, **fn_kwargs):
+            if _file is None:
+                return fn(*fn_args, **fn_kwargs)
+            with span(span_name, **args):
+                return fn(*fn_args, **fn_kwargs)
+        wrapper.__traced__ = True
+        return wrapper
+    return decorator
+
+
+def instrument(obj, attr, name=None, **args):
+    """Replaces the method (or function) obj.attr by a traced version, at most once."""
+    original = getattr(obj, attr)
+    if getattr(original, "__traced__", False):
+        return
+    wrapper = traced(name or attr, **args)(original)
+    if inspect.isclass(obj) and isinstance(inspect.getattr_static(obj, attr), staticmethod):
+        wrapper = staticmethod(wrapper)
+    setattr(obj, attr, wrapper)
+
+
+def _read_events(trace_dir):
+    events = []
+    for path in sorted(glob.glob(os.path.join(trace_dir, "*.jsonl"))):
+        with open(path) as f:
+            events.extend(json.loads(line) for line in f if line.strip())
+    return events
+
+
+def _attribute_sequences(spans):
+    """seq of every span: its own, or the one of the innermost enclosing span with a seq."""
+    owners = collections.defaultdict(list)
+    for event in spans:
+        if "seq" in event["args"]:
+            owners[event["pid"]].append(event)
+    result = []
+    for event in spans:
+        seq = event["args"].get("seq")
+        if seq is None:
+            start, stop = event["ts"], event["ts"] + event["dur"]
+            enclosing = [owner for owner in owners[event["pid"]]
+                         if owner["ts"] <= start and stop <= owner["ts"] + owner["dur"]]
+            # with several sequences at the same time in a process, prefer the same thread
+            same_thread = [owner for owner in enclosing if owner["tid"] == event["tid"]]
+            candidates = same_thread or enclosing
+            if len({owner["args"]["seq"] for owner in candidates}) == 1:
+                seq = min(candidates, key=lambda owner: owner["dur"])["args"]["seq"]
+        result.append(seq)
+    return result
+
+
+def summarize(events):
+    """Table of the number of calls and the time spent in each span, in total and per sequence."""
+    spans = [event for event in events if event.get("ph") == "X"]
+    if not spans:
+        return "No spans recorded\n"
+    wall = (max(e["ts"] + e["dur"] for e in spans) - min(e["ts"] for e in spans)) / 1e6
+    durations = collections.defaultdict(list)
+    per_sequence = collections.defaultdict(lambda: collections.defaultdict(float))
+    for event, seq in zip(spans, _attribute_sequences(spans)):
+        durations[event["name"]].append(event["dur"] / 1e6)
+        if seq is not None:
+            per_sequence[seq][event["name"]] += event["dur"] / 1e6
+
+    lines = [f"Wall time {wall:.2f}s, {len(spans)} spans (times include nested spans)", "",
+             f"{'span':<24} {'calls':>7} {'total [s]':>10} {'mean [ms]':>10} {'max [ms]':>10} {'% wall':>7}"]
+    for name, values in sorted(durations.items(), key=lambda item: -sum(item[1])):
+        total = sum(values)
+        lines.append(f"{name:<24} {len(values):>7} {total:>10.2f} {total / len(values) * 1e3:>10.1f} "
+                     f"{max(values) * 1e3:>10.1f} {100 * total / wall if wall else 0:>7.1f}")
+
+    if per_sequence:
+        names = sorted({name for totals in per_sequence.values() for name in totals},
+                       key=lambda name: -sum(durations[name]))
+        width = max(10, *(len(name) for name in names))
+        lines += ["", "Seconds per sequence", f"{'sequence':<12}" + "".join(f" {name:>{width}}" for name in names)]
+        for seq in sorted(per_sequence, key=lambda s: (len(s), s)):
+            lines.append(f"{seq:<12}" + "".join(f" {per_sequence[seq].get(name, 0.0):>{width}.2f}" for name in names))
+    return "\n".join(lines) + "\n"
+
+
+def write_report(trace_dir=None):
+    """Merges the span files of all processes into trace.json and summary.txt, returns the summary."""
+    trace_dir = trace_dir or _trace_dir or os.environ[ENV_VAR]
+    events = _read_events(trace_dir)
+    with open(os.path.join(trace_dir, TRACE_FILE), "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+    summary = summarize(events)
+    with open(os.path.join(trace_dir, SUMMARY_FILE), "w") as f:
+        f.write(summary)
+    return summary
+
+
+if os.environ.get(ENV_VAR):
+    enable(os.environ[ENV_VAR])
+
+
+if __name__ == "__main__":
+    # rebuild trace.json and summary.txt, e.g. for a generator run started with VMR_TRACE_DIR
+    import argparse
+    parser = argparse.ArgumentParser("Merge the span files of a traced run into trace.json and summary.txt")
+    parser.add_argument("trace_dir", nargs="?", default="output/traces")
+    print(write_report(parser.parse_args().trace_dir), end="")
@@ -1,3 +1,4 @@
+import os
 import logging
 from rpg_vid2e.upsampling.utils import Upsampler
 
@@ -6,7 +7,9 @@ def upsample():
     output_dir = "output/upsampled_rgb"
     # Upsample ALL RGB sequences from the simulation
     logging.info("📈 Avvio upsampling per tutte le sequenze...")
-    upsampler = Upsampler(input_dir="output/rgb", output_dir=output_dir)
+    # con --output_format store i frame RGB sono negli store di output/store
+    input_dir = "output/rgb" if os.path.isdir("output/rgb") else "output/store"
+    upsampler = Upsampler(input_dir=input_dir, output_dir=output_dir)
     upsampler.upsample()
 
 